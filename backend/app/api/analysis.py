@@ -1,60 +1,96 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Union
+from datetime import datetime
 import os
+import json
+import asyncio
+import logging
 
-from app.models.database import get_db
+from app.models.database import get_db, SessionLocal
 from app.models.schemas import (
     AnalysisResponse, AnalysisResult, BatchAnalysisRequest, 
-    PaginatedResponse, AnalysisRecordResponse
+    CursorPageResponse, AnalysisRecordResponse, JobSubmitResponse, BaselineResponse, StatsResponse,
+    AnalysisTraceResponse, VideoAnalysisRequest, VideoAnalysisResponse
 )
 from app.services.analysis_service import analysis_service
+from app.services.job_service import job_service
+from app.services.baseline_service import baseline_service
+from app.services.stats_service import stats_service
+from app.services.video_service import video_service
+from app.services.upload_store import upload_store, UploadRejected
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1", tags=["图片分析"])
 
 
-@router.post("/compare-images", response_model=AnalysisResponse)
+async def _save_uploads(db: Session, *uploads: UploadFile) -> List[str]:
+    """依次流式保存上传文件，任一文件被拒绝时释放已保存的文件"""
+    paths = []
+    try:
+        for upload in uploads:
+            paths.append(await upload_store.save(db, upload))
+    except Exception:
+        for path in paths:
+            upload_store.release(db, path)
+        raise
+    return paths
+
+
+def _release_uploads(db: Session, paths: List[str]):
+    """释放尚未交给分析记录或基准图的上传文件引用"""
+    for path in paths:
+        try:
+            upload_store.release(db, path)
+        except Exception as e:
+            logger.warning("释放上传文件失败: %s, %s", path, e)
+
+
+@router.post("/compare-images", response_model=Union[AnalysisResponse, JobSubmitResponse])
 async def compare_images(
+    response: Response,
     image1: UploadFile = File(..., description="第一张图片"),
     image2: UploadFile = File(..., description="第二张图片"),
     threshold: float = Form(0.8, ge=0.0, le=1.0, description="相似度阈值"),
     enable_alert: bool = Form(True, description="是否启用告警"),
     save_results: bool = Form(True, description="是否保存结果"),
+    async_mode: bool = Form(False, description="异步模式：立即返回任务ID，通过/analysis/{id}查询结果"),
+    latency_budget: Optional[float] = Form(None, gt=0, description="延迟预算（秒），用于决定是否进行二次分析"),
     db: Session = Depends(get_db)
 ):
-    """对比两张图片的差异"""
-    
-    # 验证文件类型
-    allowed_types = ["image/jpeg", "image/png", "image/webp"]
-    if image1.content_type not in allowed_types or image2.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="只支持JPEG、PNG和WebP格式的图片")
+    """对比两张图片的差异
     
-    # 验证文件大小
-    max_size = 10 * 1024 * 1024  # 10MB
-    if image1.size > max_size or image2.size > max_size:
-        raise HTTPException(status_code=400, detail="图片文件大小不能超过10MB")
+    文件格式、大小和像素数由上传存储在流式保存时检查。
+    """
     
+    # 上传文件的引用交给分析记录之前，任何退出路径都释放引用
+    owned: List[str] = []
     try:
-        print(f"接收到文件上传请求")
-        print(f"图片1: {image1.filename}, 大小: {image1.size}, 类型: {image1.content_type}")
-        print(f"图片2: {image2.filename}, 大小: {image2.size}, 类型: {image2.content_type}")
+        # 流式保存上传的文件（内容寻址，相同内容只保存一份）
+        owned = await _save_uploads(db, image1, image2)
+        image1_path, image2_path = owned
         
-        # 保存上传的文件
-        image1_path = analysis_service.save_uploaded_file(image1, image1.filename)
-        image2_path = analysis_service.save_uploaded_file(image2, image2.filename)
-        
-        print(f"文件保存成功:")
-        print(f"图片1路径: {image1_path}")
-        print(f"图片2路径: {image2_path}")
+        # 异步模式：持久化pending记录后立即返回
+        if async_mode:
+            job_id = job_service.submit(db, image1_path, image2_path, threshold, latency_budget)
+            owned = []
+            response.status_code = 202
+            return JobSubmitResponse(
+                status="accepted",
+                job_id=job_id,
+                message="分析任务已提交"
+            )
         
         # 分析图片差异
-        result = analysis_service.analyze_images(image1_path, image2_path, threshold)
+        result = await analysis_service.analyze_images(image1_path, image2_path, threshold, latency_budget)
         
-        # 保存分析记录
+        # 保存分析记录（记录持有上传文件的引用），不保存时在finally中释放文件
         if save_results:
-            analysis_service.save_analysis_record(db, image1_path, image2_path, result)
-        
-        print(f"分析完成，结果: {result}")
+            await analysis_service.save_analysis_record(db, image1_path, image2_path, result)
+            owned = []
         
         return AnalysisResponse(
             status="success",
@@ -62,17 +98,220 @@ async def compare_images(
             message="图片分析完成"
         )
         
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logger.warning("分析过程中出现错误: %s", e)
+        raise HTTPException(status_code=500, detail=f"分析失败: {str(e)}")
+    finally:
+        _release_uploads(db, owned)
+
+
+@router.post("/compare-images/stream")
+async def compare_images_stream(
+    image1: UploadFile = File(..., description="第一张图片"),
+    image2: UploadFile = File(..., description="第二张图片"),
+    threshold: float = Form(0.8, ge=0.0, le=1.0, description="相似度阈值"),
+    save_results: bool = Form(True, description="是否保存结果"),
+    db: Session = Depends(get_db)
+):
+    """流式对比两张图片（Server-Sent Events）
+    
+    事件类型: prescreen、alert（最早的告警级别）、difference（每个差异）、result（最终结果）、error。
+    """
+    
+    try:
+        image1_path, image2_path = await _save_uploads(db, image1, image2)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    def format_event(event: str, data) -> str:
+        return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+    
+    async def generate():
+        # 依赖注入的会话在端点返回后即关闭，响应体在此之后才生成，需要使用自己的会话
+        stream_db = SessionLocal()
+        # 结果保存为记录之前，出错、客户端断开（GeneratorExit）或不保存结果时都释放上传文件的引用
+        owned = [image1_path, image2_path]
+        try:
+            async for event in analysis_service.stream_analyze(image1_path, image2_path, threshold):
+                if event['event'] == 'result' and save_results:
+                    await analysis_service.save_analysis_record(stream_db, image1_path, image2_path, event['data'])
+                    owned = []
+                yield format_event(event['event'], event['data'])
+        except Exception as e:
+            yield format_event("error", {"detail": f"分析失败: {str(e)}"})
+        finally:
+            try:
+                _release_uploads(stream_db, owned)
+            finally:
+                stream_db.close()
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/baselines", response_model=BaselineResponse)
+async def register_baseline(
+    image: UploadFile = File(..., description="基准图"),
+    name: str = Form(..., description="基准图名称"),
+    camera_id: Optional[str] = Form(None, description="摄像头标识"),
+    db: Session = Depends(get_db)
+):
+    """注册基准图，注册时预先计算缩略图、特征、感知哈希和VLM输入"""
+    
+    owned: List[str] = []
+    try:
+        owned = [await upload_store.save(db, image)]
+        baseline = await baseline_service.register(db, owned[0], name, camera_id)
+        # 基准图持有上传文件的引用
+        owned = []
+        return baseline
+        
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"注册基准图失败: {str(e)}")
+    finally:
+        _release_uploads(db, owned)
+
+
+@router.get("/baselines", response_model=List[BaselineResponse])
+async def list_baselines(
+    camera_id: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """获取基准图列表"""
+    return baseline_service.list(db, camera_id)
+
+
+@router.get("/baselines/{baseline_id}", response_model=BaselineResponse)
+async def get_baseline(
+    baseline_id: int,
+    db: Session = Depends(get_db)
+):
+    """获取单个基准图"""
+    
+    baseline = baseline_service.get(db, baseline_id)
+    if not baseline:
+        raise HTTPException(status_code=404, detail="基准图不存在")
+    
+    return baseline
+
+
+@router.delete("/baselines/{baseline_id}")
+async def delete_baseline(
+    baseline_id: int,
+    db: Session = Depends(get_db)
+):
+    """删除基准图及其预计算数据"""
+    
+    baseline = baseline_service.get(db, baseline_id)
+    if not baseline:
+        raise HTTPException(status_code=404, detail="基准图不存在")
+    
+    try:
+        baseline_service.delete(db, baseline)
+        return {"status": "success", "message": "基准图删除成功"}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
+
+
+@router.post("/compare-to-baseline/{baseline_id}", response_model=AnalysisResponse)
+async def compare_to_baseline(
+    baseline_id: int,
+    image: UploadFile = File(..., description="当前画面"),
+    threshold: float = Form(0.8, ge=0.0, le=1.0, description="相似度阈值"),
+    save_results: bool = Form(True, description="是否保存结果"),
+    latency_budget: Optional[float] = Form(None, gt=0, description="延迟预算（秒），用于决定是否进行二次分析"),
+    db: Session = Depends(get_db)
+):
+    """将当前画面与已注册的基准图对比，只需上传当前画面"""
+    
+    baseline = baseline_service.get(db, baseline_id)
+    if not baseline:
+        raise HTTPException(status_code=404, detail="基准图不存在")
+    
+    owned: List[str] = []
+    try:
+        owned = [await upload_store.save(db, image)]
+        image_path = owned[0]
+        baseline_bundle = await baseline_service.get_bundle(baseline)
+        
+        result = await analysis_service.analyze_images(
+            baseline.image_path, image_path, threshold, latency_budget, bundle1=baseline_bundle
+        )
+        
+        if save_results:
+            # 分析记录同时持有基准图文件的引用；保存失败时与本次上传一起释放
+            upload_store.retain(db, baseline.image_path)
+            owned.append(baseline.image_path)
+            await analysis_service.save_analysis_record(db, baseline.image_path, image_path, result)
+            owned = []
+        
+        return AnalysisResponse(
+            status="success",
+            data=result,
+            message="基准图对比完成"
+        )
+        
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
-        print(f"分析过程中出现错误: {str(e)}")
+        logger.warning("基准图对比过程中出现错误: %s", e)
         raise HTTPException(status_code=500, detail=f"分析失败: {str(e)}")
+    finally:
+        _release_uploads(db, owned)
 
 
 @router.post("/batch-analyze")
 async def batch_analyze(
     request: BatchAnalysisRequest,
+    response: Response,
+    stream: bool = False,
+    async_mode: bool = False,
     db: Session = Depends(get_db)
 ):
-    """批量分析图片对"""
+    """批量分析图片对
+    
+    stream=true时以NDJSON格式按完成顺序逐条返回每个图片对的结果，
+    单个图片对失败只会产生一条error记录，不影响其他图片对。
+    async_mode=true时为每个图片对创建一个异步任务并立即返回任务ID列表。
+    """
+    
+    image_pairs = [
+        {"id": pair.id, "image1_path": pair.image1_url, "image2_path": pair.image2_url}
+        for pair in request.image_pairs
+    ]
+    
+    if async_mode:
+        jobs = [
+            {
+                "id": pair["id"],
+                "job_id": job_service.submit(
+                    db, pair["image1_path"], pair["image2_path"], request.options.get("threshold", 0.8),
+                    request.options.get("latency_budget")
+                )
+            }
+            for pair in image_pairs
+        ]
+        response.status_code = 202
+        return {
+            "status": "accepted",
+            "data": jobs,
+            "message": f"已提交 {len(jobs)} 个分析任务"
+        }
+    
+    if stream:
+        async def generate():
+            async for item in analysis_service.iter_batch_analyze(image_pairs, request.options):
+                yield json.dumps(jsonable_encoder(item), ensure_ascii=False) + "\n"
+        
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
     
     try:
         # 验证图片文件是否存在
@@ -83,11 +322,7 @@ async def batch_analyze(
                 raise HTTPException(status_code=400, detail=f"图片文件不存在: {pair.image2_url}")
         
         # 执行批量分析
-        results = analysis_service.batch_analyze(
-            [{"id": pair.id, "image1_path": pair.image1_url, "image2_path": pair.image2_url} 
-             for pair in request.image_pairs],
-            request.options
-        )
+        results = await analysis_service.batch_analyze(image_pairs, request.options)
         
         return {
             "status": "success",
@@ -99,32 +334,103 @@ async def batch_analyze(
         raise HTTPException(status_code=500, detail=f"批量分析失败: {str(e)}")
 
 
-@router.get("/analysis-history", response_model=PaginatedResponse)
+@router.post("/analyze-video", response_model=VideoAnalysisResponse)
+async def analyze_video(request: VideoAnalysisRequest, stream: bool = False):
+    """分析本地视频文件或帧序列目录
+    
+    逐帧计算低成本的变化得分，只把变化事件前后的关键帧送入完整分析流程，返回事件时间线。
+    stream=true时以NDJSON格式按时间顺序逐条返回事件（type=event），最后一条为汇总（type=summary）。
+    """
+    options = request.model_dump(exclude={"source"}, exclude_none=True)
+    if not os.path.exists(request.source):
+        raise HTTPException(status_code=400, detail=f"视频文件或帧目录不存在: {request.source}")
+    
+    if stream:
+        async def generate():
+            try:
+                async for item in video_service.iter_analyze(request.source, options):
+                    yield json.dumps(jsonable_encoder(item), ensure_ascii=False) + "\n"
+            except Exception as e:
+                logger.warning("视频分析失败: %s", e)
+                yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+        
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    
+    try:
+        timeline = await video_service.analyze(request.source, options)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.warning("视频分析失败: %s", e)
+        raise HTTPException(status_code=500, detail=f"视频分析失败: {str(e)}")
+    
+    return VideoAnalysisResponse(
+        status="success",
+        data=timeline,
+        message=f"视频分析完成，检测到 {timeline['events']} 个变化事件"
+    )
+
+
+@router.get("/analysis-history", response_model=CursorPageResponse)
 async def get_analysis_history(
-    page: int = 1,
     limit: int = 20,
+    cursor: Optional[str] = None,
+    alert_level: Optional[str] = None,
+    status: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
     db: Session = Depends(get_db)
 ):
-    """获取分析历史记录"""
+    """获取分析历史记录
     
-    if page < 1 or limit < 1 or limit > 100:
+    按分析时间倒序分页，下一页传入上一页返回的next_cursor。
+    可按告警级别、状态和时间范围 [start_time, end_time) 过滤。
+    """
+    
+    if limit < 1 or limit > 100:
         raise HTTPException(status_code=400, detail="分页参数无效")
     
     try:
-        result = analysis_service.get_analysis_history(db, page, limit)
+        result = analysis_service.get_analysis_history(
+            db, limit, cursor, alert_level, status, start_time, end_time
+        )
         
-        return PaginatedResponse(
-            items=result["items"],
+        return CursorPageResponse(
+            items=[AnalysisRecordResponse.model_validate(record) for record in result["items"]],
+            next_cursor=result["next_cursor"],
             total=result["total"],
-            page=result["page"],
-            limit=result["limit"],
-            pages=result["pages"]
+            limit=result["limit"]
         )
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取历史记录失败: {str(e)}")
 
 
+@router.get("/stats", response_model=StatsResponse)
+async def get_stats(
+    granularity: str = "hour",
+    dimension: str = "alert_level",
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    key: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """获取预聚合统计
+    
+    按小时或天（granularity）统计各告警级别或差异类型（dimension）的数量，
+    key可指定单个告警级别或差异类型，如 dimension=difference_type&key=person_detected。
+    """
+    
+    try:
+        return stats_service.get_stats(db, granularity, dimension, start_time, end_time, key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取统计失败: {str(e)}")
+
+
 @router.get("/analysis/{record_id}", response_model=AnalysisRecordResponse)
 async def get_analysis_record(
     record_id: int,
@@ -141,6 +447,57 @@ async def get_analysis_record(
     return record
 
 
+@router.get("/analysis/{record_id}/wait", response_model=AnalysisRecordResponse)
+async def wait_analysis_record(
+    record_id: int,
+    timeout: float = 30.0,
+    db: Session = Depends(get_db)
+):
+    """等待异步分析任务完成（长轮询），超时后返回记录的当前状态"""
+    
+    from app.models.database import AnalysisRecord
+    
+    if timeout < 0 or timeout > 300:
+        raise HTTPException(status_code=400, detail="超时时间必须在0到300秒之间")
+    
+    record = db.query(AnalysisRecord).filter(AnalysisRecord.id == record_id).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="分析记录不存在")
+    
+    if record.status in ("pending", "processing"):
+        await job_service.wait(record_id, timeout)
+        db.refresh(record)
+    
+    return record
+
+
+@router.get("/analysis/{record_id}/trace", response_model=AnalysisTraceResponse)
+async def get_analysis_trace(
+    record_id: int,
+    db: Session = Depends(get_db)
+):
+    """获取分析记录的追踪数据（各阶段、各指标和VLM调用的耗时）
+    
+    只有被采样或耗时超过慢分析阈值的记录保存了追踪。
+    """
+    
+    from app.models.database import AnalysisTrace
+    
+    row = db.query(AnalysisTrace).filter(AnalysisTrace.record_id == record_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="该记录没有追踪数据")
+    
+    trace = json.loads(row.trace)
+    return AnalysisTraceResponse(
+        record_id=record_id,
+        trace_id=trace["trace_id"],
+        started_at=datetime.utcfromtimestamp(trace["started_at"]),
+        duration_ms=trace["duration_ms"],
+        reason=trace["reason"],
+        spans=trace["spans"]
+    )
+
+
 @router.delete("/analysis/{record_id}")
 async def delete_analysis_record(
     record_id: int,
@@ -148,40 +505,69 @@ async def delete_analysis_record(
 ):
     """删除分析记录"""
     
-    from app.models.database import AnalysisRecord
+    from app.models.database import AnalysisRecord, AnalysisTrace
     
     record = db.query(AnalysisRecord).filter(AnalysisRecord.id == record_id).first()
     if not record:
         raise HTTPException(status_code=404, detail="分析记录不存在")
     
     try:
-        # 删除关联的图片文件
-        if os.path.exists(record.image1_path):
-            os.remove(record.image1_path)
-        if os.path.exists(record.image2_path):
-            os.remove(record.image2_path)
+        image_paths = (record.image1_path, record.image2_path)
         
-        # 删除数据库记录
+        # 删除数据库记录，同时扣减统计并删除差异明细和追踪
+        stats_service.unindex_record(db, record)
+        db.query(AnalysisTrace).filter(AnalysisTrace.record_id == record.id).delete(synchronize_session=False)
         db.delete(record)
         db.commit()
         
+        # 释放关联图片文件的引用，没有其他引用时删除文件
+        for image_path in image_paths:
+            upload_store.release(db, image_path)
+        
         return {"status": "success", "message": "记录删除成功"}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
 
 
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """获取VLM结果缓存统计"""
+    # 缓存统计会查询SQLite，放到线程中执行以免阻塞事件循环
+    stats = await asyncio.to_thread(analysis_service.get_cache_stats)
+    return {"status": "success", "data": stats}
+
+
+@router.delete("/cache")
+async def invalidate_cache(
+    image_hash: Optional[str] = None,
+    prompt_version: Optional[str] = None,
+    model: Optional[str] = None
+):
+    """使VLM结果缓存失效（不传参数时清空全部缓存）"""
+    
+    try:
+        deleted = await asyncio.to_thread(analysis_service.invalidate_cache, image_hash, prompt_version, model)
+        return {"status": "success", "message": f"已清除 {deleted} 条缓存"}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"清除缓存失败: {str(e)}")
+
+
 @router.get("/health")
 async def health_check():
     """健康检查"""
     
     try:
         # 测试Ollama连接
-        ollama_connected = analysis_service.test_ollama_connection()
+        ollama_connected = await analysis_service.test_ollama_connection()
         
         return {
             "status": "healthy",
             "ollama_connected": ollama_connected,
+            "ollama_endpoints": analysis_service.get_ollama_endpoints(),
+            "ollama_models": analysis_service.get_ollama_models(),
+            "vlm_circuit": analysis_service.get_vlm_circuit(),
             "timestamp": "2024-01-15T10:30:00Z"
         }
         
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import List
+from typing import List, Dict, Any
 import os
 
 
@@ -8,20 +8,134 @@ class Settings(BaseSettings):
     app_name: str = "图片对比分析系统"
     debug: bool = True
     secret_key: str = "your-secret-key-change-in-production"
+    log_level: str = "INFO"  # DEBUG时输出各分析阶段的详细日志
+    
+    # 分析追踪配置
+    trace_mode: str = "sampled"  # off, sampled（按比例采样，慢分析总是保留）, always
+    trace_sample_rate: float = 0.05
+    trace_slow_threshold: float = 10.0  # 总耗时超过该值（秒）的分析总是保留追踪
     
     # 数据库配置
     database_url: str = "sqlite:///./image_comparison.db"
+    history_count_ttl: float = 30.0  # 历史记录总数缓存时间（秒）
+    
+    # SQLite配置
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"  # WAL模式下NORMAL只在检查点时同步磁盘
+    sqlite_busy_timeout: int = 5000  # 等待写锁的时间（毫秒）
+    sqlite_cache_size: int = -65536  # 负数表示KB，即64MB
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    
+    # 分析记录持久化配置
+    persist_mode: str = "write_behind"  # write_behind（后台批量写入）, sync（请求内同步提交）
+    persist_batch_size: int = 200  # 单个事务最多写入的记录数
+    persist_flush_interval: float = 0.2  # 批次凑满前最多等待的时间（秒）
+    persist_queue_size: int = 10000  # 队列满时退化为同步写入
+    persist_journal_path: str = "./persist_journal.jsonl"  # 写入前先追加到日志（每个工作进程使用<路径>.<PID>），崩溃后启动时重放；为空时不记录
+    persist_journal_fsync: bool = False  # 每次追加日志后fsync（更强的持久性，更高的延迟）
     
     # Ollama API配置
     ollama_base_url: str = "http://192.168.31.80:11434"
     # ollama_model_name: str = "qwen2.5vl:32b"
     ollama_model_name: str = "qwen2.5vl:7b-fp16"
+    ollama_timeout: float = 600.0  # 单次推理超时（秒）
+    ollama_connect_timeout: float = 10.0
+    ollama_max_connections: int = 32  # 连接池上限，即同时在途的VLM请求数
+    ollama_max_keepalive_connections: int = 16
+    ollama_keepalive_expiry: float = 60.0
+    # 多节点推理池，JSON列表：[{"url": "http://gpu1:11434", "capacity": 4, "models": ["qwen2.5vl:7b-fp16"]}]
+    # capacity为节点同时处理的请求数（默认ollama_max_connections），models省略时由健康检查获取；为空时只使用ollama_base_url
+    ollama_endpoints: List[Dict[str, Any]] = []
+    ollama_routing: str = "least_outstanding"  # least_outstanding（在途请求最少）, ewma（按延迟EWMA加权）
+    ollama_health_interval: float = 15.0  # 后台健康检查间隔（秒），0表示不检查
+    ollama_eject_failures: int = 3  # 节点连续失败达到该次数后暂停分配请求
+    ollama_eject_seconds: float = 30.0  # 剔除后的冷却时间（秒），之后重新检查或试探
+    # 模型常驻：keep_alive随每个请求发送（如30m，纯数字为秒，-1表示永久常驻）
+    ollama_keep_alive: str = "30m"
+    ollama_warmup_models: List[str] = []  # 启动时预热并保持常驻的模型，为空时使用ollama_model_name
+    ollama_model_check_interval: float = 60.0  # 检查模型是否被卸载的间隔（秒），0表示只在启动时预热
+    
+    # VLM熔断器配置（Ollama整体不可用或过慢时快速失败，返回仅基于本地指标的降级结果）
+    vlm_breaker_enabled: bool = True
+    vlm_breaker_window: float = 60.0  # 统计失败率的滑动窗口（秒）
+    vlm_breaker_min_calls: int = 5  # 窗口内调用数达到该值才会判断是否打开
+    vlm_breaker_failure_rate: float = 0.5  # 失败率达到该值时打开
+    vlm_breaker_slow_call_seconds: float = 60.0  # 耗时超过该值（秒）的调用视为慢调用
+    vlm_breaker_slow_call_rate: float = 0.8  # 慢调用比例达到该值时打开
+    vlm_breaker_open_seconds: float = 30.0  # 打开后快速失败的时间（秒），之后放行试探调用
+    vlm_breaker_half_open_calls: int = 1  # 半开状态下的试探调用数，全部成功后关闭
+    vlm_breaker_timeout_factor: float = 3.0  # 启用熔断时单次调用超时不超过慢调用阈值的该倍数（0表示不限制）
     
     # 文件上传配置
     upload_dir: str = "./uploads"
+    baseline_dir: str = "./baselines"  # 基准图预计算数据目录
+    baseline_cache_size: int = 32  # 内存中保留的基准图数据包数量
     max_file_size: int = 10 * 1024 * 1024  # 10MB
+    max_image_pixels: int = 40_000_000  # 单张图片最大像素数（根据文件头检查）
+    upload_chunk_size: int = 256 * 1024  # 上传分块写入大小
     allowed_image_types: List[str] = ["image/jpeg", "image/png", "image/webp"]
     
+    # VLM结果缓存配置
+    vlm_cache_enabled: bool = True
+    vlm_cache_path: str = "./vlm_cache.db"
+    vlm_cache_ttl: float = 7 * 24 * 3600  # 缓存有效期（秒），0表示不过期
+    vlm_cache_max_entries: int = 10000
+    
+    # 预筛选配置（决定图片对是否需要发送给VLM）
+    prescreen_policy: str = "conservative"  # off, conservative, aggressive
+    prescreen_hash_threshold: float = 0.08  # 哈希距离不超过该值视为相同
+    prescreen_hash_change_threshold: float = 0.3  # 哈希距离达到该值直接判定有变化
+    prescreen_max_side: int = 512  # 分块检测使用的图片最长边
+    prescreen_tile_size: int = 16
+    prescreen_tile_threshold: float = 10.0  # 块平均灰度差的最低阈值
+    prescreen_noise_k: float = 4.0  # 噪声底 = 中位数 + k * MAD
+    prescreen_max_changed_tiles: int = 0  # 允许的变化块数量
+    
+    # 并发配置
+    cpu_workers: int = 0  # CPU工作池线程数，0表示按CPU核数自动确定
+    cpu_pool_mode: str = "thread"  # thread, process（图片解码、缩略图、特征统计和哈希在子进程中执行，像素经共享内存传回）
+    cpu_process_workers: int = 0  # process模式下的进程数，0表示按CPU核数自动确定
+    batch_concurrency: int = 8  # 批量分析默认同时处理的图片对数量
+    batch_max_concurrency: int = 64  # 单次批量请求允许的最大并发
+    job_workers: int = 4  # 异步任务模式下同时执行的分析数量
+    analysis_dedup_enabled: bool = True  # 合并图片内容和参数都相同的并发分析，只计算一次
+    
+    # 相似度指标配置
+    similarity_metrics: str = "mse,psnr,ssim,ms_ssim,histogram,edge"  # 启用的指标
+    similarity_metric_weights: str = "mse:0.1,ssim:0.3,ms_ssim:0.2,histogram:0.2,edge:0.2"  # 基础相似度权重
+    
+    # 变化区域定位配置
+    localization_mode: str = "composite"  # off（发送整图）, crops（逐区域裁剪图）, composite（前后对照拼接图）
+    localization_max_regions: int = 4  # 区域数量超过该值时退回整图分析
+    localization_max_area_ratio: float = 0.5  # 区域总面积占比超过该值时退回整图分析
+    localization_padding_tiles: int = 1  # 裁剪时在变化块外扩展的块数
+    localization_crop_side: int = 512  # 单个裁剪图的最长边
+    
+    # 二次分析升级策略配置
+    escalation_policy: str = "budgeted"  # never, similarity（原有行为）, budgeted
+    analysis_latency_budget: float = 0.0  # 单次分析的默认延迟预算（秒），0表示不限
+    escalation_confidence_threshold: float = 0.6  # 差异最高置信度低于该值时升级
+    escalation_prescreen_confidence: float = 0.8  # 预筛选确信有变化但模型未报告差异时升级
+    escalation_budget_margin: float = 1.2  # 剩余预算需达到预估推理耗时的倍数
+    
+    # 视频/帧序列分析配置
+    video_sample_fps: float = 2.0  # 计算变化得分的采样帧率
+    video_frame_dir_fps: float = 1.0  # 帧序列目录的帧率（用于计算时间戳）
+    video_change_threshold: float = 12.0  # 相邻采样帧变化得分（最大分块平均亮度差，0-255）达到该值视为变化
+    video_event_gap: float = 2.0  # 连续低于阈值多少秒后认为事件结束
+    video_max_event_seconds: float = 60.0  # 单个事件的最长时长，超过时强制分段
+    video_max_events: int = 50  # 单个视频最多送入完整分析的事件数
+    video_score_side: int = 96  # 计算变化得分时缩小到的最长边
+    
+    # 图片解码配置
+    image_decode_max_side: int = 1920  # 解码后的最长边，超过时使用draft/缩放解码
+    
+    # VLM输入预处理配置
+    vlm_max_side: int = 1024  # 发送给VLM的图片最长边，0表示不缩放（不超过解码尺寸）
+    vlm_image_format: str = "JPEG"  # JPEG, PNG, WEBP, original（original且不缩放时发送原始文件）
+    vlm_image_quality: int = 85
+    vlm_grayscale: bool = False
+    
     # CORS配置
     allowed_hosts: List[str] = ["localhost", "127.0.0.1", "192.158.31.80"]
     
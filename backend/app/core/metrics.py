@@ -0,0 +1,345 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+# 延迟直方图的默认分桶（秒），覆盖从毫秒级的本地阶段到数十秒的VLM推理
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 请求体大小分桶（字节）
+SIZE_BUCKETS = (16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类：按标签值组合保存子指标，首次出现时创建"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """只增计数器"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        self.labels(**labels).inc(amount)
+
+    def _samples(self):
+        return [("", _format_labels(self.labelnames, key), child.value)
+                for key, child in list(self._children.items())]
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值；无标签的Gauge可以绑定函数，在导出时取值"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        self.labels(**labels).inc(amount)
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.labels(**labels).dec(amount)
+
+    def set(self, value: float, **labels: str):
+        self.labels(**labels).set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    @contextmanager
+    def track_inprogress(self, **labels: str):
+        child = self.labels(**labels)
+        child.inc()
+        try:
+            yield
+        finally:
+            child.dec()
+
+    def _samples(self):
+        if self._function is not None:
+            return [("", "", float(self._function()))]
+        return [("", _format_labels(self.labelnames, key), child.value)
+                for key, child in list(self._children.items())]
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum", "_lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)  # 最后一格为+Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    """分桶直方图（导出为累计计数）"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.upper_bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float, **labels: str):
+        self.labels(**labels).observe(value)
+
+    def time(self, **labels: str):
+        """计时上下文管理器，退出时记录耗时（秒）"""
+        return self.labels(**labels).time()
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Tuple[List[int], float]]:
+        """各标签组合的 (分桶计数（非累计，最后一格为+Inf）, 总和)"""
+        snapshot = {}
+        for key, child in list(self._children.items()):
+            with child._lock:
+                snapshot[key] = (list(child.counts), child.sum)
+        return snapshot
+
+    def _samples(self):
+        samples = []
+        for key, (counts, total) in self.snapshot().items():
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                samples.append(("_bucket", _format_labels(self.labelnames, key, le), cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """指标注册表，按Prometheus文本格式导出"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标名称重复: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI中间件：统计进行中的HTTP请求数和各路由的请求耗时"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            # 使用路由模板而不是实际路径，避免记录ID等造成标签数量膨胀
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, method=scope["method"], route=route, status=str(status[0])
+            )
+
+
+# 创建全局注册表和指标
+registry = MetricsRegistry()
+
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "进行中的HTTP请求数"
+)
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "HTTP请求耗时（秒，流式响应包含整个流）", ("method", "route", "status")
+)
+ANALYSIS_IN_FLIGHT = registry.gauge(
+    "analysis_in_flight", "进行中的图片分析数", ("mode",)
+)
+ANALYSIS_SECONDS = registry.histogram(
+    "analysis_duration_seconds", "单次图片分析总耗时（秒）", ("mode", "outcome")
+)
+ANALYSIS_DEDUP = registry.counter(
+    "analysis_dedup_total", "同步分析的合并情况（role=joined表示复用了进行中的相同分析）", ("role",)
+)
+ANALYSIS_STAGE_SECONDS = registry.histogram(
+    "analysis_stage_duration_seconds", "图片分析各阶段耗时（秒）", ("stage",)
+)
+PRESCREEN_DECISIONS = registry.counter(
+    "prescreen_decisions_total", "预筛选决定次数（decision=skip表示未调用VLM）", ("decision", "tier")
+)
+VLM_REQUEST_SECONDS = registry.histogram(
+    "vlm_request_duration_seconds", "Ollama推理请求耗时（秒）", ("mode", "outcome")
+)
+VLM_PAYLOAD_BYTES = registry.histogram(
+    "vlm_request_payload_bytes", "发送给Ollama的图片和提示词大小（字节）", ("mode",), SIZE_BUCKETS
+)
+OLLAMA_ENDPOINT_IN_FLIGHT = registry.gauge(
+    "ollama_endpoint_in_flight", "各Ollama节点的在途请求数", ("endpoint",)
+)
+OLLAMA_ENDPOINT_HEALTHY = registry.gauge(
+    "ollama_endpoint_healthy", "Ollama节点是否可分配请求（1可用，0已剔除）", ("endpoint",)
+)
+OLLAMA_ENDPOINT_REQUESTS = registry.counter(
+    "ollama_endpoint_requests_total", "各Ollama节点的请求数（outcome=failure计入节点失败）", ("endpoint", "outcome")
+)
+OLLAMA_ENDPOINT_SECONDS = registry.histogram(
+    "ollama_endpoint_request_duration_seconds", "各Ollama节点的请求耗时（秒）", ("endpoint",)
+)
+OLLAMA_ENDPOINT_EJECTIONS = registry.counter(
+    "ollama_endpoint_ejections_total", "Ollama节点被剔除的次数", ("endpoint",)
+)
+OLLAMA_MODEL_LOADED = registry.gauge(
+    "ollama_model_loaded", "模型是否常驻在节点显存中（1已加载）", ("endpoint", "model")
+)
+OLLAMA_MODEL_LOAD_SECONDS = registry.histogram(
+    "ollama_model_load_duration_seconds", "模型加载耗时（秒，trigger=request表示由推理请求承担的冷加载）",
+    ("endpoint", "model", "trigger")
+)
+OLLAMA_MODEL_WARMUPS = registry.counter(
+    "ollama_model_warmups_total", "模型预热请求数", ("endpoint", "model", "outcome")
+)
+VLM_CIRCUIT_STATE = registry.gauge(
+    "vlm_circuit_state", "VLM熔断器当前状态（当前状态为1）", ("circuit", "state")
+)
+VLM_CIRCUIT_TRANSITIONS = registry.counter(
+    "vlm_circuit_transitions_total", "VLM熔断器状态切换次数", ("circuit", "state")
+)
+VLM_CIRCUIT_REJECTIONS = registry.counter(
+    "vlm_circuit_rejections_total", "熔断器打开期间被立即拒绝的VLM调用数", ("circuit",)
+)
+VIDEO_FRAMES_SCANNED = registry.counter(
+    "video_frames_scanned_total", "视频分析中解码并计算变化得分的帧数"
+)
+VIDEO_EVENTS = registry.counter(
+    "video_events_total", "视频中检测到的变化事件数（outcome=skipped表示超过事件上限未分析）", ("outcome",)
+)
+CACHE_REQUESTS = registry.counter(
+    "cache_requests_total", "缓存查询次数", ("cache", "result")
+)
+DB_WRITE_SECONDS = registry.histogram(
+    "db_write_duration_seconds", "分析记录写入数据库的事务耗时（秒）", ("operation",)
+)
+DB_WRITE_RECORDS = registry.counter(
+    "db_write_records_total", "写入数据库的分析记录数", ("operation",)
+)
+PERSIST_QUEUE_DEPTH = registry.gauge(
+    "persist_queue_depth", "后台写入队列中等待提交的分析记录数"
+)
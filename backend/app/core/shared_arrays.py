@@ -0,0 +1,55 @@
+from multiprocessing import shared_memory
+from typing import Dict, Any
+import numpy as np
+
+
+def _aligned(offset: int, alignment: int = 64) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def export_arrays(arrays: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """把一组数组写入一块新的共享内存，返回可跨进程传递的描述（名称、各数组的形状、类型和偏移）
+
+    由接收方调用import_arrays读取并释放；写入失败时立即释放。
+    """
+    layout = {}
+    size = 0
+    for name, array in arrays.items():
+        offset = _aligned(size)
+        layout[name] = (array.shape, array.dtype.str, offset)
+        size = offset + array.nbytes
+
+    segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        for name, array in arrays.items():
+            shape, dtype, offset = layout[name]
+            np.ndarray(shape, dtype, buffer=segment.buf, offset=offset)[...] = array
+    except BaseException:
+        segment.close()
+        segment.unlink()
+        raise
+    segment.close()
+    return {"name": segment.name, "layout": layout}
+
+
+def import_arrays(descriptor: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """读取export_arrays写入的数组（复制到本进程内存）并释放共享内存"""
+    segment = shared_memory.SharedMemory(name=descriptor["name"])
+    try:
+        return {
+            name: np.ndarray(shape, dtype, buffer=segment.buf, offset=offset).copy()
+            for name, (shape, dtype, offset) in descriptor["layout"].items()
+        }
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+def discard_arrays(descriptor: Dict[str, Any]):
+    """释放未被读取的共享内存（如接收方已取消）"""
+    try:
+        segment = shared_memory.SharedMemory(name=descriptor["name"])
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
@@ -0,0 +1,55 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    __slots__ = ("task", "waiters", "joined")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.joined = 0
+
+
+class SingleFlight:
+    """合并相同键的并发调用：同一时刻每个键只执行一次，其余调用等待并共享结果
+
+    计算在独立的任务中执行，某个调用方被取消（如客户端断开、请求超时）不影响其他等待者；
+    所有等待者都取消后才取消计算。计算结束后键立即移除，之后的调用重新执行。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool, bool]:
+        """返回 (结果, 是否加入了已在执行的计算, 结果是否被多个调用方共享)
+
+        结果被共享时调用方不应原地修改结果对象。
+        """
+        call = self._calls.get(key)
+        joined = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            # 先于等待者的回调注册：计算结束后不会再有新的调用加入
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            call.joined += 1
+
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done() and call.waiters == 1:
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+        return result, joined, call.joined > 0
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,160 @@
+import time
+import uuid
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+
+
+TRACE_MODES = ("off", "sampled", "always")
+
+# 当前的 (trace, 父span编号)；CPU工作池中执行的函数通过复制的上下文继承
+_current: contextvars.ContextVar = contextvars.ContextVar("analysis_trace", default=None)
+
+if settings.trace_mode not in TRACE_MODES:
+    raise ValueError(f"未知的追踪模式: {settings.trace_mode}")
+
+
+class Span:
+    """一个计时区间，结束前可以补充属性"""
+
+    __slots__ = ("trace", "record", "_start")
+
+    def __init__(self, trace: "Trace", record: Dict[str, Any]):
+        self.trace = trace
+        self.record = record
+        self._start = time.perf_counter()
+
+    def set(self, **attrs: Any):
+        self.record["attrs"].update(attrs)
+
+    def end(self):
+        if self.record["duration_ms"] is None:
+            self.record["duration_ms"] = round((time.perf_counter() - self._start) * 1000, 3)
+
+
+class _NoopSpan:
+    """未采集追踪时使用，所有操作为空"""
+
+    def set(self, **attrs: Any):
+        pass
+
+    def end(self):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """单次分析的追踪记录
+
+    各阶段的span按开始顺序保存，start_ms为相对追踪开始的偏移，parent为父span编号。
+    采样模式下每次分析都会采集（开销很小），结束时只保留被采样中或耗时超过阈值的追踪。
+    """
+
+    def __init__(self, sampled: bool):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self.sampled = sampled
+        self._origin = time.perf_counter()
+        self._spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, parent: Optional[int], attrs: Dict[str, Any]) -> Span:
+        record = {
+            "id": 0,
+            "parent": parent,
+            "name": name,
+            "start_ms": round((time.perf_counter() - self._origin) * 1000, 3),
+            "duration_ms": None,
+            "attrs": attrs
+        }
+        with self._lock:
+            record["id"] = len(self._spans)
+            self._spans.append(record)
+        return Span(self, record)
+
+    def export(self, duration: float) -> Optional[Dict[str, Any]]:
+        """结束追踪，需要保留时返回可JSON序列化的字典，否则返回None"""
+        if settings.trace_mode == "always":
+            reason = "always"
+        elif duration >= settings.trace_slow_threshold:
+            reason = "slow"
+        elif self.sampled:
+            reason = "sampled"
+        else:
+            return None
+        return {
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "duration_ms": round(duration * 1000, 3),
+            "reason": reason,
+            "spans": self._spans
+        }
+
+
+def start_trace() -> Tuple[Optional[Trace], Optional[contextvars.Token]]:
+    """开始一次分析的追踪，返回 (trace, token)，结束时调用end_trace(token)"""
+    if settings.trace_mode == "off":
+        return None, None
+    sampled = settings.trace_mode == "always" or random.random() < settings.trace_sample_rate
+    trace = Trace(sampled)
+    return trace, _current.set((trace, None))
+
+
+def end_trace(token: Optional[contextvars.Token]):
+    if token is not None:
+        _current.reset(token)
+
+
+def start_span(name: str, **attrs: Any):
+    """开始一个不改变当前上下文的span（需手动调用end），用于跨越yield的区间"""
+    state = _current.get()
+    if state is None:
+        return _NOOP_SPAN
+    trace, parent = state
+    return trace.start_span(name, parent, attrs)
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """记录一个span，其中开始的span作为它的子span"""
+    state = _current.get()
+    if state is None:
+        yield _NOOP_SPAN
+        return
+    trace, parent = state
+    current = trace.start_span(name, parent, attrs)
+    token = _current.set((trace, current.record["id"]))
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=str(e))
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+def open_detached_span(trace: Dict[str, Any], name: str, **attrs: Any):
+    """在已导出的追踪中追加一个从现在开始的span（如等待后台写入），由close_detached_span结束"""
+    trace["spans"].append({
+        "id": len(trace["spans"]),
+        "parent": None,
+        "name": name,
+        "start_ms": round((time.time() - trace["started_at"]) * 1000, 3),
+        "duration_ms": None,
+        "attrs": attrs
+    })
+
+
+def close_detached_span(trace: Dict[str, Any], name: str, **attrs: Any):
+    for record in reversed(trace["spans"]):
+        if record["name"] == name and record["duration_ms"] is None:
+            elapsed = (time.time() - trace["started_at"]) * 1000 - record["start_ms"]
+            record["duration_ms"] = round(elapsed, 3)
+            record["attrs"].update(attrs)
+            return
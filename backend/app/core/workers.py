@@ -0,0 +1,81 @@
+import asyncio
+import functools
+import contextvars
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Optional
+from app.core.config import settings
+
+
+CPU_POOL_MODES = ("thread", "process")
+
+if settings.cpu_pool_mode not in CPU_POOL_MODES:
+    raise ValueError(f"未知的CPU工作池模式: {settings.cpu_pool_mode}")
+
+# CPU密集型阶段（解码、特征统计、哈希等）使用的工作池
+_executor: Optional[ThreadPoolExecutor] = None
+# process模式下解码等持有GIL较多的阶段使用的进程池
+_process_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """获取CPU工作池（首次使用时创建）"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.cpu_workers or None,
+            thread_name_prefix="cpu-worker"
+        )
+    return _executor
+
+
+async def run_cpu(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在CPU工作池中执行同步函数，不阻塞事件循环（函数在复制的上下文中执行，可继承当前追踪）"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_cpu_executor(), context.run, functools.partial(func, *args, **kwargs))
+
+
+def process_pool_enabled() -> bool:
+    return settings.cpu_pool_mode == "process"
+
+
+def get_process_executor() -> ProcessPoolExecutor:
+    """获取CPU进程池（首次使用时创建）；使用spawn启动，子进程不继承事件循环和线程状态"""
+    global _process_executor
+    if _process_executor is None:
+        _process_executor = ProcessPoolExecutor(
+            max_workers=settings.cpu_process_workers or None,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_executor
+
+
+async def run_process(func: Callable[..., Any], *args,
+                      on_abandoned: Optional[Callable[[Any], None]] = None) -> Any:
+    """在CPU进程池中执行可pickle的模块级函数
+
+    参数和返回值经pickle传递，大数组应通过共享内存传递。调用方取消时子进程中的函数仍会执行完，
+    on_abandoned在其结果被丢弃时调用（用于释放结果中引用的共享内存等资源）。
+    """
+    future = get_process_executor().submit(func, *args)
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        if on_abandoned is not None:
+            def release(done: Future):
+                if not done.cancelled() and done.exception() is None:
+                    on_abandoned(done.result())
+            future.add_done_callback(release)
+        raise
+
+
+def shutdown_workers():
+    """关闭CPU工作池和进程池"""
+    global _executor, _process_executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    if _process_executor is not None:
+        _process_executor.shutdown(wait=False, cancel_futures=True)
+        _process_executor = None
@@ -1,15 +1,35 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Text, Boolean
+from sqlalchemy import (
+    create_engine, event, Column, Integer, String, DateTime, Float, Text, Boolean, Index, ForeignKey,
+    UniqueConstraint, inspect, text
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import logging
 from datetime import datetime
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
 # 创建数据库引擎
 engine = create_engine(
     settings.database_url,
     connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {}
 )
 
+
+if "sqlite" in settings.database_url:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """每个新连接应用SQLite pragma（WAL模式下读写互不阻塞）"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout)}")
+        cursor.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -26,11 +46,100 @@ class AnalysisRecord(Base):
     image2_path = Column(String, nullable=False)
     similarity_score = Column(Float, nullable=True)
     differences = Column(Text, nullable=True)  # JSON格式存储差异信息
-    alert_level = Column(String, nullable=True)  # info, warning, error
-    analysis_time = Column(DateTime, default=datetime.utcnow)
+    alert_level = Column(String, nullable=True, index=True)  # info, warning, error
+    analysis_time = Column(DateTime, default=datetime.utcnow, index=True)
     processing_time = Column(Float, nullable=True)  # 处理时间（秒）
-    status = Column(String, default="completed")  # pending, processing, completed, failed
+    degraded = Column(Boolean, default=False)  # VLM不可用时仅基于本地指标的降级结果
+    status = Column(String, default="completed", index=True)  # pending, processing, completed, failed
     error_message = Column(Text, nullable=True)
+    write_key = Column(String, nullable=True, unique=True, index=True)  # 异步写入的幂等键，用于崩溃后重放日志去重
+    threshold = Column(Float, nullable=True)  # 异步任务的相似度阈值，重启后恢复任务时使用
+    latency_budget = Column(Float, nullable=True)  # 异步任务的延迟预算（秒）
+    
+    __table_args__ = (
+        # 历史记录按 (analysis_time, id) 倒序做键集分页，带过滤条件时使用组合索引
+        Index("ix_analysis_records_time_id", "analysis_time", "id"),
+        Index("ix_analysis_records_level_time", "alert_level", "analysis_time"),
+        Index("ix_analysis_records_status_time", "status", "analysis_time"),
+    )
+
+
+class AnalysisTrace(Base):
+    """分析记录的追踪数据（只保存被采样或较慢的分析）"""
+    __tablename__ = "analysis_traces"
+    
+    record_id = Column(Integer, ForeignKey("analysis_records.id", ondelete="CASCADE"), primary_key=True)
+    trace = Column(Text, nullable=False)  # JSON格式存储各阶段span
+
+
+class DifferenceRecord(Base):
+    """分析记录中的单条差异（从差异JSON展开，便于按类型和时间统计）"""
+    __tablename__ = "differences"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    record_id = Column(Integer, ForeignKey("analysis_records.id", ondelete="CASCADE"), nullable=False, index=True)
+    analysis_time = Column(DateTime, nullable=False)  # 冗余记录的分析时间，按类型+时间范围查询时无需关联主表
+    type = Column(String, nullable=False)
+    confidence = Column(Float, nullable=True)
+    severity = Column(String, nullable=True)
+    bbox_x1 = Column(Integer, nullable=True)
+    bbox_y1 = Column(Integer, nullable=True)
+    bbox_x2 = Column(Integer, nullable=True)
+    bbox_y2 = Column(Integer, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_differences_type_time", "type", "analysis_time"),
+        Index("ix_differences_severity_time", "severity", "analysis_time"),
+    )
+
+
+class StatsRollup(Base):
+    """按小时/天预聚合的统计（随分析记录写入和删除增量维护）
+    
+    dimension为alert_level时key为告警级别，score_sum为相似度之和；
+    dimension为difference_type时key为差异类型，score_sum为置信度之和。
+    """
+    __tablename__ = "stats_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String, nullable=False)  # hour, day
+    bucket_start = Column(DateTime, nullable=False)
+    dimension = Column(String, nullable=False)  # alert_level, difference_type
+    key = Column(String, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+    score_sum = Column(Float, default=0.0, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("granularity", "dimension", "bucket_start", "key", name="uq_stats_rollups_bucket"),
+    )
+
+
+class StoredFile(Base):
+    """内容寻址存储的文件引用计数"""
+    __tablename__ = "stored_files"
+    
+    content_hash = Column(String, primary_key=True)
+    path = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=1, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Baseline(Base):
+    """基准图模型（摄像头的已知正常参考画面）"""
+    __tablename__ = "baselines"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    camera_id = Column(String, nullable=True, index=True)
+    image_path = Column(String, nullable=False)
+    artifact_dir = Column(String, nullable=True)  # 预计算数据目录（解码像素.npy、缩略图、VLM输入）
+    content_hash = Column(String, nullable=True)
+    original_width = Column(Integer, nullable=True)
+    original_height = Column(Integer, nullable=True)
+    features = Column(Text, nullable=True)  # JSON格式存储统计特征
+    perceptual_hashes = Column(Text, nullable=True)  # JSON格式存储感知哈希
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 
 class AlertRule(Base):
@@ -49,6 +158,24 @@ class AlertRule(Base):
 # 创建数据库表
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    upgrade_schema()
+
+
+def upgrade_schema():
+    """为已存在的表补充新增的列和索引（create_all不会修改已存在的表）"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        with engine.begin() as connection:
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+                    logger.info("数据库升级: %s 新增列 %s", table.name, column.name)
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 
 # 获取数据库会话
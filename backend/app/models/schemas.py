@@ -23,12 +23,24 @@ class BatchAnalysisRequest(BaseModel):
     options: Dict[str, Any] = Field(default_factory=dict, description="分析选项")
 
 
+class VideoAnalysisRequest(BaseModel):
+    """视频/帧序列分析请求模型"""
+    source: str = Field(description="本地视频文件或帧序列目录路径")
+    threshold: float = Field(default=0.8, ge=0.0, le=1.0, description="相似度阈值")
+    sample_fps: Optional[float] = Field(default=None, gt=0, description="采样帧率，未指定时使用配置值")
+    change_threshold: Optional[float] = Field(default=None, gt=0, description="变化得分阈值（0-255），未指定时使用配置值")
+    max_events: Optional[int] = Field(default=None, ge=1, description="最多送入完整分析的事件数")
+    concurrency: Optional[int] = Field(default=None, ge=1, description="同时分析的事件数")
+    latency_budget: Optional[float] = Field(default=None, gt=0, description="每个事件的分析延迟预算（秒）")
+
+
 class Difference(BaseModel):
     """差异信息模型"""
     type: str = Field(description="差异类型")
     description: str = Field(description="差异描述")
     confidence: float = Field(ge=0.0, le=1.0, description="置信度")
     bbox: Optional[List[int]] = Field(default=None, description="边界框坐标")
+    severity: Optional[str] = Field(default=None, description="严重程度: low, medium, high, critical")
 
 
 class AlertDetail(BaseModel):
@@ -42,6 +54,45 @@ class AlertDetail(BaseModel):
     estimated_resolution_time: Optional[str] = Field(default=None, description="预估解决时间")
 
 
+class PrescreenReport(BaseModel):
+    """预筛选报告模型"""
+    policy: str = Field(description="预筛选策略: off, conservative, aggressive")
+    decision: str = Field(description="决定: skip(跳过VLM), analyze(发送VLM)")
+    tier: str = Field(description="做出决定的层级: hash, tiles, mse, none")
+    confidence: float = Field(ge=0.0, le=1.0, description="决定的置信度")
+    hash_distances: Dict[str, float] = Field(default_factory=dict, description="感知哈希归一化距离")
+    changed_tiles: int = Field(default=0, description="变化块数量")
+    total_tiles: int = Field(default=0, description="总块数量")
+    changed_tile_ratio: float = Field(default=0.0, description="变化块比例")
+
+
+class ChangeRegion(BaseModel):
+    """变化区域模型"""
+    index: int = Field(description="区域编号")
+    bbox: List[int] = Field(description="原图像素坐标边界框 [x1, y1, x2, y2]")
+    crop_box: List[int] = Field(description="发送给VLM的裁剪框（解码图坐标，含扩展）")
+    tiles: int = Field(description="变化块数量")
+    score: float = Field(description="变化块平均得分")
+
+
+class LocalizationReport(BaseModel):
+    """变化区域定位报告模型"""
+    mode: str = Field(description="定位模式: off, crops, composite")
+    localized: bool = Field(default=False, description="是否只向VLM发送了局部区域")
+    fallback: Optional[str] = Field(default=None, description="退回整图分析的原因")
+    area_ratio: float = Field(default=0.0, description="区域总面积占比")
+    regions: List[ChangeRegion] = Field(default_factory=list, description="变化区域列表")
+
+
+class EscalationReport(BaseModel):
+    """二次分析升级决策报告模型"""
+    policy: str = Field(description="升级策略名称")
+    escalated: bool = Field(description="是否进行了二次VLM分析")
+    reason: str = Field(description="决策原因")
+    latency_budget: Optional[float] = Field(default=None, description="延迟预算（秒）")
+    budget_remaining: Optional[float] = Field(default=None, description="分析结束时的剩余预算（秒）")
+
+
 class AnalysisResult(BaseModel):
     """分析结果模型"""
     similarity_score: float = Field(ge=0.0, le=1.0, description="相似度分数")
@@ -51,6 +102,13 @@ class AnalysisResult(BaseModel):
     analysis_summary: str = Field(description="分析摘要")
     analysis_time: datetime = Field(description="分析时间")
     processing_time: float = Field(description="处理时间（秒）")
+    similarity_metrics: Dict[str, float] = Field(default_factory=dict, description="各相似度指标 (0-1)")
+    degraded: bool = Field(default=False, description="是否为VLM不可用时仅基于本地指标的降级结果")
+    degraded_reason: Optional[str] = Field(default=None, description="降级原因: circuit_open, timeout, connect_error等")
+    prescreen: Optional[PrescreenReport] = Field(default=None, description="预筛选报告")
+    escalation: Optional[EscalationReport] = Field(default=None, description="二次分析升级决策")
+    localization: Optional[LocalizationReport] = Field(default=None, description="变化区域定位报告")
+    trace: Optional[Dict[str, Any]] = Field(default=None, exclude=True, description="追踪数据（随记录保存，不在响应中返回）")
 
 
 class AnalysisResponse(BaseModel):
@@ -60,6 +118,45 @@ class AnalysisResponse(BaseModel):
     message: Optional[str] = Field(default=None, description="响应消息")
 
 
+class VideoEvent(BaseModel):
+    """视频时间线中的一个变化事件"""
+    index: int = Field(description="事件序号")
+    start_time: float = Field(description="事件开始时间（秒，变化前最后一帧）")
+    end_time: float = Field(description="最后一次检测到变化的时间（秒）")
+    peak_time: float = Field(description="变化得分最高的时间（秒）")
+    peak_score: float = Field(description="最高变化得分")
+    before_time: float = Field(description="前关键帧时间（秒）")
+    after_time: float = Field(description="后关键帧时间（秒，画面重新稳定后）")
+    status: str = Field(description="success, error, skipped（超过事件上限未分析）")
+    result: Optional[AnalysisResult] = Field(default=None, description="前后关键帧的分析结果")
+    error: Optional[str] = Field(default=None, description="分析失败原因")
+
+
+class VideoTimeline(BaseModel):
+    """视频分析时间线"""
+    source: str = Field(description="视频文件或帧序列目录")
+    frames_scanned: int = Field(description="计算了变化得分的采样帧数")
+    duration: float = Field(description="最后一个采样帧的时间（秒）")
+    events: int = Field(description="检测到的事件数")
+    analyzed_events: int = Field(description="送入完整分析的事件数")
+    skipped_events: int = Field(description="超过事件上限未分析的事件数")
+    timeline: List[VideoEvent] = Field(default_factory=list, description="按时间排序的事件")
+
+
+class VideoAnalysisResponse(BaseModel):
+    """视频分析响应模型"""
+    status: str = Field(description="响应状态")
+    data: VideoTimeline = Field(description="事件时间线")
+    message: Optional[str] = Field(default=None, description="响应消息")
+
+
+class JobSubmitResponse(BaseModel):
+    """异步任务提交响应模型"""
+    status: str = Field(description="响应状态")
+    job_id: int = Field(description="任务ID（即分析记录ID）")
+    message: Optional[str] = Field(default=None, description="响应消息")
+
+
 class AnalysisRecordResponse(BaseModel):
     """分析记录响应模型"""
     id: int
@@ -70,12 +167,28 @@ class AnalysisRecordResponse(BaseModel):
     alert_level: Optional[str]
     analysis_time: datetime
     processing_time: Optional[float]
+    degraded: Optional[bool] = False
     status: str
     error_message: Optional[str]
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class BaselineResponse(BaseModel):
+    """基准图响应模型"""
+    id: int
+    name: str
+    camera_id: Optional[str]
+    image_path: str
+    content_hash: Optional[str]
+    original_width: Optional[int]
+    original_height: Optional[int]
+    features: Optional[str]
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class AlertRuleRequest(BaseModel):
     """告警规则请求模型"""
     name: str = Field(description="规则名称")
@@ -98,10 +211,51 @@ class AlertRuleResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
-class PaginatedResponse(BaseModel):
-    """分页响应模型"""
-    items: List[Any]
-    total: int
-    page: int
-    limit: int
-    pages: int 
\ No newline at end of file
+class CursorPageResponse(BaseModel):
+    """键集分页响应模型"""
+    items: List[AnalysisRecordResponse]
+    next_cursor: Optional[str] = Field(default=None, description="下一页游标，为空表示没有更多记录")
+    total: int = Field(description="符合条件的记录总数（短时间缓存，可能略有滞后）")
+    limit: int 
+
+
+class StatsBucket(BaseModel):
+    """统计时间桶"""
+    bucket_start: datetime
+    key: str = Field(description="告警级别或差异类型")
+    count: int
+    avg_score: float = Field(description="平均相似度（告警级别维度）或平均置信度（差异类型维度）")
+
+
+class StatsTotal(BaseModel):
+    """统计区间合计"""
+    count: int
+    avg_score: float
+
+
+class StatsResponse(BaseModel):
+    """预聚合统计响应模型"""
+    granularity: str = Field(description="时间粒度: hour, day")
+    dimension: str = Field(description="统计维度: alert_level, difference_type")
+    series: List[StatsBucket]
+    totals: Dict[str, StatsTotal]
+
+
+class TraceSpan(BaseModel):
+    """追踪span"""
+    id: int
+    parent: Optional[int] = Field(default=None, description="父span编号")
+    name: str
+    start_ms: float = Field(description="相对分析开始的偏移（毫秒）")
+    duration_ms: Optional[float] = None
+    attrs: Dict[str, Any] = Field(default_factory=dict)
+
+
+class AnalysisTraceResponse(BaseModel):
+    """分析追踪响应模型"""
+    record_id: int
+    trace_id: str
+    started_at: datetime
+    duration_ms: float = Field(description="分析总耗时（毫秒，不含持久化）")
+    reason: str = Field(description="保留原因: sampled, slow, always")
+    spans: List[TraceSpan]
@@ -1,13 +1,66 @@
 import os
 import json
 import time
-from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import base64
+import logging
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 from datetime import datetime
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
 from app.models.database import AnalysisRecord, AlertRule, get_db
-from app.models.schemas import AnalysisResult, Difference, AlertDetail
-from app.services.ollama_service import ollama_service
+from app.models.schemas import (
+    AnalysisResult, Difference, AlertDetail, PrescreenReport, EscalationReport, LocalizationReport
+)
+from app.services.ollama_service import ollama_service, VLMUnavailableError
+from app.services.image_bundle import ImageBundle, file_content_hash
+from app.services.image_loader import load_image_bundle_async
+from app.services.prescreen import prescreener, build_prescreen_report
+from app.services.stream_parser import ERROR_DIFFERENCE_TYPES, is_error_difference, difference_confidence
+from app.services.escalation import Deadline, get_escalation_policy
+from app.services.localization import change_localizer
+from app.services.similarity_metrics import similarity_metrics
+from app.services.record_writer import record_writer, persist_trace
+from app.services.stats_service import stats_service
 from app.core.config import settings
+from app.core.workers import run_cpu
+from app.core.singleflight import SingleFlight
+from app.core.metrics import (
+    ANALYSIS_IN_FLIGHT, ANALYSIS_SECONDS, ANALYSIS_DEDUP, ANALYSIS_STAGE_SECONDS, PRESCREEN_DECISIONS,
+    DB_WRITE_SECONDS, DB_WRITE_RECORDS
+)
+from app.core.tracing import (
+    start_trace, end_trace, span, start_span, open_detached_span
+)
+
+logger = logging.getLogger(__name__)
+
+
+# 详细分析提示词版本，修改提示词内容时需同步升级
+DETAILED_PROMPT_VERSION = "v1"
+
+
+@contextmanager
+def _stage(name: str):
+    """分析阶段：同时记录阶段耗时直方图和追踪span"""
+    with ANALYSIS_STAGE_SECONDS.time(stage=name), span(name) as current:
+        yield current
+
+
+def encode_history_cursor(record: AnalysisRecord) -> str:
+    """分页游标：最后一条记录的 (analysis_time, id)"""
+    raw = f"{record.analysis_time.isoformat()}|{record.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析分页游标，格式错误时抛出ValueError"""
+    try:
+        analysis_time, record_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(analysis_time), int(record_id)
+    except Exception:
+        raise ValueError("无效的分页游标")
 
 
 class AnalysisService:
@@ -15,164 +68,287 @@ class AnalysisService:
     
     def __init__(self):
         self.ollama_service = ollama_service
+        self.prescreener = prescreener
+        self.change_localizer = change_localizer
+        self.metrics_engine = similarity_metrics
+        self.escalation_policy = get_escalation_policy(settings.escalation_policy)
+        # 历史记录总数缓存: 过滤条件 -> (过期时间, 总数)
+        self._count_cache: Dict[Tuple, Tuple[float, int]] = {}
+        # 进行中的同步分析，相同内容和参数的并发请求共享一次计算
+        self._inflight = SingleFlight()
     
-    def save_uploaded_file(self, file, filename: str) -> str:
-        """保存上传的文件"""
-        print(f"开始保存文件: {filename}")
-        
-        # 确保文件名安全
-        safe_filename = self._get_safe_filename(filename)
-        file_path = os.path.join(settings.upload_dir, safe_filename)
+    async def analyze_images(self, image1_path: str, image2_path: str, threshold: float = 0.8,
+                             latency_budget: Optional[float] = None,
+                             bundle1: Optional[ImageBundle] = None) -> AnalysisResult:
+        """多阶段图片分析workflow
         
-        print(f"安全文件名: {safe_filename}")
-        print(f"完整路径: {file_path}")
+        latency_budget为本次分析的延迟预算（秒），未指定时使用配置值，各阶段在剩余预算内执行。
+        bundle1为已加载的第一张图片（如预计算的基准图），提供时不再读取和解码image1_path。
+        图片内容和参数都相同的并发分析合并为一次计算（如客户端超时后重试），共享同一结果。
+        """
+        budget = settings.analysis_latency_budget if latency_budget is None else latency_budget
+        key = await self._dedup_key(image1_path, image2_path, threshold, budget, bundle1) \
+            if settings.analysis_dedup_enabled else None
+        if key is None:
+            return await self._analyze_images(image1_path, image2_path, threshold, budget, bundle1)
         
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            content = file.file.read()
-            buffer.write(content)
-        
-        print(f"文件保存完成，大小: {len(content)} 字节")
-        return file_path
+        result, joined, shared = await self._inflight.run(
+            key, lambda: self._analyze_images(image1_path, image2_path, threshold, budget, bundle1)
+        )
+        ANALYSIS_DEDUP.inc(role="joined" if joined else "leader")
+        if joined:
+            logger.debug("复用进行中的相同分析: %s, %s", image1_path, image2_path)
+        # 调用方会原地修改结果（如在追踪中记录persist阶段），共享时各自持有副本
+        return result.model_copy(deep=True) if shared else result
     
-    def _get_safe_filename(self, filename: str) -> str:
-        """生成安全的文件名"""
-        import uuid
-        name, ext = os.path.splitext(filename)
-        timestamp = int(time.time())
-        return f"{timestamp}_{uuid.uuid4().hex[:8]}{ext}"
+    async def _dedup_key(self, image1_path: str, image2_path: str, threshold: float, budget: float,
+                         bundle1: Optional[ImageBundle]) -> Optional[Tuple]:
+        """合并并发分析使用的键：两张图片的内容哈希和分析参数；文件无法读取时不合并"""
+        try:
+            hash1, hash2 = await asyncio.gather(
+                run_cpu(lambda: bundle1.content_hash) if bundle1 is not None
+                else run_cpu(file_content_hash, image1_path),
+                run_cpu(file_content_hash, image2_path)
+            )
+        except OSError:
+            return None
+        return hash1, hash2, threshold, budget
     
-    def analyze_images(self, image1_path: str, image2_path: str, threshold: float = 0.8) -> AnalysisResult:
-        """多阶段图片分析workflow"""
+    async def _analyze_images(self, image1_path: str, image2_path: str, threshold: float,
+                              latency_budget: float, bundle1: Optional[ImageBundle]) -> AnalysisResult:
         start_time = time.time()
+        deadline = Deadline(latency_budget)
         
+        ANALYSIS_IN_FLIGHT.inc(mode="sync")
+        trace, trace_token = start_trace()
         try:
-            # 验证图片文件
-            if not os.path.exists(image1_path):
-                raise Exception(f"图片1文件不存在: {image1_path}")
-            if not os.path.exists(image2_path):
-                raise Exception(f"图片2文件不存在: {image2_path}")
+            context = await self._prepare_analysis(image1_path, image2_path, bundle1)
+            context['deadline'] = deadline
             
-            print("=== 开始多阶段图片分析 ===")
+            # 阶段3: 内容差异检测（先经过预筛选，场景无变化时不调用VLM；VLM不可用时降级为本地结果）
+            with _stage("content") as content_span:
+                if context['prescreen']['decision'] == 'skip':
+                    content_analysis = self._unchanged_content_analysis(context['base_similarity'])
+                else:
+                    try:
+                        content_analysis = await self._analyze_content_differences(
+                            context['bundle1'], context['bundle2'], context['prescreen'], deadline,
+                            context['localization']
+                        )
+                    except VLMUnavailableError as e:
+                        content_span.set(degraded=e.reason)
+                        content_analysis = self._degraded_content_analysis(context, e)
             
-            # 阶段1: 基础相似度计算
-            print("阶段1: 计算基础相似度...")
-            base_similarity = self._calculate_base_similarity(image1_path, image2_path)
-            print(f"基础相似度: {base_similarity:.4f}")
+            result = self._finalize_analysis(context, content_analysis, threshold, start_time)
+            ANALYSIS_SECONDS.observe(result.processing_time, mode="sync",
+                                     outcome="degraded" if result.degraded else "success")
+            if trace is not None:
+                result.trace = trace.export(result.processing_time)
+            return result
             
-            # 阶段2: 特征提取和比较
-            print("阶段2: 特征提取和比较...")
-            feature_analysis = self._analyze_image_features(image1_path, image2_path)
-            feature_similarity = feature_analysis.get('similarity', 0.5)
-            print(f"特征相似度: {feature_similarity:.4f}")
+        except Exception as e:
+            ANALYSIS_SECONDS.observe(time.time() - start_time, mode="sync", outcome="error")
+            logger.exception("分析过程中出现错误: %s", e)
+            raise Exception(f"图片分析失败: {str(e)}")
+        finally:
+            end_trace(trace_token)
+            ANALYSIS_IN_FLIGHT.dec(mode="sync")
+    
+    async def stream_analyze(self, image1_path: str, image2_path: str,
+                             threshold: float = 0.8) -> AsyncIterator[Dict[str, Any]]:
+        """流式多阶段分析，逐个产出事件
+        
+        事件依次为: prescreen、alert(最早的告警级别)、difference(每个差异)、result(最终结果)。
+        流式模式追求最快给出告警，不进行二次详细分析。VLM不可用时产出degraded事件，
+        最终结果为仅基于本地指标的降级结果。
+        """
+        start_time = time.time()
+        
+        ANALYSIS_IN_FLIGHT.inc(mode="stream")
+        trace, trace_token = start_trace()
+        try:
+            context = await self._prepare_analysis(image1_path, image2_path)
+            context['deadline'] = Deadline(settings.analysis_latency_budget)
+            yield {"event": "prescreen", "data": build_prescreen_report(context['prescreen'])}
             
-            # 阶段3: 内容差异检测
-            print("阶段3: 内容差异检测...")
-            content_analysis = self._analyze_content_differences(image1_path, image2_path)
-            content_similarity = content_analysis.get('similarity_score', 0.5)
-            print(f"内容相似度: {content_similarity:.4f}")
-            print(f"内容分析差异数量: {len(content_analysis.get('differences', []))}")
+            # 内容检测跨越多次yield，不能使用改变上下文的span，在结束时补记
+            content_start = time.perf_counter()
+            if context['prescreen']['decision'] == 'skip':
+                content_analysis = self._unchanged_content_analysis(context['base_similarity'])
+            else:
+                content_analysis = None
+                alert_sent = False
+                content_span = start_span("content", mode="stream")
+                stream = self.ollama_service.stream_image_differences(context['bundle1'], context['bundle2'])
+                try:
+                    async for event in stream:
+                        if event['event'] == 'result':
+                            content_analysis = event['data']
+                        elif event['event'] == 'alert_level' and not alert_sent:
+                            alert_sent = True
+                            yield {"event": "alert", "data": {"alert_level": event['data'], "source": "model"}}
+                        elif event['event'] == 'difference':
+                            if not alert_sent and is_error_difference(event['data']):
+                                alert_sent = True
+                                yield {"event": "alert", "data": {"alert_level": "error", "source": "difference"}}
+                            yield {"event": "difference", "data": event['data']}
+                    if content_analysis is None:
+                        raise VLMUnavailableError("incomplete_stream", "VLM流式输出未返回最终结果")
+                    content_analysis['escalation'] = self._escalation_record("streaming")
+                except VLMUnavailableError as e:
+                    content_span.set(degraded=e.reason)
+                    content_analysis = self._degraded_content_analysis(context, e)
+                    yield {"event": "degraded", "data": {"reason": e.reason, "detail": str(e)}}
+                finally:
+                    content_span.end()
+            ANALYSIS_STAGE_SECONDS.observe(time.perf_counter() - content_start, stage="content")
             
-            # 阶段4: 结果整合和验证
-            print("阶段4: 结果整合和验证...")
-            final_result = self._integrate_results(base_similarity, feature_analysis, content_analysis, threshold)
-            print(f"最终相似度: {final_result['similarity_score']:.4f}")
-            print(f"最终差异数量: {len(final_result['differences'])}")
-            print(f"告警级别: {final_result['alert_level']}")
+            result = self._finalize_analysis(context, content_analysis, threshold, start_time)
+            ANALYSIS_SECONDS.observe(result.processing_time, mode="stream",
+                                     outcome="degraded" if result.degraded else "success")
+            if trace is not None:
+                result.trace = trace.export(result.processing_time)
+            yield {"event": "result", "data": result}
             
-            # 阶段5: 生成告警详情
-            print("阶段5: 生成告警详情...")
+        except Exception as e:
+            ANALYSIS_SECONDS.observe(time.time() - start_time, mode="stream", outcome="error")
+            logger.warning("流式分析过程中出现错误: %s", e)
+            raise Exception(f"图片分析失败: {str(e)}")
+        finally:
+            end_trace(trace_token)
+            ANALYSIS_IN_FLIGHT.dec(mode="stream")
+    
+    async def _prepare_analysis(self, image1_path: str, image2_path: str,
+                                bundle1: Optional[ImageBundle] = None) -> Dict[str, Any]:
+        """解码图片并执行VLM之前的本地分析阶段（基础相似度、特征、预筛选）"""
+        # 验证图片文件
+        if bundle1 is None and not os.path.exists(image1_path):
+            raise Exception(f"图片1文件不存在: {image1_path}")
+        if not os.path.exists(image2_path):
+            raise Exception(f"图片2文件不存在: {image2_path}")
+        
+        # 每张图片只解码一次，后续各阶段共享（解码在CPU工作池或进程池中进行，不阻塞事件循环）
+        with _stage("decode"):
+            if bundle1 is None:
+                bundle1, bundle2 = await asyncio.gather(
+                    load_image_bundle_async(image1_path),
+                    load_image_bundle_async(image2_path)
+                )
+            else:
+                bundle2 = await load_image_bundle_async(image2_path)
+        logger.debug("图片解码完成: %s, %s", bundle1.describe(), bundle2.describe())
+        
+        # 阶段1: 相似度指标计算（MSE、PSNR、SSIM等及统计特征在共享缓冲区上一次算出）
+        with _stage("similarity"):
+            metrics = await run_cpu(self.metrics_engine.compute, bundle1, bundle2)
+            base_similarity = self.metrics_engine.weighted(metrics['scores'])
+        logger.debug("相似度指标: %s, 基础相似度: %.4f", metrics['scores'], base_similarity)
+        
+        # 阶段2: 特征比较
+        with _stage("features"):
+            feature_analysis = self._analyze_image_features(metrics)
+        
+        # 预筛选：决定是否需要调用VLM
+        with _stage("prescreen") as prescreen_span:
+            prescreen = await run_cpu(self.prescreener.evaluate, bundle1, bundle2)
+        PRESCREEN_DECISIONS.inc(decision=prescreen['decision'], tier=prescreen['tier'])
+        prescreen_span.set(decision=prescreen['decision'], tier=prescreen['tier'])
+        logger.debug("预筛选: %s (层级: %s, 置信度: %.2f)",
+                     prescreen['decision'], prescreen['tier'], prescreen['confidence'])
+        
+        # 变化区域定位：得到确定性的边界框，并决定是否只发送局部区域给VLM
+        localization = None
+        if prescreen['decision'] == 'analyze':
+            with _stage("localization"):
+                localization = await run_cpu(self.change_localizer.locate, bundle1, bundle2, prescreen)
+            logger.debug("变化区域定位: %d 个区域, 退回整图原因: %s",
+                         len(localization['regions']), localization['fallback'])
+        
+        return {
+            "bundle1": bundle1,
+            "bundle2": bundle2,
+            "metrics": metrics,
+            "base_similarity": base_similarity,
+            "feature_analysis": feature_analysis,
+            "prescreen": prescreen,
+            "localization": localization
+        }
+    
+    def _finalize_analysis(self, context: Dict[str, Any], content_analysis: Dict[str, Any],
+                           threshold: float, start_time: float) -> AnalysisResult:
+        """整合各阶段结果，生成告警详情和摘要"""
+        prescreen = context['prescreen']
+        if content_analysis.get('vlm_skipped'):
+            # Ollama服务内部的像素级MSE检查跳过了VLM
+            prescreen.update({
+                "decision": "skip",
+                "tier": "mse",
+                "confidence": content_analysis.get('similarity_score', 1.0)
+            })
+        
+        # 阶段4: 结果整合和验证
+        with _stage("integration"):
+            final_result = self._integrate_results(
+                context['metrics']['scores'], context['feature_analysis'], content_analysis, threshold
+            )
+        
+        # 阶段5: 生成告警详情
+        with _stage("alert_details"):
             alert_details = self._generate_alert_details(
                 final_result['alert_level'], 
                 final_result['differences'], 
                 final_result['similarity_score']
             )
-            
-            # 阶段6: 生成分析摘要
+        
+        # 阶段6: 生成分析摘要
+        with _stage("summary"):
             analysis_summary = self._generate_analysis_summary(
                 final_result['differences'], 
                 final_result['similarity_score'], 
                 final_result['alert_level']
             )
-            
-            processing_time = time.time() - start_time
-            print(f"分析完成，总耗时: {processing_time:.2f}秒")
-            
-            return AnalysisResult(
-                similarity_score=final_result['similarity_score'],
-                differences=final_result['differences'],
-                alert_level=final_result['alert_level'],
-                alert_details=alert_details,
-                analysis_summary=analysis_summary,
-                analysis_time=datetime.utcnow(),
-                processing_time=processing_time
-            )
-            
-        except Exception as e:
-            print(f"分析过程中出现错误: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            raise Exception(f"图片分析失败: {str(e)}")
-    
-    def _calculate_base_similarity(self, image1_path: str, image2_path: str) -> float:
-        """计算基础相似度（像素级比较）"""
-        try:
-            from PIL import Image
-            import numpy as np
-            
-            # 加载图片
-            img1 = Image.open(image1_path).convert('RGB')
-            img2 = Image.open(image2_path).convert('RGB')
-            
-            # 统一尺寸
-            size = (224, 224)
-            img1 = img1.resize(size)
-            img2 = img2.resize(size)
-            
-            # 转换为numpy数组
-            arr1 = np.array(img1)
-            arr2 = np.array(img2)
-            
-            # 计算均方误差
-            mse = np.mean((arr1 - arr2) ** 2)
-            
-            # 转换为相似度分数 (0-1)
-            max_mse = 255 ** 2
-            similarity = 1 - (mse / max_mse)
-            
-            return max(0, min(1, similarity))
-        except Exception as e:
-            print(f"基础相似度计算失败: {str(e)}")
-            return 0.5
+            if content_analysis.get('degraded'):
+                analysis_summary = f"AI分析不可用，以下结果仅基于本地指标。{analysis_summary}"
+        
+        processing_time = time.time() - start_time
+        logger.debug("分析完成，总耗时: %.2f秒", processing_time)
+        
+        escalation = content_analysis.get('escalation') or self._escalation_record("no_vlm_call")
+        deadline = context['deadline']
+        localization = context.get('localization')
+        
+        return AnalysisResult(
+            similarity_score=final_result['similarity_score'],
+            differences=final_result['differences'],
+            alert_level=final_result['alert_level'],
+            alert_details=alert_details,
+            analysis_summary=analysis_summary,
+            analysis_time=datetime.utcnow(),
+            processing_time=processing_time,
+            similarity_metrics=context['metrics']['scores'],
+            degraded=content_analysis.get('degraded', False),
+            degraded_reason=content_analysis.get('degraded_reason'),
+            prescreen=PrescreenReport(**build_prescreen_report(prescreen)),
+            escalation=EscalationReport(
+                latency_budget=deadline.budget,
+                budget_remaining=deadline.remaining(),
+                **escalation
+            ),
+            localization=LocalizationReport(
+                mode=localization['mode'],
+                localized=content_analysis.get('localized', False),
+                fallback=localization['fallback'],
+                area_ratio=localization['area_ratio'],
+                regions=localization['regions']
+            ) if localization else None
+        )
     
-    def _analyze_image_features(self, image1_path: str, image2_path: str) -> Dict[str, Any]:
+    def _analyze_image_features(self, metrics: Dict[str, Any]) -> Dict[str, Any]:
         """分析图片特征（颜色、亮度、对比度等）"""
         try:
-            from PIL import Image
-            import numpy as np
-            
-            def extract_features(img_path: str) -> Dict[str, float]:
-                img = Image.open(img_path).convert('RGB')
-                arr = np.array(img)
-                
-                # 计算颜色特征
-                r_mean, g_mean, b_mean = np.mean(arr, axis=(0, 1))
-                r_std, g_std, b_std = np.std(arr, axis=(0, 1))
-                
-                # 计算亮度
-                gray = np.dot(arr[..., :3], [0.299, 0.587, 0.114])
-                brightness = np.mean(gray)
-                contrast = np.std(gray)
-                
-                return {
-                    'r_mean': r_mean, 'g_mean': g_mean, 'b_mean': b_mean,
-                    'r_std': r_std, 'g_std': g_std, 'b_std': b_std,
-                    'brightness': brightness, 'contrast': contrast
-                }
-            
-            # 提取两张图片的特征
-            features1 = extract_features(image1_path)
-            features2 = extract_features(image2_path)
+            # 特征由指标引擎在共享缓冲区上计算
+            features1 = metrics['features1']
+            features2 = metrics['features2']
             
             # 计算特征差异
             feature_diffs = {}
@@ -193,35 +369,126 @@ class AnalysisService:
             }
             
         except Exception as e:
-            print(f"特征分析失败: {str(e)}")
+            logger.warning("特征分析失败: %s", e)
             return {'similarity': 0.5, 'differences': {}}
     
-    def _analyze_content_differences(self, image1_path: str, image2_path: str) -> Dict[str, Any]:
-        """使用AI分析内容差异"""
+    def _unchanged_content_analysis(self, base_similarity: float) -> Dict[str, Any]:
+        """预筛选判定场景无变化时的内容分析结果"""
+        return {
+            "similarity_score": base_similarity,
+            "differences": [],
+            "alert_level": "info",
+            "summary": "预筛选判定场景无变化，跳过AI分析",
+            "escalation": self._escalation_record("prescreen_skip")
+        }
+    
+    def _degraded_content_analysis(self, context: Dict[str, Any], error: VLMUnavailableError) -> Dict[str, Any]:
+        """VLM不可用时的降级内容分析：相似度使用基础相似度，差异只来自预筛选和变化定位
+        
+        定位到的每个变化区域作为一个未经确认的差异，没有定位结果但预筛选判定有变化时报告整体变化。
+        """
+        prescreen = context['prescreen']
+        localization = context.get('localization')
+        confidence = float(prescreen.get('confidence', 0.5))
+        differences = []
+        if localization and localization['regions'] and not localization['fallback']:
+            for region in localization['regions']:
+                differences.append({
+                    "type": "unverified_change",
+                    "description": f"本地检测到区域{region['index']}发生变化（未经AI确认）",
+                    "confidence": confidence,
+                    "bbox": region['bbox'],
+                    "severity": "medium"
+                })
+        elif prescreen.get('changed_tiles'):
+            differences.append({
+                "type": "unverified_change",
+                "description": f"本地检测到{prescreen['changed_tiles']}个图像块发生变化（未经AI确认）",
+                "confidence": confidence,
+                "severity": "medium"
+            })
+        
+        logger.debug("VLM不可用（%s），返回降级结果: %s", error.reason, error)
+        return {
+            "similarity_score": context['base_similarity'],
+            "differences": differences,
+            "degraded": True,
+            "degraded_reason": error.reason,
+            "escalation": self._escalation_record(
+                "budget_exhausted" if error.reason == "budget_exhausted" else "vlm_unavailable"
+            )
+        }
+    
+    def _escalation_record(self, reason: str, escalated: bool = False) -> Dict[str, Any]:
+        """记录二次分析的决策路径"""
+        return {"policy": self.escalation_policy.name, "escalated": escalated, "reason": reason}
+    
+    async def _analyze_content_differences(self, bundle1: ImageBundle, bundle2: ImageBundle,
+                                           prescreen: Dict[str, Any], deadline: Deadline,
+                                           localization: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """使用AI分析内容差异，由升级策略决定是否进行二次详细分析
+        
+        定位到少量变化区域时只发送局部区域，否则发送整图。
+        """
+        if deadline.expired():
+            # 按VLM不可用处理，由调用方返回基于本地指标的降级结果
+            logger.info("延迟预算已用尽，跳过AI分析")
+            raise VLMUnavailableError("budget_exhausted", "延迟预算已用尽，跳过AI分析")
+        
         try:
             # 调用Ollama服务进行内容分析
-            result = self.ollama_service.analyze_image_differences(image1_path, image2_path)
+            timeout = deadline.timeout_for(settings.ollama_timeout)
+            if localization and localization['regions'] and not localization['fallback']:
+                result = await self.ollama_service.analyze_region_differences(
+                    bundle1, bundle2, localization, timeout
+                )
+                result['localized'] = True
+            else:
+                result = await self.ollama_service.analyze_image_differences(bundle1, bundle2, timeout)
             
-            # 如果AI返回的相似度与基础相似度差异很大，进行二次验证
-            if 'similarity_score' in result:
-                ai_similarity = result['similarity_score']
-                
-                # 如果AI认为相似度很高但基础相似度不高，进行详细分析
-                if ai_similarity > 0.9:
-                    # 进行更详细的分析
-                    detailed_result = self._detailed_content_analysis(image1_path, image2_path)
-                    if detailed_result:
-                        return detailed_result
+            if result.get('vlm_skipped'):
+                result['escalation'] = self._escalation_record("vlm_skipped")
+                return result
+            
+            # 根据预筛选置信度、首次结果置信度和剩余预算决定是否进行二次分析
+            decision = self.escalation_policy.decide(
+                prescreen, result, deadline, self.ollama_service.latency_ewma
+            )
+            logger.debug("升级策略: %s, 二次分析: %s", decision['reason'], decision['escalate'])
+            
+            if decision['escalate']:
+                detailed_result = await self._detailed_content_analysis(
+                    bundle1, bundle2, deadline, localization if result.get('localized') else None
+                )
+                if detailed_result:
+                    detailed_result['escalation'] = self._escalation_record(decision['reason'], escalated=True)
+                    return detailed_result
             
+            result['escalation'] = self._escalation_record(decision['reason'])
             return result
             
+        except VLMUnavailableError:
+            raise
         except Exception as e:
-            print(f"内容差异分析失败: {str(e)}")
-            return {'differences': [], 'similarity_score': 0.5}
+            logger.warning("内容差异分析失败: %s", e)
+            raise VLMUnavailableError("analysis_failed", str(e))
     
-    def _detailed_content_analysis(self, image1_path: str, image2_path: str) -> Dict[str, Any]:
-        """详细内容分析（当基础分析可能不准确时）"""
+    async def _detailed_content_analysis(self, bundle1: ImageBundle, bundle2: ImageBundle, deadline: Deadline,
+                                         localization: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """详细内容分析（当基础分析可能不准确时）
+        
+        首次分析为局部分析时，二次分析同样只发送变化区域，保留定位得到的边界框和本地计算的相似度。
+        """
         try:
+            if localization is not None:
+                result = await self.ollama_service.analyze_region_differences(
+                    bundle1, bundle2, localization, deadline.timeout_for(settings.ollama_timeout), detailed=True
+                )
+                if not result.get('parsed', True):
+                    return None
+                result['localized'] = True
+                return result
+            
             # 使用更详细的提示词进行二次分析
             detailed_prompt = """
 请非常仔细地分析这两张图片的差异。请特别注意：
@@ -250,10 +517,9 @@ class AnalysisService:
 """
             
             # 调用AI进行详细分析
-            result = self.ollama_service._call_ollama_api(
-                detailed_prompt, 
-                [self.ollama_service._encode_image_to_base64(image1_path),
-                 self.ollama_service._encode_image_to_base64(image2_path)]
+            result = await self.ollama_service.generate_cached(
+                "detailed", DETAILED_PROMPT_VERSION, detailed_prompt, [bundle1, bundle2],
+                deadline.timeout_for(settings.ollama_timeout)
             )
             
             if 'response' in result:
@@ -265,18 +531,20 @@ class AnalysisService:
             return None
             
         except Exception as e:
-            print(f"详细内容分析失败: {str(e)}")
+            logger.warning("详细内容分析失败: %s", e)
             return None
     
-    def _integrate_results(self, base_similarity: float, feature_analysis: Dict, 
+    def _integrate_results(self, metric_scores: Dict[str, float], feature_analysis: Dict, 
                           content_analysis: Dict, threshold: float) -> Dict[str, Any]:
         """整合多个分析结果"""
         
-        # 获取各个阶段的相似度
+        # 获取各个阶段的相似度，基础相似度由各像素级指标按配置权重合成
+        base_similarity = self.metrics_engine.weighted(metric_scores)
         feature_similarity = feature_analysis.get('similarity', 0.5)
         content_similarity = content_analysis.get('similarity_score', 0.5)
         
-        print(f"整合结果 - 基础相似度: {base_similarity:.4f}, 特征相似度: {feature_similarity:.4f}, 内容相似度: {content_similarity:.4f}")
+        logger.debug("整合结果 - 基础相似度: %.4f, 特征相似度: %.4f, 内容相似度: %.4f",
+                     base_similarity, feature_similarity, content_similarity)
         
         # 加权计算最终相似度
         # 基础相似度权重30%，特征相似度权重20%，内容相似度权重50%
@@ -299,7 +567,7 @@ class AnalysisService:
                     "confidence": 0.8,
                     "severity": "medium"
                 })
-                print(f"添加特征差异: 特征相似度 {feature_similarity:.4f} < 0.95")
+                logger.debug("添加特征差异: 特征相似度 %.4f < 0.95", feature_similarity)
         
         # 确保differences是Difference对象的列表
         processed_differences = []
@@ -308,8 +576,9 @@ class AnalysisService:
                 processed_differences.append(Difference(
                     type=diff.get("type", "unknown"),
                     description=diff.get("description", ""),
-                    confidence=diff.get("confidence", 0.0),
-                    bbox=diff.get("bbox")
+                    confidence=min(max(difference_confidence(diff), 0.0), 1.0),
+                    bbox=diff.get("bbox"),
+                    severity=diff.get("severity")
                 ))
             elif isinstance(diff, Difference):
                 processed_differences.append(diff)
@@ -317,7 +586,8 @@ class AnalysisService:
             # 确定告警级别
         alert_level = self._determine_alert_level(final_similarity, processed_differences, threshold)
         
-        print(f"最终结果 - 相似度: {final_similarity:.4f}, 差异数量: {len(processed_differences)}, 告警级别: {alert_level}")
+        logger.debug("最终结果 - 相似度: %.4f, 差异数量: %d, 告警级别: %s",
+                     final_similarity, len(processed_differences), alert_level)
         
         return {
             'similarity_score': final_similarity,
@@ -334,7 +604,7 @@ class AnalysisService:
         # 检查差异的严重程度
         for diff in differences:
             if diff.confidence > 0.8:  # 降低置信度阈值
-                if diff.type in ["error", "failure", "danger", "person_detected"]:
+                if diff.type in ERROR_DIFFERENCE_TYPES:
                     return "error"
                 elif diff.type in ["warning", "change", "feature_change"]:
                     return "warning"
@@ -511,71 +781,153 @@ class AnalysisService:
         else:
             return f"图片差异在正常范围内，相似度{(similarity_score * 100):.1f}%，系统运行正常。"
     
-    def save_analysis_record(self, db: Session, image1_path: str, image2_path: str, 
-                           result: AnalysisResult) -> AnalysisRecord:
-        """保存分析记录到数据库"""
-        record = AnalysisRecord(
-            image1_path=image1_path,
-            image2_path=image2_path,
-            similarity_score=result.similarity_score,
-            differences=json.dumps([diff.dict() for diff in result.differences]),
-            alert_level=result.alert_level,
-            analysis_time=result.analysis_time,
-            processing_time=result.processing_time,
-            status="completed"
-        )
+    async def save_analysis_record(self, db: Session, image1_path: str, image2_path: str,
+                                   result: AnalysisResult) -> Optional[AnalysisRecord]:
+        """保存分析记录到数据库
         
-        db.add(record)
-        db.commit()
+        后台写入任务运行时只提交到写入队列（返回None），由后台批量提交；否则同步写入。
+        """
+        fields = dict(self._result_fields(result), image1_path=image1_path, image2_path=image2_path)
+        if result.trace:
+            open_detached_span(result.trace, "persist")
+        if record_writer.running:
+            await record_writer.submit(dict(fields, trace=result.trace))
+            return None
+        
+        record = AnalysisRecord(**fields)
+        with DB_WRITE_SECONDS.time(operation="sync"):
+            db.add(record)
+            db.flush()
+            stats_service.index_records(db, [record])
+            persist_trace(db, record, result.trace, mode="sync")
+            db.commit()
+        DB_WRITE_RECORDS.inc(operation="sync")
         db.refresh(record)
         return record
     
-    def get_analysis_history(self, db: Session, page: int = 1, limit: int = 20) -> Dict[str, Any]:
-        """获取分析历史记录"""
-        offset = (page - 1) * limit
+    def _result_fields(self, result: AnalysisResult) -> Dict[str, Any]:
+        return {
+            "similarity_score": result.similarity_score,
+            "differences": json.dumps([diff.dict() for diff in result.differences]),
+            "alert_level": result.alert_level,
+            "analysis_time": result.analysis_time,
+            "processing_time": result.processing_time,
+            "degraded": result.degraded,
+            "status": "completed",
+            "error_message": None
+        }
+    
+    def apply_analysis_result(self, record: AnalysisRecord, result: AnalysisResult):
+        """将分析结果写入记录并标记为完成"""
+        for key, value in self._result_fields(result).items():
+            setattr(record, key, value)
+    
+    def get_analysis_history(self, db: Session, limit: int = 20, cursor: Optional[str] = None,
+                             alert_level: Optional[str] = None, status: Optional[str] = None,
+                             start_time: Optional[datetime] = None,
+                             end_time: Optional[datetime] = None) -> Dict[str, Any]:
+        """获取分析历史记录（按分析时间倒序的键集分页）
         
-        # 查询记录
-        records = db.query(AnalysisRecord).order_by(
-            AnalysisRecord.analysis_time.desc()
-        ).offset(offset).limit(limit).all()
+        cursor为上一页返回的next_cursor，每页都通过索引直接定位，不随页数加深而变慢。
+        """
+        filters = []
+        if alert_level:
+            filters.append(AnalysisRecord.alert_level == alert_level)
+        if status:
+            filters.append(AnalysisRecord.status == status)
+        if start_time:
+            filters.append(AnalysisRecord.analysis_time >= start_time)
+        if end_time:
+            filters.append(AnalysisRecord.analysis_time < end_time)
         
-        # 查询总数
-        total = db.query(AnalysisRecord).count()
+        query = db.query(AnalysisRecord).filter(*filters)
+        if cursor:
+            cursor_time, cursor_id = decode_history_cursor(cursor)
+            query = query.filter(or_(
+                AnalysisRecord.analysis_time < cursor_time,
+                and_(AnalysisRecord.analysis_time == cursor_time, AnalysisRecord.id < cursor_id)
+            ))
         
+        # 多取一条用于判断是否还有下一页
+        records = query.order_by(
+            AnalysisRecord.analysis_time.desc(), AnalysisRecord.id.desc()
+        ).limit(limit + 1).all()
+        has_more = len(records) > limit
+        records = records[:limit]
+        
+        count_key = (alert_level, status, start_time, end_time)
         return {
             "items": records,
-            "total": total,
-            "page": page,
-            "limit": limit,
-            "pages": (total + limit - 1) // limit
+            "next_cursor": encode_history_cursor(records[-1]) if has_more else None,
+            "total": self._cached_count(db, count_key, filters),
+            "limit": limit
         }
     
-    def batch_analyze(self, image_pairs: List[Dict[str, str]], options: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """批量分析图片对"""
-        results = []
+    def _cached_count(self, db: Session, key: Tuple, filters: List) -> int:
+        """带过期时间的记录总数缓存，避免每次翻页都全表计数"""
+        now = time.time()
+        cached = self._count_cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
         
-        for pair in image_pairs:
-            try:
-                result = self.analyze_images(
-                    pair["image1_path"],
-                    pair["image2_path"],
-                    options.get("threshold", 0.8)
-                )
-                
-                results.append({
-                    "id": pair.get("id", "unknown"),
-                    "status": "success",
-                    "result": result.dict()
-                })
-                
-            except Exception as e:
-                results.append({
-                    "id": pair.get("id", "unknown"),
-                    "status": "error",
-                    "error": str(e)
-                })
+        total = db.query(AnalysisRecord).filter(*filters).count()
+        if len(self._count_cache) >= 256:
+            self._count_cache.clear()
+        self._count_cache[key] = (now + settings.history_count_ttl, total)
+        return total
+    
+    async def _analyze_pair(self, pair: Dict[str, str], options: Dict[str, Any]) -> Dict[str, Any]:
+        """分析单个图片对，异常被捕获为错误结果，不影响批次中的其他图片对"""
+        try:
+            result = await self.analyze_images(
+                pair["image1_path"],
+                pair["image2_path"],
+                options.get("threshold", 0.8),
+                options.get("latency_budget")
+            )
+            
+            return {
+                "id": pair.get("id", "unknown"),
+                "status": "success",
+                "result": result.dict()
+            }
+            
+        except Exception as e:
+            return {
+                "id": pair.get("id", "unknown"),
+                "status": "error",
+                "error": str(e)
+            }
+    
+    def _bounded_pair_runner(self, options: Dict[str, Any]):
+        """创建受并发上限约束的图片对分析函数"""
+        concurrency = int(options.get("concurrency") or settings.batch_concurrency)
+        semaphore = asyncio.Semaphore(max(1, min(concurrency, settings.batch_max_concurrency)))
+        
+        async def run(pair: Dict[str, str]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._analyze_pair(pair, options)
         
-        return results
+        return run
+    
+    async def iter_batch_analyze(self, image_pairs: List[Dict[str, str]],
+                                 options: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """并发批量分析，按完成顺序逐个产出结果"""
+        run = self._bounded_pair_runner(options)
+        tasks = [asyncio.create_task(run(pair)) for pair in image_pairs]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 客户端断开等情况下取消尚未完成的分析
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    async def batch_analyze(self, image_pairs: List[Dict[str, str]], options: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """批量分析图片对（并发执行，结果保持输入顺序）"""
+        run = self._bounded_pair_runner(options)
+        return await asyncio.gather(*(run(pair) for pair in image_pairs))
     
     def get_alert_rules(self, db: Session) -> List[AlertRule]:
         """获取告警规则"""
@@ -589,9 +941,30 @@ class AnalysisService:
         db.refresh(rule)
         return rule
     
-    def test_ollama_connection(self) -> bool:
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取VLM结果缓存统计"""
+        return self.ollama_service.cache.stats()
+    
+    def invalidate_cache(self, image_hash: Optional[str] = None, prompt_version: Optional[str] = None,
+                         model: Optional[str] = None) -> int:
+        """使VLM结果缓存失效"""
+        return self.ollama_service.cache.invalidate(image_hash, prompt_version, model)
+    
+    async def test_ollama_connection(self) -> bool:
         """测试Ollama连接"""
-        return self.ollama_service.test_connection()
+        return await self.ollama_service.test_connection()
+    
+    def get_ollama_endpoints(self) -> List[Dict[str, Any]]:
+        """Ollama推理池各节点的状态"""
+        return self.ollama_service.endpoint_status()
+    
+    def get_ollama_models(self) -> List[Dict[str, Any]]:
+        """各节点上模型的加载状态"""
+        return self.ollama_service.model_status()
+    
+    def get_vlm_circuit(self) -> Dict[str, Any]:
+        """VLM熔断器状态"""
+        return self.ollama_service.circuit_status()
 
 
 # 创建全局服务实例
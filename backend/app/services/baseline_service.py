@@ -0,0 +1,160 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+import numpy as np
+from sqlalchemy.orm import Session
+from app.models.database import Baseline
+from app.services.image_bundle import ImageBundle, load_image_bundle
+from app.services.prescreen import image_hashes
+from app.services.similarity_metrics import image_features
+from app.services.vlm_preprocess import vlm_input_options
+from app.services.upload_store import upload_store
+from app.core.config import settings
+from app.core.workers import run_cpu
+from app.core.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+def _pack_hashes(hashes: Dict[str, np.ndarray]) -> str:
+    """感知哈希比特 -> JSON（十六进制+比特数）"""
+    return json.dumps({
+        name: [np.packbits(bits).tobytes().hex(), int(bits.size)] for name, bits in hashes.items()
+    })
+
+
+def _unpack_hashes(text: Optional[str]) -> Optional[Dict[str, np.ndarray]]:
+    if not text:
+        return None
+    return {
+        name: np.unpackbits(np.frombuffer(bytes.fromhex(value), dtype=np.uint8))[:size].astype(bool)
+        for name, (value, size) in json.loads(text).items()
+    }
+
+
+class BaselineService:
+    """基准图服务
+
+    注册时一次性完成解码、缩略图、统计特征、感知哈希和VLM输入编码，结果保存在
+    基准图数据目录中；对比时通过内存映射加载解码像素，只需解码新上传的画面。
+    """
+
+    PIXELS_FILE = "pixels.npy"
+    THUMBNAIL_FILE = "thumbnail.npy"
+    VLM_FILE = "vlm.json"
+
+    def __init__(self):
+        self.baseline_dir = settings.baseline_dir
+        self.cache_size = settings.baseline_cache_size
+        self._bundles: "OrderedDict[int, ImageBundle]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.baseline_dir, exist_ok=True)
+
+    def _precompute(self, image_path: str, artifact_dir: str) -> Dict[str, Any]:
+        """解码基准图并写入预计算数据（在CPU工作池中执行）"""
+        bundle = load_image_bundle(image_path)
+        os.makedirs(artifact_dir, exist_ok=True)
+        np.save(os.path.join(artifact_dir, self.PIXELS_FILE), np.asarray(bundle.image))
+        np.save(os.path.join(artifact_dir, self.THUMBNAIL_FILE), bundle.thumbnail)
+
+        options = vlm_input_options()
+        with open(os.path.join(artifact_dir, self.VLM_FILE), "w", encoding="utf-8") as vlm_file:
+            json.dump({ImageBundle.vlm_payload_key(options): bundle.vlm_base64_for(options)}, vlm_file)
+
+        return {
+            "content_hash": bundle.content_hash,
+            "original_width": bundle.original_size[0],
+            "original_height": bundle.original_size[1],
+            "features": json.dumps(image_features(bundle.buffers)),
+            "perceptual_hashes": _pack_hashes(image_hashes(bundle))
+        }
+
+    async def register(self, db: Session, image_path: str, name: str,
+                       camera_id: Optional[str] = None) -> Baseline:
+        """注册基准图"""
+        if not os.path.exists(image_path):
+            raise Exception(f"基准图文件不存在: {image_path}")
+
+        baseline = Baseline(name=name, camera_id=camera_id, image_path=image_path)
+        db.add(baseline)
+        db.commit()
+        db.refresh(baseline)
+
+        artifact_dir = os.path.join(self.baseline_dir, str(baseline.id))
+        try:
+            computed = await run_cpu(self._precompute, image_path, artifact_dir)
+        except Exception:
+            db.delete(baseline)
+            db.commit()
+            shutil.rmtree(artifact_dir, ignore_errors=True)
+            raise
+
+        baseline.artifact_dir = artifact_dir
+        for key, value in computed.items():
+            setattr(baseline, key, value)
+        db.commit()
+        db.refresh(baseline)
+        logger.info("基准图注册完成: %s (%s)", baseline.id, name)
+        return baseline
+
+    def get(self, db: Session, baseline_id: int) -> Optional[Baseline]:
+        return db.query(Baseline).filter(Baseline.id == baseline_id).first()
+
+    def list(self, db: Session, camera_id: Optional[str] = None) -> List[Baseline]:
+        query = db.query(Baseline)
+        if camera_id is not None:
+            query = query.filter(Baseline.camera_id == camera_id)
+        return query.order_by(Baseline.id.desc()).all()
+
+    def delete(self, db: Session, baseline: Baseline):
+        """删除基准图及其预计算数据"""
+        with self._lock:
+            self._bundles.pop(baseline.id, None)
+        if baseline.artifact_dir:
+            shutil.rmtree(baseline.artifact_dir, ignore_errors=True)
+        image_path = baseline.image_path
+        db.delete(baseline)
+        db.commit()
+        upload_store.release(db, image_path)
+
+    def _load_bundle(self, baseline: Baseline) -> ImageBundle:
+        """从预计算数据构建数据包，解码像素使用内存映射"""
+        artifact_dir = baseline.artifact_dir
+        pixels = np.load(os.path.join(artifact_dir, self.PIXELS_FILE), mmap_mode='r')
+        thumbnail = np.load(os.path.join(artifact_dir, self.THUMBNAIL_FILE))
+        with open(os.path.join(artifact_dir, self.VLM_FILE), encoding="utf-8") as vlm_file:
+            vlm_payloads = json.load(vlm_file)
+        return ImageBundle.from_precomputed(
+            baseline.image_path, pixels, thumbnail,
+            (baseline.original_width, baseline.original_height), baseline.content_hash,
+            vlm_payloads=vlm_payloads,
+            perceptual_hashes=_unpack_hashes(baseline.perceptual_hashes)
+        )
+
+    async def get_bundle(self, baseline: Baseline) -> ImageBundle:
+        """获取基准图数据包，最近使用的数据包保留在内存中"""
+        with self._lock:
+            bundle = self._bundles.get(baseline.id)
+            if bundle is not None:
+                self._bundles.move_to_end(baseline.id)
+                CACHE_REQUESTS.inc(cache="baseline_bundle", result="hit")
+                return bundle
+        CACHE_REQUESTS.inc(cache="baseline_bundle", result="miss")
+
+        if not baseline.artifact_dir:
+            raise Exception(f"基准图尚未完成预计算: {baseline.id}")
+        bundle = await run_cpu(self._load_bundle, baseline)
+
+        with self._lock:
+            self._bundles[baseline.id] = bundle
+            while len(self._bundles) > self.cache_size:
+                self._bundles.popitem(last=False)
+        return bundle
+
+
+# 创建全局服务实例
+baseline_service = BaselineService()
@@ -0,0 +1,160 @@
+import time
+import logging
+from collections import deque
+from typing import Dict, Any
+from app.core.config import settings
+from app.core.metrics import VLM_CIRCUIT_STATE, VLM_CIRCUIT_REJECTIONS, VLM_CIRCUIT_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+
+CIRCUIT_STATES = ("closed", "open", "half_open")
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，调用被立即拒绝"""
+
+
+class CircuitBreaker:
+    """基于滑动时间窗口的熔断器
+
+    closed: 正常放行，记录最近window秒内每次调用的成败和耗时；调用数达到min_calls且
+            失败率或慢调用率超过阈值时打开。
+    open: 立即拒绝所有调用，open_seconds秒后进入half_open。
+    half_open: 放行最多half_open_calls个试探调用，全部成功（且不慢）后关闭，任一失败重新打开。
+
+    调用结束时才记录结果，因此由call_timeout限制单次调用的最长时间：后端挂起时调用
+    在slow_call_seconds的timeout_factor倍后超时并计为失败，熔断器能及时打开。
+    """
+
+    def __init__(self, name: str, window: float, min_calls: int, failure_rate: float,
+                 slow_call_seconds: float, slow_call_rate: float, open_seconds: float,
+                 half_open_calls: int, enabled: bool = True, timeout_factor: float = 0.0):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.enabled = enabled
+        self.timeout_factor = timeout_factor
+
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._calls: deque = deque()  # (时间, 是否失败, 是否慢调用)
+        self._probes = 0  # half_open状态下已放行的试探调用数
+        self._probe_successes = 0
+        self._export_state()
+
+    @property
+    def state(self) -> str:
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition("half_open")
+        return self._state
+
+    def before_call(self):
+        """调用前检查，拒绝时抛出CircuitOpenError"""
+        if not self.enabled:
+            return
+        state = self.state
+        if state == "open":
+            VLM_CIRCUIT_REJECTIONS.inc(circuit=self.name)
+            retry_after = self.open_seconds - (time.monotonic() - self._opened_at)
+            raise CircuitOpenError(f"{self.name}熔断器已打开，{max(retry_after, 0):.0f}秒后重试")
+        if state == "half_open":
+            if self._probes >= self.half_open_calls:
+                VLM_CIRCUIT_REJECTIONS.inc(circuit=self.name)
+                raise CircuitOpenError(f"{self.name}熔断器半开，试探调用进行中")
+            self._probes += 1
+
+    def call_timeout(self, timeout: float) -> float:
+        """单次调用的超时时间：启用时不超过慢调用阈值的timeout_factor倍"""
+        if not self.enabled or self.timeout_factor <= 0:
+            return timeout
+        return min(timeout, self.slow_call_seconds * self.timeout_factor)
+
+    def record(self, success: bool, latency: float):
+        """记录一次调用的结果"""
+        if not self.enabled:
+            return
+        slow = latency >= self.slow_call_seconds
+        if self._state == "half_open":
+            if not success or slow:
+                self._transition("open")
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._transition("closed")
+            return
+        if self._state == "open":
+            # 打开前已放行的调用结束
+            return
+
+        now = time.monotonic()
+        self._calls.append((now, not success, slow))
+        self._prune(now)
+        if len(self._calls) < self.min_calls:
+            return
+        failures = sum(1 for _, failed, _ in self._calls if failed)
+        slow_calls = sum(1 for _, _, was_slow in self._calls if was_slow)
+        if failures / len(self._calls) >= self.failure_rate or slow_calls / len(self._calls) >= self.slow_call_rate:
+            self._transition("open")
+
+    def release(self):
+        """调用被取消（既不算成功也不算失败）时归还试探名额"""
+        if self.enabled and self._state == "half_open" and self._probes > 0:
+            self._probes -= 1
+
+    def _prune(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _transition(self, state: str):
+        if state == self._state:
+            return
+        if state == "open":
+            logger.warning("%s熔断器打开，%.0f秒内快速失败", self.name, self.open_seconds)
+            self._opened_at = time.monotonic()
+        elif state == "closed":
+            logger.info("%s熔断器关闭，恢复正常调用", self.name)
+        self._state = state
+        self._calls.clear()
+        self._probes = 0
+        self._probe_successes = 0
+        VLM_CIRCUIT_TRANSITIONS.inc(circuit=self.name, state=state)
+        self._export_state()
+
+    def _export_state(self):
+        for state in CIRCUIT_STATES:
+            VLM_CIRCUIT_STATE.set(1 if state == self._state else 0, circuit=self.name, state=state)
+
+    def status(self) -> Dict[str, Any]:
+        state = self.state
+        self._prune(time.monotonic())
+        calls = len(self._calls)
+        failures = sum(1 for _, failed, _ in self._calls if failed)
+        return {
+            "enabled": self.enabled,
+            "state": state,
+            "window_calls": calls,
+            "failure_rate": failures / calls if calls else 0.0,
+            "retry_after": max(self.open_seconds - (time.monotonic() - self._opened_at), 0.0)
+            if state == "open" else None
+        }
+
+
+def create_vlm_breaker(name: str = "ollama") -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        window=settings.vlm_breaker_window,
+        min_calls=settings.vlm_breaker_min_calls,
+        failure_rate=settings.vlm_breaker_failure_rate,
+        slow_call_seconds=settings.vlm_breaker_slow_call_seconds,
+        slow_call_rate=settings.vlm_breaker_slow_call_rate,
+        open_seconds=settings.vlm_breaker_open_seconds,
+        half_open_calls=settings.vlm_breaker_half_open_calls,
+        enabled=settings.vlm_breaker_enabled,
+        timeout_factor=settings.vlm_breaker_timeout_factor
+    )
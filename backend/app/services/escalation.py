@@ -0,0 +1,113 @@
+import time
+from typing import Dict, Any, Optional
+from app.core.config import settings
+from app.services.stream_parser import difference_confidence
+
+
+class Deadline:
+    """单次分析的延迟预算"""
+
+    def __init__(self, budget: Optional[float] = None):
+        # 预算为None或不大于0表示不限时
+        self.budget = budget if budget and budget > 0 else None
+        self.start_time = time.time()
+
+    def remaining(self) -> Optional[float]:
+        """剩余时间（秒），不限时返回None"""
+        if self.budget is None:
+            return None
+        return self.budget - (time.time() - self.start_time)
+
+    def timeout_for(self, default: float) -> float:
+        """当前阶段可用的超时时间，不超过剩余预算"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return max(0.0, min(default, remaining))
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+
+class EscalationPolicy:
+    """二次VLM分析的升级策略基类"""
+
+    name = "base"
+
+    def decide(self, prescreen: Dict[str, Any], first_pass: Dict[str, Any], deadline: Deadline,
+               expected_latency: Optional[float]) -> Dict[str, Any]:
+        """返回 {"escalate": bool, "reason": str}"""
+        raise NotImplementedError
+
+
+class NeverEscalate(EscalationPolicy):
+    """从不进行二次分析"""
+
+    name = "never"
+
+    def decide(self, prescreen, first_pass, deadline, expected_latency):
+        return {"escalate": False, "reason": "policy_never"}
+
+
+class SimilarityEscalation(EscalationPolicy):
+    """原有行为：首次结果相似度高于0.9时总是进行二次分析"""
+
+    name = "similarity"
+
+    def decide(self, prescreen, first_pass, deadline, expected_latency):
+        if first_pass.get('similarity_score', 0) > 0.9:
+            return {"escalate": True, "reason": "high_similarity"}
+        return {"escalate": False, "reason": "low_similarity"}
+
+
+class BudgetedEscalation(EscalationPolicy):
+    """根据预筛选置信度、首次结果置信度和剩余延迟预算决定是否二次分析
+
+    只有在首次结果不可信时才升级：模型输出无法解析、预筛选确信有变化但模型未报告差异、
+    或者模型报告的差异置信度都偏低。剩余预算不足以完成一次推理时不升级。
+    """
+
+    name = "budgeted"
+
+    def __init__(self):
+        self.confidence_threshold = settings.escalation_confidence_threshold
+        self.prescreen_confidence = settings.escalation_prescreen_confidence
+        self.budget_margin = settings.escalation_budget_margin
+
+    def decide(self, prescreen, first_pass, deadline, expected_latency):
+        remaining = deadline.remaining()
+        if remaining is not None and expected_latency is not None \
+                and remaining < expected_latency * self.budget_margin:
+            return {"escalate": False, "reason": "insufficient_budget"}
+
+        if not first_pass.get('parsed', True):
+            return {"escalate": True, "reason": "unparsed_response"}
+
+        differences = first_pass.get('differences', [])
+        if not differences:
+            if prescreen.get('decision') == 'analyze' and prescreen.get('tier') == 'tiles' \
+                    and prescreen.get('confidence', 0) >= self.prescreen_confidence:
+                return {"escalate": True, "reason": "prescreen_disagreement"}
+            return {"escalate": False, "reason": "confident_no_change"}
+
+        max_confidence = max(
+            (difference_confidence(diff) for diff in differences if isinstance(diff, dict)), default=0
+        )
+        if max_confidence < self.confidence_threshold:
+            return {"escalate": True, "reason": "low_confidence"}
+        return {"escalate": False, "reason": "confident_first_pass"}
+
+
+ESCALATION_POLICIES = {
+    NeverEscalate.name: NeverEscalate,
+    SimilarityEscalation.name: SimilarityEscalation,
+    BudgetedEscalation.name: BudgetedEscalation
+}
+
+
+def get_escalation_policy(name: str) -> EscalationPolicy:
+    """按名称创建升级策略"""
+    if name not in ESCALATION_POLICIES:
+        raise ValueError(f"未知的升级策略: {name}")
+    return ESCALATION_POLICIES[name]()
@@ -0,0 +1,153 @@
+import io
+import json
+import base64
+import hashlib
+from typing import Dict, Any, Optional
+from PIL import Image
+import numpy as np
+from app.core.config import settings
+from app.services.vlm_preprocess import vlm_input_options, prepare_vlm_image
+from app.services.upload_store import upload_store
+
+
+# 相似度计算使用的缩略图尺寸
+THUMBNAIL_SIZE = (224, 224)
+
+
+class ImageBundle:
+    """单次请求内的图片数据包
+
+    每张图片只读取、解码一次，缩略图、指标计算缓冲区和base64编码结果都缓存在这里，
+    供分析workflow的各个阶段共享。
+    """
+
+    def __init__(self, image_path: str, max_side: Optional[int] = None):
+        self.path = image_path
+        self.max_side = max_side or settings.image_decode_max_side
+
+        with open(image_path, "rb") as image_file:
+            self._raw_bytes: Optional[bytes] = image_file.read()
+
+        self.original_size, self.image = self._decode(self._raw_bytes, self.max_side)
+        self.thumbnail = np.asarray(self.image.resize(THUMBNAIL_SIZE))
+        self._init_caches()
+
+    def _init_caches(self):
+        self._buffers: Optional[Dict[str, np.ndarray]] = None
+        self._vlm_payloads: Dict[str, str] = {}
+        self._content_hash: Optional[str] = None
+        # 感知哈希由预筛选阶段按需填充
+        self.perceptual_hashes: Optional[Dict[str, np.ndarray]] = None
+
+    @classmethod
+    def from_precomputed(cls, image_path: str, pixels: np.ndarray, thumbnail: np.ndarray,
+                         original_size, content_hash: str,
+                         vlm_payloads: Optional[Dict[str, str]] = None,
+                         perceptual_hashes: Optional[Dict[str, np.ndarray]] = None,
+                         buffers: Optional[Dict[str, np.ndarray]] = None) -> "ImageBundle":
+        """由预先计算的解码像素（可为内存映射数组）构建数据包，不读取、不解码原始文件"""
+        bundle = cls.__new__(cls)
+        bundle.path = image_path
+        bundle.max_side = max(pixels.shape[:2])
+        bundle._raw_bytes = None
+        bundle.original_size = tuple(original_size)
+        bundle.image = Image.fromarray(pixels)
+        bundle.thumbnail = thumbnail
+        bundle._init_caches()
+        bundle._content_hash = content_hash
+        bundle._vlm_payloads.update(vlm_payloads or {})
+        bundle.perceptual_hashes = perceptual_hashes
+        bundle._buffers = buffers
+        return bundle
+
+    @property
+    def raw_bytes(self) -> bytes:
+        """原始文件内容（预计算的数据包在首次需要时才读取）"""
+        if self._raw_bytes is None:
+            with open(self.path, "rb") as image_file:
+                self._raw_bytes = image_file.read()
+        return self._raw_bytes
+
+    @staticmethod
+    def _decode(raw_bytes: bytes, max_side: int):
+        """解码图片，JPEG等格式使用draft模式直接按比例缩小解码，返回 (原始尺寸, 解码图片)"""
+        img = Image.open(io.BytesIO(raw_bytes))
+        original_size = img.size
+        # draft只会选择不小于目标尺寸的缩放比例，对不支持的格式无效果
+        img.draft('RGB', (max_side, max_side))
+        img = img.convert('RGB')
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side))
+        return original_size, img
+
+    @property
+    def size(self):
+        """解码后的工作尺寸 (width, height)"""
+        return self.image.size
+
+    @property
+    def buffers(self) -> Dict[str, np.ndarray]:
+        """相似度指标共享的缓冲区：缩略图的float32 RGB、灰度图和各通道32级直方图"""
+        if self._buffers is None:
+            rgb = self.thumbnail.astype(np.float32)
+            gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+            histogram = np.stack([
+                np.bincount((self.thumbnail[..., channel] >> 3).ravel(), minlength=32)
+                for channel in range(3)
+            ])
+            self._buffers = {"rgb": rgb, "gray": gray, "histogram": histogram}
+        return self._buffers
+
+    @property
+    def content_hash(self) -> str:
+        """原始文件内容的SHA-256，用作缓存键（内容寻址存储中的文件直接取文件名）"""
+        if self._content_hash is None:
+            self._content_hash = upload_store.content_hash_of(self.path) \
+                or hashlib.sha256(self.raw_bytes).hexdigest()
+        return self._content_hash
+
+    @property
+    def vlm_base64(self) -> str:
+        """按配置预处理后发送给VLM的base64编码（只编码一次）"""
+        return self.vlm_base64_for(vlm_input_options())
+
+    @staticmethod
+    def vlm_payload_key(options: Dict[str, Any]) -> str:
+        return json.dumps(options, sort_keys=True)
+
+    def vlm_base64_for(self, options: Dict[str, Any]) -> str:
+        """按指定预处理参数生成VLM输入，结果按参数缓存"""
+        key = self.vlm_payload_key(options)
+        if key not in self._vlm_payloads:
+            payload = prepare_vlm_image(self.image, self.raw_bytes, options)
+            self._vlm_payloads[key] = base64.b64encode(payload).decode('utf-8')
+        return self._vlm_payloads[key]
+
+    def describe(self) -> Dict[str, Any]:
+        """返回用于日志的简要信息"""
+        return {
+            "path": self.path,
+            "bytes": len(self._raw_bytes) if self._raw_bytes is not None else None,
+            "original_size": self.original_size,
+            "decoded_size": self.size
+        }
+
+
+def load_image_bundle(image_path: str) -> ImageBundle:
+    """加载图片数据包"""
+    try:
+        return ImageBundle(image_path)
+    except Exception as e:
+        raise Exception(f"图片解码失败: {image_path}, {str(e)}")
+
+
+def file_content_hash(image_path: str) -> str:
+    """图片文件内容的SHA-256（与ImageBundle.content_hash一致），不解码图片"""
+    stored = upload_store.content_hash_of(image_path)
+    if stored:
+        return stored
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,60 @@
+from typing import Dict, Any
+import numpy as np
+from app.core.workers import run_cpu, run_process, process_pool_enabled
+from app.core.shared_arrays import export_arrays, import_arrays, discard_arrays
+from app.services.image_bundle import ImageBundle, load_image_bundle
+from app.services.prescreen import image_hashes
+
+
+def decode_in_worker(image_path: str) -> Dict[str, Any]:
+    """在子进程中加载图片数据包，并预先计算缩略图缓冲区、感知哈希和内容哈希
+
+    解码像素、缩略图和指标缓冲区写入共享内存，只有描述信息和很小的哈希数组经pickle传回。
+    """
+    bundle = load_image_bundle(image_path)
+    buffers = bundle.buffers
+    decoded = {
+        "original_size": bundle.original_size,
+        "max_side": bundle.max_side,
+        "content_hash": bundle.content_hash,
+        "perceptual_hashes": image_hashes(bundle)
+    }
+    decoded["shared"] = export_arrays({
+        "pixels": np.asarray(bundle.image),
+        "thumbnail": bundle.thumbnail,
+        "rgb": buffers["rgb"],
+        "gray": buffers["gray"],
+        "histogram": buffers["histogram"]
+    })
+    return decoded
+
+
+def bundle_from_worker(image_path: str, decoded: Dict[str, Any]) -> ImageBundle:
+    """由子进程的解码结果构建数据包（从共享内存复制像素后释放共享内存）"""
+    arrays = import_arrays(decoded["shared"])
+    bundle = ImageBundle.from_precomputed(
+        image_path, arrays["pixels"], arrays["thumbnail"], decoded["original_size"], decoded["content_hash"],
+        perceptual_hashes=decoded["perceptual_hashes"],
+        buffers={name: arrays[name] for name in ("rgb", "gray", "histogram")}
+    )
+    bundle.max_side = decoded["max_side"]
+    return bundle
+
+
+def _discard_decoded(decoded: Dict[str, Any]):
+    discard_arrays(decoded["shared"])
+
+
+async def load_image_bundle_async(image_path: str) -> ImageBundle:
+    """在CPU工作池中加载图片数据包
+
+    process模式下解码等持有GIL较多的步骤在进程池中执行，充分利用多核；thread模式下在线程池中执行。
+    """
+    if not process_pool_enabled():
+        return await run_cpu(load_image_bundle, image_path)
+    decoded = await run_process(decode_in_worker, image_path, on_abandoned=_discard_decoded)
+    try:
+        return bundle_from_worker(image_path, decoded)
+    except BaseException:
+        _discard_decoded(decoded)
+        raise
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from typing import Dict, Any, Optional, Set
+from sqlalchemy.orm import Session
+from app.models.database import AnalysisRecord, SessionLocal
+from app.services.analysis_service import analysis_service
+from app.services.stats_service import stats_service
+from app.services.record_writer import persist_trace
+from app.core.config import settings
+from app.core.metrics import DB_WRITE_SECONDS, DB_WRITE_RECORDS
+from app.core.tracing import open_detached_span
+
+logger = logging.getLogger(__name__)
+
+
+class JobService:
+    """异步分析任务服务
+
+    提交时先持久化一条pending状态的分析记录并立即返回记录ID作为任务ID，
+    分析在进程内的工作池中执行，状态依次更新为processing、completed或failed。
+    """
+
+    def __init__(self):
+        self.analysis_service = analysis_service
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._events: Dict[int, asyncio.Event] = {}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """工作池并发上限（在事件循环中首次使用时创建）"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.job_workers)
+        return self._semaphore
+
+    def submit(self, db: Session, image1_path: str, image2_path: str, threshold: float = 0.8,
+               latency_budget: Optional[float] = None) -> int:
+        """创建pending记录并调度分析任务，返回任务ID"""
+        record = AnalysisRecord(
+            image1_path=image1_path,
+            image2_path=image2_path,
+            status="pending",
+            threshold=threshold,
+            latency_budget=latency_budget
+        )
+        db.add(record)
+        db.commit()
+        db.refresh(record)
+
+        self._schedule(record.id, image1_path, image2_path, threshold, latency_budget)
+        return record.id
+
+    def _schedule(self, record_id: int, image1_path: str, image2_path: str, threshold: float,
+                  latency_budget: Optional[float] = None):
+        """将任务加入进程内工作池"""
+        self._events.setdefault(record_id, asyncio.Event())
+        task = asyncio.create_task(self._run(record_id, image1_path, image2_path, threshold, latency_budget))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, record_id: int, image1_path: str, image2_path: str, threshold: float,
+                   latency_budget: Optional[float] = None):
+        """执行分析并更新记录状态"""
+        try:
+            async with self._get_semaphore():
+                self._update_record(record_id, status="processing")
+                try:
+                    result = await self.analysis_service.analyze_images(
+                        image1_path, image2_path, threshold, latency_budget
+                    )
+                except Exception as e:
+                    logger.warning("分析任务 %s 失败: %s", record_id, e)
+                    self._mark_failed(record_id, str(e))
+                    return
+
+                db = SessionLocal()
+                try:
+                    record = db.query(AnalysisRecord).filter(AnalysisRecord.id == record_id).first()
+                    if record is not None:
+                        if result.trace:
+                            open_detached_span(result.trace, "persist")
+                        with DB_WRITE_SECONDS.time(operation="job"):
+                            self.analysis_service.apply_analysis_result(record, result)
+                            db.flush()
+                            stats_service.index_records(db, [record])
+                            persist_trace(db, record, result.trace, mode="job")
+                            db.commit()
+                        DB_WRITE_RECORDS.inc(operation="job")
+                except Exception as e:
+                    # 写入结果失败时记录不能停留在processing状态，否则只能等重启后重新调度
+                    db.rollback()
+                    logger.exception("保存分析任务 %s 的结果失败: %s", record_id, e)
+                    self._mark_failed(record_id, f"保存分析结果失败: {str(e)}")
+                finally:
+                    db.close()
+        finally:
+            event = self._events.pop(record_id, None)
+            if event is not None:
+                event.set()
+
+    def _update_record(self, record_id: int, **fields: Any):
+        """更新记录状态字段"""
+        db = SessionLocal()
+        try:
+            db.query(AnalysisRecord).filter(AnalysisRecord.id == record_id).update(fields)
+            db.commit()
+        finally:
+            db.close()
+
+    def _mark_failed(self, record_id: int, error_message: str):
+        """在新的会话中将记录标记为failed"""
+        try:
+            self._update_record(record_id, status="failed", error_message=error_message)
+        except Exception as e:
+            logger.error("更新分析任务 %s 的失败状态失败: %s", record_id, e)
+
+    async def wait(self, record_id: int, timeout: float) -> bool:
+        """等待任务完成，任务已结束或在超时前完成时返回True"""
+        event = self._events.get(record_id)
+        if event is None:
+            return True
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def recover(self):
+        """服务启动时重新调度上次未完成的任务"""
+        db = SessionLocal()
+        try:
+            records = db.query(AnalysisRecord).filter(
+                AnalysisRecord.status.in_(["pending", "processing"])
+            ).all()
+            for record in records:
+                # 升级前提交的任务没有保存阈值，使用默认阈值
+                threshold = record.threshold if record.threshold is not None else 0.8
+                self._schedule(record.id, record.image1_path, record.image2_path, threshold,
+                               record.latency_budget)
+            if records:
+                logger.info("重新调度 %d 个未完成的分析任务", len(records))
+        finally:
+            db.close()
+
+    async def shutdown(self):
+        """取消进行中的任务，未完成的记录在下次启动时重新调度"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# 创建全局服务实例
+job_service = JobService()
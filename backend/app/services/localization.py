@@ -0,0 +1,226 @@
+import base64
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+from PIL import Image, ImageDraw
+import numpy as np
+from app.core.config import settings
+from app.services.image_bundle import ImageBundle
+from app.services.prescreen import tile_change_map
+from app.services.vlm_preprocess import vlm_input_options, prepare_vlm_image
+
+
+LOCALIZATION_MODES = ("off", "crops", "composite")
+
+# 拼接图中前后两张裁剪图之间、各区域之间的间隔（像素）
+_COMPOSITE_GAP = 8
+_LABEL_HEIGHT = 20
+
+
+def connected_regions(mask: np.ndarray) -> List[List[Tuple[int, int]]]:
+    """8连通分量标记，返回每个连通区域包含的块坐标 (row, col)"""
+    rows, cols = mask.shape
+    visited = np.zeros_like(mask, dtype=bool)
+    regions = []
+    for row, col in zip(*np.nonzero(mask)):
+        if visited[row, col]:
+            continue
+        visited[row, col] = True
+        queue = deque([(int(row), int(col))])
+        tiles = []
+        while queue:
+            r, c = queue.popleft()
+            tiles.append((r, c))
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    nr, nc = r + dr, c + dc
+                    if 0 <= nr < rows and 0 <= nc < cols and mask[nr, nc] and not visited[nr, nc]:
+                        visited[nr, nc] = True
+                        queue.append((nr, nc))
+        regions.append(tiles)
+    return regions
+
+
+def _tile_box(tiles: List[Tuple[int, int]], padding: int, shape: Tuple[int, int]) -> List[int]:
+    """区域的块坐标外接框（含padding），格式 [col1, row1, col2, row2)，右下为开区间"""
+    rows = [r for r, _ in tiles]
+    cols = [c for _, c in tiles]
+    return [
+        max(0, min(cols) - padding),
+        max(0, min(rows) - padding),
+        min(shape[1], max(cols) + 1 + padding),
+        min(shape[0], max(rows) + 1 + padding)
+    ]
+
+
+def scale_box(box: List[int], from_size: Tuple[int, int], to_size: Tuple[int, int]) -> List[int]:
+    """把 [x1, y1, x2, y2) 从一个图片尺寸按比例换算到另一个尺寸，并限制在图片范围内"""
+    sx, sy = to_size[0] / from_size[0], to_size[1] / from_size[1]
+    x1 = min(max(int(round(box[0] * sx)), 0), to_size[0] - 1)
+    y1 = min(max(int(round(box[1] * sy)), 0), to_size[1] - 1)
+    x2 = min(max(int(round(box[2] * sx)), x1 + 1), to_size[0])
+    y2 = min(max(int(round(box[3] * sy)), y1 + 1), to_size[1])
+    return [x1, y1, x2, y2]
+
+
+def _boxes_overlap(box1: List[int], box2: List[int]) -> bool:
+    return box1[0] < box2[2] and box2[0] < box1[2] and box1[1] < box2[3] and box2[1] < box1[3]
+
+
+def _merge_overlapping(regions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """合并padding后外接框相互重叠的区域，避免同一目标被拆成多张裁剪图"""
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                if _boxes_overlap(regions[i]["tile_box"], regions[j]["tile_box"]):
+                    a, b = regions[i], regions.pop(j)
+                    a["tile_box"] = [
+                        min(a["tile_box"][0], b["tile_box"][0]), min(a["tile_box"][1], b["tile_box"][1]),
+                        max(a["tile_box"][2], b["tile_box"][2]), max(a["tile_box"][3], b["tile_box"][3])
+                    ]
+                    a["core_box"] = [
+                        min(a["core_box"][0], b["core_box"][0]), min(a["core_box"][1], b["core_box"][1]),
+                        max(a["core_box"][2], b["core_box"][2]), max(a["core_box"][3], b["core_box"][3])
+                    ]
+                    a["tiles"] += b["tiles"]
+                    a["score"] += b["score"]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+
+class ChangeLocalizer:
+    """基于分块变化检测的差异定位
+
+    由变化块构建连通区域，得到确定性的像素边界框；只把变化区域的裁剪图
+    （或前后对照的拼接图）发送给VLM，减少视觉token数量。
+    """
+
+    def __init__(self):
+        self.mode = settings.localization_mode
+        self.max_regions = settings.localization_max_regions
+        self.max_area_ratio = settings.localization_max_area_ratio
+        self.padding_tiles = settings.localization_padding_tiles
+        self.crop_side = settings.localization_crop_side
+
+        if self.mode not in LOCALIZATION_MODES:
+            raise ValueError(f"未知的差异定位模式: {self.mode}")
+
+    def locate(self, bundle1: ImageBundle, bundle2: ImageBundle, prescreen: Dict[str, Any]) -> Dict[str, Any]:
+        """定位变化区域
+
+        返回 {"mode", "regions", "area_ratio", "fallback"}。fallback不为None时表示
+        不适合局部分析（无变化块、区域过多或面积过大），应退回整图分析。
+        """
+        report = {"mode": self.mode, "regions": [], "area_ratio": 0.0, "fallback": None}
+        if self.mode == "off":
+            report["fallback"] = "disabled"
+            return report
+
+        # 预筛选在哈希层做出决定时没有分块结果，这里补算
+        tile_map = prescreen.get("tile_map") or tile_change_map(
+            bundle1, bundle2, settings.prescreen_max_side, settings.prescreen_tile_size,
+            settings.prescreen_tile_threshold, settings.prescreen_noise_k
+        )
+        mask = tile_map["mask"]
+        scores = tile_map["scores"]
+        if not mask.any():
+            report["fallback"] = "no_changed_tiles"
+            return report
+
+        regions = []
+        for tiles in connected_regions(mask):
+            regions.append({
+                "tiles": len(tiles),
+                "score": float(sum(scores[r, c] for r, c in tiles)),
+                "core_box": _tile_box(tiles, 0, mask.shape),
+                "tile_box": _tile_box(tiles, self.padding_tiles, mask.shape)
+            })
+        regions = _merge_overlapping(regions)
+
+        covered = sum((box[2] - box[0]) * (box[3] - box[1]) for box in (r["tile_box"] for r in regions))
+        report["area_ratio"] = covered / mask.size
+        if len(regions) > self.max_regions:
+            report["fallback"] = "too_many_regions"
+            return report
+        if report["area_ratio"] > self.max_area_ratio:
+            report["fallback"] = "area_too_large"
+            return report
+
+        # 块坐标 -> 解码图坐标 -> 原图坐标
+        tile_px = tile_map["tile_size"] / tile_map["scale"]
+        width, height = bundle1.size
+        to_original = bundle1.original_size[0] / width
+
+        def to_pixels(box: List[int], factor: float = 1.0) -> List[int]:
+            return [
+                int(round(min(box[0] * tile_px, width) * factor)),
+                int(round(min(box[1] * tile_px, height) * factor)),
+                int(round(min(box[2] * tile_px, width) * factor)),
+                int(round(min(box[3] * tile_px, height) * factor))
+            ]
+
+        regions.sort(key=lambda region: region["score"], reverse=True)
+        for index, region in enumerate(regions, start=1):
+            report["regions"].append({
+                "index": index,
+                "bbox": to_pixels(region["core_box"], to_original),
+                "crop_box": to_pixels(region["tile_box"]),
+                "tiles": region["tiles"],
+                "score": region["score"] / region["tiles"]
+            })
+        return report
+
+    def _crop(self, bundle: ImageBundle, crop_box: List[int], reference_size: Tuple[int, int]) -> Image.Image:
+        """裁剪区域；crop_box是变化前图片（reference_size）上的坐标，尺寸不同的图片按比例换算"""
+        crop = bundle.image.crop(tuple(scale_box(crop_box, reference_size, bundle.size)))
+        if max(crop.size) > self.crop_side:
+            crop.thumbnail((self.crop_side, self.crop_side), Image.LANCZOS)
+        return crop
+
+    def build_composite(self, bundle1: ImageBundle, bundle2: ImageBundle,
+                        regions: List[Dict[str, Any]]) -> Image.Image:
+        """生成前后对照拼接图：每个区域一行，左为变化前、右为变化后，行首标注区域编号"""
+        rows = [(region["index"], self._crop(bundle1, region["crop_box"], bundle1.size),
+                 self._crop(bundle2, region["crop_box"], bundle1.size))
+                for region in regions]
+        width = max(before.width + after.width for _, before, after in rows) + _COMPOSITE_GAP * 3
+        height = sum(
+            _LABEL_HEIGHT + max(before.height, after.height) + _COMPOSITE_GAP for _, before, after in rows
+        ) + _COMPOSITE_GAP
+
+        canvas = Image.new('RGB', (width, height), (255, 255, 255))
+        draw = ImageDraw.Draw(canvas)
+        y = _COMPOSITE_GAP
+        for index, before, after in rows:
+            draw.text((_COMPOSITE_GAP, y + 4), f"#{index}  before | after", fill=(0, 0, 0))
+            y += _LABEL_HEIGHT
+            canvas.paste(before, (_COMPOSITE_GAP, y))
+            canvas.paste(after, (_COMPOSITE_GAP * 2 + before.width, y))
+            y += max(before.height, after.height) + _COMPOSITE_GAP
+        return canvas
+
+    def build_images(self, bundle1: ImageBundle, bundle2: ImageBundle,
+                     regions: List[Dict[str, Any]], options: Optional[Dict[str, Any]] = None) -> List[str]:
+        """按定位模式生成发送给VLM的base64图片列表
+
+        composite模式为一张拼接图；crops模式为每个区域的变化前、变化后两张裁剪图。
+        """
+        options = dict(options or vlm_input_options())
+        if options["format"] == "original":
+            options["format"] = "JPEG"
+        if self.mode == "composite":
+            images = [self.build_composite(bundle1, bundle2, regions)]
+        else:
+            images = []
+            for region in regions:
+                images.append(self._crop(bundle1, region["crop_box"], bundle1.size))
+                images.append(self._crop(bundle2, region["crop_box"], bundle1.size))
+        return [base64.b64encode(prepare_vlm_image(image, b"", options)).decode('utf-8') for image in images]
+
+
+# 创建全局实例
+change_localizer = ChangeLocalizer()
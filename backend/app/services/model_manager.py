@@ -0,0 +1,218 @@
+import re
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+from app.core.config import settings
+from app.core.metrics import OLLAMA_MODEL_LOADED, OLLAMA_MODEL_LOAD_SECONDS, OLLAMA_MODEL_WARMUPS
+from app.services.ollama_pool import OllamaPool, OllamaEndpoint
+
+logger = logging.getLogger(__name__)
+
+
+# Ollama返回的load_duration超过该值（秒）视为一次冷加载（模型已常驻时通常只有几毫秒）
+COLD_LOAD_SECONDS = 0.5
+
+_FRACTION = re.compile(r"(\.\d{6})\d+")
+
+
+def keep_alive_value(value: str) -> Any:
+    """keep_alive配置：纯数字按秒发送（负数表示永久常驻），否则按时长字符串（如30m）发送"""
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def parse_expires_at(value: Optional[str]) -> Optional[float]:
+    """解析/api/ps中的expires_at（RFC3339，可能带纳秒），返回Unix时间戳"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(_FRACTION.sub(r"\1", value.replace("Z", "+00:00")))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class ModelState:
+    """一个节点上一个模型的加载状态"""
+
+    __slots__ = ("state", "loaded_at", "expires_at", "last_load_seconds", "cold_loads", "warmups", "error")
+
+    def __init__(self):
+        self.state = "unknown"  # unknown, loading, loaded, evicted, failed
+        self.loaded_at: Optional[float] = None
+        self.expires_at: Optional[float] = None
+        self.last_load_seconds: Optional[float] = None
+        self.cold_loads = 0
+        self.warmups = 0
+        self.error: Optional[str] = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "loaded_at": self.loaded_at,
+            "expires_at": self.expires_at,
+            "last_load_seconds": self.last_load_seconds,
+            "cold_loads": self.cold_loads,
+            "warmups": self.warmups,
+            "error": self.error
+        }
+
+
+class ModelManager:
+    """Ollama模型生命周期管理
+
+    启动时在每个节点上预热配置的模型，之后定期通过/api/ps检查模型是否仍在显存中：
+    已被卸载或keep_alive即将到期的模型会被主动重新预热，使请求不必承担模型加载耗时。
+    推理响应中的load_duration用于记录请求触发的冷加载。
+    """
+
+    def __init__(self, pool: OllamaPool, models: List[str]):
+        self.pool = pool
+        self.models = models
+        self.keep_alive = keep_alive_value(settings.ollama_keep_alive)
+        self._states: Dict[Tuple[str, str], ModelState] = {}
+        self._warming: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _state(self, endpoint_url: str, model: str) -> ModelState:
+        key = (endpoint_url, model)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = ModelState()
+        return state
+
+    def _set_loaded(self, endpoint_url: str, model: str, loaded: bool):
+        state = self._state(endpoint_url, model)
+        if loaded:
+            if state.state != "loaded":
+                state.loaded_at = time.time()
+            state.state = "loaded"
+            state.error = None
+        elif state.state == "loaded":
+            logger.info("模型 %s 已从节点 %s 卸载", model, endpoint_url)
+            state.state = "evicted"
+            state.expires_at = None
+        OLLAMA_MODEL_LOADED.set(1 if loaded else 0, endpoint=endpoint_url, model=model)
+
+    def observe(self, endpoint_url: str, model: str, result: Dict[str, Any]):
+        """根据推理响应更新状态：load_duration较大说明本次请求承担了模型加载"""
+        load_seconds = result.get("load_duration", 0) / 1e9
+        state = self._state(endpoint_url, model)
+        if load_seconds >= COLD_LOAD_SECONDS:
+            state.cold_loads += 1
+            state.last_load_seconds = load_seconds
+            OLLAMA_MODEL_LOAD_SECONDS.observe(load_seconds, endpoint=endpoint_url, model=model, trigger="request")
+            logger.info("请求触发模型 %s 在节点 %s 冷加载，耗时 %.1f 秒", model, endpoint_url, load_seconds)
+        self._set_loaded(endpoint_url, model, True)
+
+    async def warmup(self, endpoint: OllamaEndpoint, model: str) -> bool:
+        """发送空提示词请求加载模型并设置keep_alive（不执行推理）"""
+        state = self._state(endpoint.url, model)
+        previous = state.state
+        state.state = "loading"
+        state.warmups += 1
+        try:
+            response = await endpoint.client.post("/api/generate", json={
+                "model": model, "prompt": "", "stream": False, "keep_alive": self.keep_alive
+            })
+            response.raise_for_status()
+            result = response.json()
+        except asyncio.CancelledError:
+            state.state = previous
+            raise
+        except Exception as e:
+            state.state = "failed"
+            state.error = str(e)
+            OLLAMA_MODEL_WARMUPS.inc(endpoint=endpoint.url, model=model, outcome="failure")
+            OLLAMA_MODEL_LOADED.set(0, endpoint=endpoint.url, model=model)
+            logger.warning("节点 %s 预热模型 %s 失败: %s", endpoint.url, model, e)
+            return False
+
+        load_seconds = result.get("load_duration", 0) / 1e9
+        state.last_load_seconds = load_seconds
+        OLLAMA_MODEL_LOAD_SECONDS.observe(load_seconds, endpoint=endpoint.url, model=model, trigger="warmup")
+        OLLAMA_MODEL_WARMUPS.inc(endpoint=endpoint.url, model=model, outcome="success")
+        state.loaded_at = time.time()
+        self._set_loaded(endpoint.url, model, True)
+        logger.info("节点 %s 预热模型 %s 完成，加载耗时 %.1f 秒", endpoint.url, model, load_seconds)
+        return True
+
+    def _schedule_warmup(self, endpoint: OllamaEndpoint, model: str):
+        """后台预热，同一节点同一模型同时只有一个预热请求"""
+        key = (endpoint.url, model)
+        task = self._warming.get(key)
+        if task is None or task.done():
+            self._warming[key] = asyncio.create_task(self.warmup(endpoint, model))
+
+    async def refresh(self, endpoint: OllamaEndpoint):
+        """通过/api/ps同步节点上的模型状态，需要时重新预热"""
+        try:
+            response = await endpoint.client.get("/api/ps", timeout=settings.ollama_connect_timeout)
+            response.raise_for_status()
+            running = {
+                item.get("name") or item.get("model"): item for item in response.json().get("models", [])
+            }
+        except Exception as e:
+            logger.debug("获取节点 %s 的模型状态失败: %s", endpoint.url, e)
+            return
+
+        now = time.time()
+        for model in self.models:
+            if not endpoint.serves(model):
+                continue
+            state = self._state(endpoint.url, model)
+            if state.state == "loading":
+                continue
+            item = running.get(model)
+            if item is None:
+                self._set_loaded(endpoint.url, model, False)
+                self._schedule_warmup(endpoint, model)
+                continue
+            self._set_loaded(endpoint.url, model, True)
+            state.expires_at = parse_expires_at(item.get("expires_at"))
+            # keep_alive在下一次检查之前到期时提前续期
+            if state.expires_at is not None and state.expires_at - now <= settings.ollama_model_check_interval * 2:
+                self._schedule_warmup(endpoint, model)
+
+    async def _loop(self):
+        now = time.monotonic()
+        for endpoint in self.pool.endpoints:
+            if endpoint.admissible(now):
+                for model in self.models:
+                    if endpoint.serves(model):
+                        self._schedule_warmup(endpoint, model)
+        if settings.ollama_model_check_interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(settings.ollama_model_check_interval)
+            now = time.monotonic()
+            await asyncio.gather(*(
+                self.refresh(endpoint) for endpoint in self.pool.endpoints if endpoint.admissible(now)
+            ))
+
+    def start(self):
+        """启动预热和定期检查（在事件循环中调用），未配置模型时不执行"""
+        if self.models and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        tasks = [task for task in self._warming.values() if not task.done()]
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._warming.clear()
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [
+            dict(state.status(), endpoint=endpoint_url, model=model)
+            for (endpoint_url, model), state in self._states.items()
+        ]
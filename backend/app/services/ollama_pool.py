@@ -0,0 +1,257 @@
+import time
+import asyncio
+import logging
+import httpx
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, AsyncIterator, Set, Tuple
+from app.core.config import settings
+from app.core.metrics import (
+    OLLAMA_ENDPOINT_IN_FLIGHT, OLLAMA_ENDPOINT_HEALTHY, OLLAMA_ENDPOINT_REQUESTS,
+    OLLAMA_ENDPOINT_SECONDS, OLLAMA_ENDPOINT_EJECTIONS
+)
+
+logger = logging.getLogger(__name__)
+
+
+ROUTING_POLICIES = ("least_outstanding", "ewma")
+
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """判断异常是否说明节点本身有问题（连接失败、超时、5xx、模型不存在）"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status == 404
+    return isinstance(error, httpx.HTTPError)
+
+
+class OllamaEndpoint:
+    """一个Ollama节点：独立的连接池、在途请求数、延迟EWMA和健康状态"""
+
+    def __init__(self, url: str, capacity: int, models: Optional[List[str]] = None):
+        self.url = url.rstrip("/")
+        self.capacity = capacity
+        # 配置中未指定模型列表时，由健康检查从/api/tags获取；获取之前视为支持任意模型
+        self.configured_models = set(models) if models else None
+        self.models: Optional[Set[str]] = self.configured_models
+        self.outstanding = 0
+        self.latency_ewma: Optional[float] = None
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self._client: Optional[httpx.AsyncClient] = None
+        OLLAMA_ENDPOINT_HEALTHY.set(1, endpoint=self.url)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """复用的异步HTTP客户端（keep-alive连接池）"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                timeout=httpx.Timeout(settings.ollama_timeout, connect=settings.ollama_connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=max(self.capacity, settings.ollama_max_connections),
+                    max_keepalive_connections=settings.ollama_max_keepalive_connections,
+                    keepalive_expiry=settings.ollama_keepalive_expiry
+                )
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def admissible(self, now: float) -> bool:
+        """健康，或被剔除后已过冷却时间（试探性接收请求，成功即恢复）"""
+        return self.healthy or now >= self.ejected_until
+
+    def record_success(self, latency: float):
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        self.consecutive_failures = 0
+        if not self.healthy:
+            self.mark_healthy()
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= settings.ollama_eject_failures or not self.healthy:
+            self.eject()
+
+    def eject(self):
+        if self.healthy:
+            logger.warning("Ollama节点 %s 连续失败 %d 次，暂停分配请求", self.url, self.consecutive_failures)
+            OLLAMA_ENDPOINT_EJECTIONS.inc(endpoint=self.url)
+        self.healthy = False
+        self.ejected_until = time.monotonic() + settings.ollama_eject_seconds
+        OLLAMA_ENDPOINT_HEALTHY.set(0, endpoint=self.url)
+
+    def mark_healthy(self):
+        if not self.healthy:
+            logger.info("Ollama节点 %s 已恢复", self.url)
+        self.healthy = True
+        self.consecutive_failures = 0
+        OLLAMA_ENDPOINT_HEALTHY.set(1, endpoint=self.url)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "capacity": self.capacity,
+            "outstanding": self.outstanding,
+            "latency_ewma": self.latency_ewma,
+            "consecutive_failures": self.consecutive_failures,
+            "models": sorted(self.models) if self.models is not None else None
+        }
+
+
+class OllamaPool:
+    """多个Ollama节点组成的推理池
+
+    每个请求按路由策略选择一个支持该模型、未满载的健康节点：least_outstanding选择在途请求最少的
+    节点，ewma选择 (在途请求数+1) * 延迟EWMA 最小的节点。全部节点满载时排队等待。
+    节点连续失败达到阈值后被剔除，冷却时间过后由后台健康检查或下一个试探请求恢复。
+    """
+
+    def __init__(self, endpoints: List[Dict[str, Any]], routing: str):
+        if routing not in ROUTING_POLICIES:
+            raise ValueError(f"未知的Ollama路由策略: {routing}")
+        if not endpoints:
+            endpoints = [{"url": settings.ollama_base_url, "capacity": settings.ollama_max_connections}]
+        self.routing = routing
+        self.endpoints = []
+        for config in endpoints:
+            if not config.get("url"):
+                raise ValueError(f"Ollama节点配置缺少url: {config}")
+            self.endpoints.append(OllamaEndpoint(
+                config["url"], int(config.get("capacity") or settings.ollama_max_connections), config.get("models")
+            ))
+        self._available: Optional[asyncio.Condition] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._available is None:
+            self._available = asyncio.Condition()
+        return self._available
+
+    def _select(self, model: str, exclude: Set[str]) -> Optional[OllamaEndpoint]:
+        """选择节点；有可用节点但全部满载时返回None，没有可用节点时抛出异常"""
+        now = time.monotonic()
+        candidates = [
+            endpoint for endpoint in self.endpoints
+            if endpoint.url not in exclude and endpoint.serves(model) and endpoint.admissible(now)
+        ]
+        if not candidates:
+            raise httpx.ConnectError(f"没有可用的Ollama节点（模型: {model}）")
+
+        free = [endpoint for endpoint in candidates if endpoint.outstanding < endpoint.capacity]
+        if not free:
+            return None
+        if self.routing == "ewma":
+            # 尚无延迟数据的节点按已知最小延迟估计，使新节点能够尽快分到请求
+            known = [endpoint.latency_ewma for endpoint in free if endpoint.latency_ewma is not None]
+            default = min(known) if known else 1.0
+            return min(free, key=lambda e: (e.outstanding + 1) * (e.latency_ewma or default))
+        return min(free, key=lambda e: (e.outstanding / e.capacity, e.outstanding))
+
+    @asynccontextmanager
+    async def acquire(self, model: str, exclude: Optional[Set[str]] = None) -> AsyncIterator[OllamaEndpoint]:
+        """占用一个节点执行请求，结束时按是否异常记录节点的成功或失败"""
+        exclude = exclude or set()
+        condition = self._condition()
+        async with condition:
+            while True:
+                endpoint = self._select(model, exclude)
+                if endpoint is not None:
+                    break
+                await condition.wait()
+            endpoint.outstanding += 1
+
+        OLLAMA_ENDPOINT_IN_FLIGHT.inc(endpoint=endpoint.url)
+        start = time.time()
+        outcome = "success"
+        try:
+            yield endpoint
+        except BaseException as e:
+            if isinstance(e, Exception) and is_endpoint_failure(e):
+                outcome = "failure"
+                endpoint.record_failure()
+            else:
+                outcome = "error"
+            raise
+        else:
+            endpoint.record_success(time.time() - start)
+        finally:
+            elapsed = time.time() - start
+            OLLAMA_ENDPOINT_IN_FLIGHT.dec(endpoint=endpoint.url)
+            OLLAMA_ENDPOINT_REQUESTS.inc(endpoint=endpoint.url, outcome=outcome)
+            OLLAMA_ENDPOINT_SECONDS.observe(elapsed, endpoint=endpoint.url)
+            async with condition:
+                endpoint.outstanding -= 1
+                condition.notify_all()
+
+    async def post(self, model: str, path: str, **kwargs: Any) -> Tuple[OllamaEndpoint, httpx.Response]:
+        """发送非流式请求；节点连接失败时换一个节点重试（请求未到达节点，重试是安全的）"""
+        tried: Set[str] = set()
+        while True:
+            endpoint = None
+            try:
+                async with self.acquire(model, tried) as endpoint:
+                    response = await endpoint.client.post(path, **kwargs)
+                    response.raise_for_status()
+                    return endpoint, response
+            except httpx.ConnectError:
+                if endpoint is None:
+                    raise
+                tried.add(endpoint.url)
+                logger.warning("Ollama节点 %s 连接失败，尝试其他节点", endpoint.url)
+
+    async def check_endpoint(self, endpoint: OllamaEndpoint) -> bool:
+        """通过/api/tags检查节点，成功时恢复节点并更新模型列表"""
+        try:
+            response = await endpoint.client.get("/api/tags", timeout=settings.ollama_connect_timeout)
+            response.raise_for_status()
+        except Exception as e:
+            logger.debug("Ollama节点 %s 健康检查失败: %s", endpoint.url, e)
+            endpoint.consecutive_failures = max(endpoint.consecutive_failures, settings.ollama_eject_failures)
+            endpoint.eject()
+            return False
+
+        if endpoint.configured_models is None:
+            endpoint.models = {model.get("name", "") for model in response.json().get("models", [])}
+        endpoint.mark_healthy()
+        return True
+
+    async def check_health(self) -> List[bool]:
+        return list(await asyncio.gather(*(self.check_endpoint(endpoint) for endpoint in self.endpoints)))
+
+    async def _health_loop(self):
+        while True:
+            now = time.monotonic()
+            # 冷却中的节点不检查，避免频繁探测已知故障的节点
+            due = [endpoint for endpoint in self.endpoints if endpoint.healthy or now >= endpoint.ejected_until]
+            await asyncio.gather(*(self.check_endpoint(endpoint) for endpoint in due))
+            async with self._condition():
+                self._condition().notify_all()
+            await asyncio.sleep(settings.ollama_health_interval)
+
+    def start(self):
+        """启动后台健康检查（在事件循环中调用），间隔为0时不检查"""
+        if settings.ollama_health_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        for endpoint in self.endpoints:
+            await endpoint.close()
+        self._available = None
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [endpoint.status() for endpoint in self.endpoints]
@@ -1,221 +1,578 @@
 import os
 import json
 import time
-import base64
-import requests
-from typing import List, Dict, Any
-from PIL import Image
-import numpy as np
+import asyncio
+import logging
+import httpx
+from contextlib import aclosing
+from typing import List, Dict, Any, Optional, AsyncIterator
 from app.core.config import settings
+from app.core.metrics import VLM_REQUEST_SECONDS, VLM_PAYLOAD_BYTES
+from app.core.tracing import span, start_span
+from app.core.workers import run_cpu
+from app.services.image_bundle import ImageBundle
+from app.services.ollama_pool import OllamaPool
+from app.services.model_manager import ModelManager, keep_alive_value
+from app.services.circuit_breaker import CircuitOpenError, create_vlm_breaker
+from app.services.vlm_cache import VLMResultCache, vlm_cache
+from app.services.vlm_preprocess import vlm_input_options
+from app.services.stream_parser import IncrementalDifferenceParser, is_error_difference, difference_confidence
+from app.services.localization import change_localizer
+from app.services.similarity_metrics import similarity_metrics
+
+logger = logging.getLogger(__name__)
+
+# Ollama响应中的耗时（纳秒）和token统计字段 -> 追踪属性名
+_OLLAMA_TIMING_FIELDS = {
+    "total_duration": "total_ms",
+    "load_duration": "load_ms",
+    "prompt_eval_duration": "prompt_eval_ms",
+    "eval_duration": "eval_ms"
+}
+_OLLAMA_COUNT_FIELDS = {
+    "prompt_eval_count": "prompt_tokens",
+    "eval_count": "output_tokens"
+}
+
+
+def _ollama_stats(result: Dict[str, Any]) -> Dict[str, Any]:
+    """提取Ollama响应中的模型加载、推理耗时和token数"""
+    stats = {name: round(result[field] / 1e6, 3) for field, name in _OLLAMA_TIMING_FIELDS.items() if field in result}
+    stats.update({name: result[field] for field, name in _OLLAMA_COUNT_FIELDS.items() if field in result})
+    return stats
+
+
+# 提示词版本，修改提示词内容时需同步升级，使旧缓存失效
+DIFFERENCE_PROMPT_VERSION = "v1"
+
+# 差异分析提示词（监控场景，更敏感地检测变化）
+DIFFERENCE_PROMPT = """
+请非常仔细地分析这两张图片的差异。这是监控场景的图片对比分析，请特别注意：
+
+**重点关注的变化（即使很小也要检测）：**
+1. 人物：人的出现、消失、移动、姿势变化（即使只有部分身体可见）
+2. 物体：物体的增加、减少、移动、状态变化
+3. 设备：指示灯、显示屏、开关状态的变化
+4. 环境：光线变化、阴影变化、背景变化
+5. 细节：任何可见的细节差异，包括时间戳、文字等
+
+**分析要求：**
+- 即使差异很小，也要仔细检测并报告
+- 特别注意人物出现这种重要的安全相关变化
+- 对于检测到的差异，请提供准确的置信度
+- 如果发现任何变化，请详细描述
+
+请以JSON格式返回分析结果：
+{
+    "similarity_score": 0.85,
+    "differences": [
+        {
+            "type": "person_detected",
+            "description": "检测到人物出现",
+            "confidence": 0.95,
+            "bbox": [100, 150, 200, 250],
+            "severity": "high"
+        }
+    ],
+    "alert_level": "warning",
+    "summary": "总体分析摘要"
+}
+
+请确保JSON格式正确，不要包含额外的文本。
+"""
+
+REGION_PROMPT_VERSION = "v1"
+
+# 局部区域分析提示词，{layout}和{count}按定位模式填充
+REGION_PROMPT = """
+这是监控场景中发生变化的局部区域，共{count}个区域，按编号排列。{layout}
+
+请逐个区域判断变化前后发生了什么变化，特别注意人物的出现、消失、移动，物体的增减和设备状态变化。
+光线、阴影、压缩噪声等无意义的变化不需要报告。区域位置已经确定，不需要返回坐标。
+
+请以JSON格式返回分析结果：
+{{
+    "differences": [
+        {{
+            "region": 1,
+            "type": "person_detected",
+            "description": "检测到人物出现",
+            "confidence": 0.95,
+            "severity": "high"
+        }}
+    ],
+    "alert_level": "warning",
+    "summary": "总体分析摘要"
+}}
+
+请确保JSON格式正确，不要包含额外的文本。
+"""
+
+# 二次分析时附加在局部区域提示词之前
+REGION_DETAIL_NOTE = """
+这是二次分析，首次分析的结果不够可信。请非常仔细地逐个区域检查，不要遗漏人物、物体、设备状态和细节的差异，
+并给出准确的置信度。
+"""
+
+REGION_LAYOUTS = {
+    "composite": "只有一张拼接图，每个区域占一行，标注了区域编号，左侧为变化前，右侧为变化后。",
+    "crops": "图片按区域顺序成对提供：第1、2张是区域1变化前、变化后，第3、4张是区域2变化前、变化后，依此类推。"
+}
+
+
+class VLMUnavailableError(Exception):
+    """VLM调用失败或被熔断器拒绝，调用方应改用仅基于本地指标的降级结果"""
+    
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        # circuit_open, timeout, connect_error, http_error, bad_response, stream_error, incomplete_stream,
+        # budget_exhausted
+        self.reason = reason
 
 
 class OllamaService:
     """Ollama服务类"""
     
     def __init__(self):
-        self.base_url = settings.ollama_base_url
         self.model_name = settings.ollama_model_name
+        self.pool = OllamaPool(settings.ollama_endpoints, settings.ollama_routing)
+        self.breaker = create_vlm_breaker()
+        # 模型预热和常驻管理：每个请求都携带keep_alive，空闲期间由管理器续期
+        self.model_manager = ModelManager(self.pool, settings.ollama_warmup_models or [self.model_name])
+        self.keep_alive = keep_alive_value(settings.ollama_keep_alive)
+        self.cache = vlm_cache
+        self.generate_options = {
+            "temperature": 0.1,
+            "top_p": 0.9,
+            "max_tokens": 2048  # 减少token数量以加快响应
+        }
+        # 成功调用延迟的指数加权平均，用于预估下一次推理耗时
+        self.latency_ewma: Optional[float] = None
     
-    def _encode_image_to_base64(self, image_path: str) -> str:
-        """将图片编码为base64"""
-        try:
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
-        except Exception as e:
-            raise Exception(f"图片编码失败: {str(e)}")
+    def start(self):
+        """启动推理池的后台健康检查（在事件循环中调用）"""
+        self.pool.start()
+    
+    async def close(self):
+        """停止模型管理和健康检查，关闭各节点的HTTP连接池"""
+        await self.model_manager.close()
+        await self.pool.close()
     
-    def _calculate_image_similarity(self, image1_path: str, image2_path: str) -> float:
+    def _calculate_image_similarity(self, bundle1: ImageBundle, bundle2: ImageBundle) -> float:
         """计算两张图片的相似度（用于验证）"""
         try:
-            # 加载图片
-            img1 = Image.open(image1_path).convert('RGB')
-            img2 = Image.open(image2_path).convert('RGB')
-            
-            # 统一尺寸
-            size = (224, 224)
-            img1 = img1.resize(size)
-            img2 = img2.resize(size)
-            
-            # 转换为numpy数组
-            arr1 = np.array(img1)
-            arr2 = np.array(img2)
-            
-            # 计算均方误差
-            mse = np.mean((arr1 - arr2) ** 2)
-            
-            # 转换为相似度分数 (0-1)
-            max_mse = 255 ** 2
-            similarity = 1 - (mse / max_mse)
-            
-            return max(0, min(1, similarity))
+            return similarity_metrics.compute(bundle1, bundle2, ["mse"])["scores"]["mse"]
         except Exception as e:
-            print(f"计算图片相似度失败: {str(e)}")
+            logger.warning("计算图片相似度失败: %s", e)
             return 0.5  # 默认值
     
-    def _call_ollama_api(self, prompt: str, images: List[str]) -> Dict[str, Any]:
-        """调用Ollama API"""
-        url = f"{self.base_url}/api/generate"
+    @staticmethod
+    def _payload_size(prompt: str, images: List[str]) -> int:
+        return len(prompt.encode('utf-8')) + sum(len(image) for image in images)
+    
+    def _record_latency(self, latency: float):
+        """更新推理延迟的指数加权平均"""
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+    
+    def _check_breaker(self):
+        """熔断器打开时立即失败，不占用连接和推理节点"""
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError as e:
+            raise VLMUnavailableError("circuit_open", str(e))
+    
+    async def _call_ollama_api(self, prompt: str, images: List[str],
+                               timeout: Optional[float] = None) -> Dict[str, Any]:
+        """调用Ollama API，timeout为空时使用推理超时（启用熔断时受熔断器限制）
+        
+        调用失败或熔断器打开时抛出VLMUnavailableError。
+        """
+        url = "/api/generate"
         
         payload = {
             "model": self.model_name,
             "prompt": prompt,
             "images": images,
             "stream": False,
-            "options": {
-                "temperature": 0.1,
-                "top_p": 0.9,
-                "max_tokens": 2048  # 减少token数量以加快响应
-            }
+            "options": self.generate_options,
+            "keep_alive": self.keep_alive
         }
         
-        try:
-            print(f"调用Ollama API: {url}")
-            print(f"模型: {self.model_name}")
-            print(f"图片数量: {len(images)}")
-            
-            response = requests.post(url, json=payload, timeout=600)  # 减少超时时间到30秒
-            response.raise_for_status()
-            
-            result = response.json()
-            print(f"Ollama API响应成功: {len(result.get('response', ''))} 字符")
-            return result
+        self._check_breaker()
+        call_timeout = self.breaker.call_timeout(settings.ollama_timeout)
+        # 受分析延迟预算限制的超时不说明Ollama有问题，不计入熔断统计
+        budget_limited = timeout is not None and timeout < call_timeout
+        if not budget_limited:
+            timeout = call_timeout
+        payload_size = self._payload_size(prompt, images)
+        VLM_PAYLOAD_BYTES.observe(payload_size, mode="generate")
+        with span("vlm.generate", model=self.model_name, images=len(images), bytes_sent=payload_size) as vlm_span:
+            call_start = time.time()
+            try:
+                endpoint, response = await self.pool.post(
+                    self.model_name, url, json=payload,
+                    timeout=httpx.Timeout(timeout, connect=min(timeout, settings.ollama_connect_timeout))
+                )
+                vlm_span.set(endpoint=endpoint.url)
+                
+                result = response.json()
+                latency = time.time() - call_start
+                self.model_manager.observe(endpoint.url, self.model_name, result)
+                self._record_latency(latency)
+                self.breaker.record(True, latency)
+                VLM_REQUEST_SECONDS.observe(latency, mode="generate", outcome="success")
+                vlm_span.set(outcome="success", **_ollama_stats(result))
+                logger.debug("Ollama API响应成功: %d 字符", len(result.get('response', '')))
+                return result
+                
+            except httpx.TimeoutException:
+                outcome, message = "timeout", "Ollama API调用超时"
+            except httpx.ConnectError:
+                outcome, message = "connect_error", "无法连接到Ollama服务"
+            except httpx.HTTPError as e:
+                outcome, message = "http_error", f"Ollama API调用失败: {str(e)}"
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                # 响应不是合法JSON或内容异常
+                outcome, message = "bad_response", f"Ollama API响应无效: {str(e)}"
             
-        except requests.exceptions.Timeout:
-            print("Ollama API调用超时，返回模拟数据")
-            return self._get_mock_response(time.time())
-        except requests.exceptions.ConnectionError:
-            print("无法连接到Ollama服务，返回模拟数据")
-            return self._get_mock_response(time.time())
-        except requests.exceptions.RequestException as e:
-            print(f"Ollama API调用失败: {str(e)}，返回模拟数据")
-            return self._get_mock_response(time.time())
+            latency = time.time() - call_start
+            if outcome == "timeout" and budget_limited:
+                self.breaker.release()
+            else:
+                self.breaker.record(False, latency)
+            VLM_REQUEST_SECONDS.observe(latency, mode="generate", outcome=outcome)
+            vlm_span.set(outcome=outcome)
+            logger.warning(message)
+            raise VLMUnavailableError(outcome, message)
     
-    def analyze_image_differences(self, image1_path: str, image2_path: str) -> Dict[str, Any]:
+    async def _stream_ollama_api(self, prompt: str, images: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        """以流式模式调用Ollama API，逐个产出模型输出片段
+
+        调用方提前关闭生成器时会断开连接，Ollama随之停止生成。熔断器打开、Ollama返回错误或响应无效时
+        抛出VLMUnavailableError。
+        """
+        payload = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "images": images,
+            "stream": True,
+            "options": self.generate_options,
+            "keep_alive": self.keep_alive
+        }
+        
+        self._check_breaker()
+        payload_size = self._payload_size(prompt, images)
+        VLM_PAYLOAD_BYTES.observe(payload_size, mode="stream")
+        # 生成器跨越多次yield，使用不改变上下文的span
+        vlm_span = start_span("vlm.stream", model=self.model_name, images=len(images), bytes_sent=payload_size)
+        call_start = time.time()
+        outcome = "error"
+        try:
+            # 两个输出片段之间的等待时间受熔断器限制，挂起的节点会超时并计为失败
+            timeout = httpx.Timeout(
+                self.breaker.call_timeout(settings.ollama_timeout), connect=settings.ollama_connect_timeout
+            )
+            async with self.pool.acquire(self.model_name) as endpoint, \
+                    endpoint.client.stream("POST", "/api/generate", json=payload, timeout=timeout) as response:
+                vlm_span.set(endpoint=endpoint.url)
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    try:
+                        chunk = json.loads(line)
+                    except ValueError as e:
+                        raise VLMUnavailableError("stream_error", f"Ollama流式响应无效: {str(e)}")
+                    if not isinstance(chunk, dict):
+                        raise VLMUnavailableError("stream_error", f"Ollama流式响应无效: {line[:200]}")
+                    if 'error' in chunk:
+                        raise VLMUnavailableError("stream_error", f"Ollama生成失败: {chunk['error']}")
+                    yield chunk
+                    if chunk.get('done'):
+                        self.model_manager.observe(endpoint.url, self.model_name, chunk)
+                        vlm_span.set(**_ollama_stats(chunk))
+                        break
+            outcome = "success"
+        except GeneratorExit:
+            outcome = "closed"
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            latency = time.time() - call_start
+            if outcome in ("success", "closed"):
+                self.breaker.record(True, latency)
+            elif outcome == "cancelled":
+                self.breaker.release()
+            else:
+                self.breaker.record(False, latency)
+            VLM_REQUEST_SECONDS.observe(latency, mode="stream", outcome=outcome)
+            vlm_span.set(outcome=outcome)
+            vlm_span.end()
+    
+    async def _vlm_images(self, bundles: List[ImageBundle]) -> List[str]:
+        """在CPU工作池中生成发送给VLM的图片（缩放和重新编码，结果缓存在数据包中）"""
+        with span("vlm.encode_images", images=len(bundles)):
+            return await run_cpu(lambda: [bundle.vlm_base64 for bundle in bundles])
+    
+    def _cache_key(self, prompt_name: str, prompt_version: str, bundles: List[ImageBundle],
+                   key_extra: Optional[Dict[str, Any]] = None) -> str:
+        """缓存键：图片内容哈希+提示词版本+模型+推理参数+输入预处理参数"""
+        options = dict(self.generate_options, vlm_input=vlm_input_options(), **(key_extra or {}))
+        return VLMResultCache.make_key(
+            bundles[0].content_hash, bundles[1].content_hash, prompt_name, prompt_version,
+            self.model_name, options
+        )
+    
+    async def generate_cached(self, prompt_name: str, prompt_version: str, prompt: str,
+                              bundles: List[ImageBundle], timeout: Optional[float] = None,
+                              images: Optional[List[str]] = None,
+                              key_extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """带结果缓存的VLM调用
+        
+        images为空时发送两张整图；发送派生图片（如局部裁剪图）时需通过key_extra
+        把决定派生图片内容的参数纳入缓存键。
+        """
+        image1_hash, image2_hash = bundles[0].content_hash, bundles[1].content_hash
+        key = self._cache_key(prompt_name, prompt_version, bundles, key_extra)
+        
+        with span("vlm.cache_lookup", prompt=prompt_name) as cache_span:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            cache_span.set(hit=cached is not None)
+        if cached is not None:
+            logger.debug("VLM缓存命中: %s", prompt_name)
+            return cached
+        
+        if images is None:
+            images = await self._vlm_images(bundles)
+        result = await self._call_ollama_api(prompt, images, timeout)
+        
+        # 只缓存完整的模型响应
+        if 'response' in result:
+            await asyncio.to_thread(
+                self.cache.set, key, {"response": result['response']},
+                image1_hash, image2_hash, prompt_name, prompt_version, self.model_name
+            )
+        return result
+    
+    async def analyze_image_differences(self, bundle1: ImageBundle, bundle2: ImageBundle,
+                                        timeout: Optional[float] = None) -> Dict[str, Any]:
         """分析两张图片的差异"""
         start_time = time.time()
         
         try:
-            print("=== Ollama服务开始分析 ===")
-            
             # 首先计算图片相似度
-            similarity_score = self._calculate_image_similarity(image1_path, image2_path)
-            print(f"计算得到的相似度: {similarity_score:.4f}")
+            similarity_score = self._calculate_image_similarity(bundle1, bundle2)
             
             # 提高阈值，只有在图片几乎完全相同时才跳过AI分析
             if similarity_score > 0.9995:  # 提高到0.9995
-                print("图片几乎完全相同，跳过AI分析")
+                logger.debug("图片几乎完全相同（相似度 %.4f），跳过AI分析", similarity_score)
                 return {
                     "similarity_score": similarity_score,
                     "differences": [],
                     "alert_level": "info",
                     "summary": "图片基本相同，未检测到显著差异",
-                    "processing_time": time.time() - start_time
+                    "processing_time": time.time() - start_time,
+                    "vlm_skipped": True
                 }
             
-            print("开始AI内容分析...")
+            # 调用API
+            response = await self.generate_cached(
+                "differences", DIFFERENCE_PROMPT_VERSION, DIFFERENCE_PROMPT, [bundle1, bundle2], timeout
+            )
             
-            # 编码图片
-            image1_base64 = self._encode_image_to_base64(image1_path)
-            image2_base64 = self._encode_image_to_base64(image2_path)
+            # 解析响应
+            if 'response' not in response:
+                raise Exception("API响应格式错误")
             
-            # 构建更敏感的分析提示词
-            prompt = """
-请非常仔细地分析这两张图片的差异。这是监控场景的图片对比分析，请特别注意：
-
-**重点关注的变化（即使很小也要检测）：**
-1. 人物：人的出现、消失、移动、姿势变化（即使只有部分身体可见）
-2. 物体：物体的增加、减少、移动、状态变化
-3. 设备：指示灯、显示屏、开关状态的变化
-4. 环境：光线变化、阴影变化、背景变化
-5. 细节：任何可见的细节差异，包括时间戳、文字等
-
-**分析要求：**
-- 即使差异很小，也要仔细检测并报告
-- 特别注意人物出现这种重要的安全相关变化
-- 对于检测到的差异，请提供准确的置信度
-- 如果发现任何变化，请详细描述
-
-请以JSON格式返回分析结果：
-{
-    "similarity_score": 0.85,
-    "differences": [
-        {
-            "type": "person_detected",
-            "description": "检测到人物出现",
-            "confidence": 0.95,
-            "bbox": [100, 150, 200, 250],
-            "severity": "high"
-        }
-    ],
-    "alert_level": "warning",
-    "summary": "总体分析摘要"
-}
+            return self._parse_analysis_response(response['response'], similarity_score, start_time)
+                
+        except VLMUnavailableError:
+            raise
+        except Exception as e:
+            logger.warning("Ollama分析失败: %s", e)
+            raise Exception(f"Ollama API调用失败: {str(e)}")
+    
+    async def analyze_region_differences(self, bundle1: ImageBundle, bundle2: ImageBundle,
+                                         localization: Dict[str, Any],
+                                         timeout: Optional[float] = None, detailed: bool = False) -> Dict[str, Any]:
+        """只把变化区域发送给VLM分析，差异的边界框使用定位结果而不是模型输出
 
-请确保JSON格式正确，不要包含额外的文本。
-"""
+        detailed为True时用于二次分析，使用要求更仔细检查的提示词。
+        """
+        start_time = time.time()
+        regions = localization['regions']
+        mode = localization['mode']
+        
+        try:
+            similarity_score = self._calculate_image_similarity(bundle1, bundle2)
+            logger.debug("局部分析: %d 个变化区域 (模式: %s)", len(regions), mode)
             
-            print("发送AI分析请求...")
-            # 调用API
-            response = self._call_ollama_api(prompt, [image1_base64, image2_base64])
-            print("收到AI响应")
+            with span("vlm.build_images", regions=len(regions), mode=mode):
+                images = await run_cpu(change_localizer.build_images, bundle1, bundle2, regions)
+            prompt = REGION_PROMPT.format(count=len(regions), layout=REGION_LAYOUTS[mode])
+            if detailed:
+                prompt = REGION_DETAIL_NOTE + prompt
+            response = await self.generate_cached(
+                "regions_detailed" if detailed else "regions", REGION_PROMPT_VERSION, prompt, [bundle1, bundle2],
+                timeout,
+                images=images,
+                key_extra={"localization": {
+                    "mode": mode,
+                    "crop_side": change_localizer.crop_side,
+                    "crop_boxes": [region['crop_box'] for region in regions]
+                }}
+            )
             
-            # 解析响应
             if 'response' not in response:
                 raise Exception("API响应格式错误")
             
-            print(f"AI原始响应: {response['response'][:200]}...")  # 只显示前200个字符
+            result = self._parse_analysis_response(response['response'], similarity_score, start_time)
+            self._assign_region_bboxes(result, regions)
+            return result
+        
+        except VLMUnavailableError:
+            raise
+        except Exception as e:
+            logger.warning("Ollama局部分析失败: %s", e)
+            raise Exception(f"Ollama API调用失败: {str(e)}")
+    
+    def _assign_region_bboxes(self, result: Dict[str, Any], regions: List[Dict[str, Any]]):
+        """按区域编号填充差异的边界框（原图像素坐标 [x1, y1, x2, y2]）"""
+        boxes = {region['index']: region['bbox'] for region in regions}
+        for diff in result.get('differences', []):
+            if not isinstance(diff, dict):
+                continue
+            try:
+                index = int(diff.get('region'))
+            except (TypeError, ValueError):
+                index = None
+            if index not in boxes and len(regions) == 1:
+                # 只有一个区域时模型可能省略编号
+                index = regions[0]['index']
+            diff['bbox'] = boxes.get(index)
+    
+    async def stream_image_differences(self, bundle1: ImageBundle, bundle2: ImageBundle,
+                                       stop_on_error: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """流式分析两张图片的差异
+
+        依次产出事件: {"event": "alert_level"|"difference", "data": ...}，
+        最后产出 {"event": "result", "data": 完整分析结果}。
+        stop_on_error为True时，一旦出现error级别的差异就停止生成。
+        """
+        start_time = time.time()
+        similarity_score = self._calculate_image_similarity(bundle1, bundle2)
+        
+        if similarity_score > 0.9995:
+            yield {"event": "result", "data": {
+                "similarity_score": similarity_score,
+                "differences": [],
+                "alert_level": "info",
+                "summary": "图片基本相同，未检测到显著差异",
+                "processing_time": time.time() - start_time,
+                "vlm_skipped": True
+            }}
+            return
+        
+        image1_hash, image2_hash = bundle1.content_hash, bundle2.content_hash
+        key = self._cache_key("differences", DIFFERENCE_PROMPT_VERSION, [bundle1, bundle2])
+        parser = IncrementalDifferenceParser()
+        stopped_early = False
+        
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            # 缓存命中时一次性回放完整输出
+            for kind, value in parser.feed(cached['response']):
+                yield {"event": kind, "data": value}
+        else:
+            try:
+                images = await self._vlm_images([bundle1, bundle2])
+                stream = self._stream_ollama_api(DIFFERENCE_PROMPT, images)
+                async with aclosing(stream):
+                    async for chunk in stream:
+                        for kind, value in parser.feed(chunk.get('response', '')):
+                            yield {"event": kind, "data": value}
+                            if kind == "difference" and stop_on_error and is_error_difference(value):
+                                stopped_early = True
+                        if stopped_early:
+                            logger.debug("检测到error级别差异，提前停止生成")
+                            break
+            except VLMUnavailableError:
+                raise
+            except httpx.HTTPError as e:
+                raise VLMUnavailableError("stream_error", f"Ollama API调用失败: {str(e)}")
+            except (ValueError, TypeError) as e:
+                # 模型管理等对输出片段的处理失败同样按VLM不可用降级
+                raise VLMUnavailableError("stream_error", f"Ollama流式响应无效: {str(e)}")
             
-            # 清理响应文本，移除markdown代码块标记
-            cleaned_response = response['response'].strip()
-            if cleaned_response.startswith('```json'):
-                cleaned_response = cleaned_response[7:]  # 移除 ```json
-            if cleaned_response.startswith('```'):
-                cleaned_response = cleaned_response[3:]  # 移除 ```
-            if cleaned_response.endswith('```'):
-                cleaned_response = cleaned_response[:-3]  # 移除结尾的 ```
-            cleaned_response = cleaned_response.strip()
+            # 提前停止时输出不完整，不写入缓存
+            if not stopped_early:
+                await asyncio.to_thread(
+                    self.cache.set, key, {"response": parser.buffer},
+                    image1_hash, image2_hash, "differences", DIFFERENCE_PROMPT_VERSION, self.model_name
+                )
+        
+        if stopped_early:
+            result = {
+                "similarity_score": similarity_score,
+                "differences": parser.differences,
+                "alert_level": "error",
+                "summary": "检测到严重差异，已提前停止分析",
+                "processing_time": time.time() - start_time,
+                "stopped_early": True
+            }
+        else:
+            result = self._parse_analysis_response(parser.buffer, similarity_score, start_time)
+        yield {"event": "result", "data": result}
+    
+    def _parse_analysis_response(self, text: str, similarity_score: float, start_time: float) -> Dict[str, Any]:
+        """解析差异分析的模型输出"""
+        logger.debug("AI原始响应: %.200s", text)  # 只显示前200个字符
+        
+        # 清理响应文本，移除markdown代码块标记
+        cleaned_response = text.strip()
+        if cleaned_response.startswith('```json'):
+            cleaned_response = cleaned_response[7:]  # 移除 ```json
+        if cleaned_response.startswith('```'):
+            cleaned_response = cleaned_response[3:]  # 移除 ```
+        if cleaned_response.endswith('```'):
+            cleaned_response = cleaned_response[:-3]  # 移除结尾的 ```
+        cleaned_response = cleaned_response.strip()
+        
+        # 尝试解析JSON响应
+        try:
+            result = json.loads(cleaned_response)
             
-            print(f"清理后的响应: {cleaned_response[:200]}...")
+            # 使用计算得到的相似度，而不是AI返回的
+            result['similarity_score'] = similarity_score
             
-            # 尝试解析JSON响应
-            try:
-                result = json.loads(cleaned_response)
-                print("JSON解析成功")
-                print(f"AI检测到的差异数量: {len(result.get('differences', []))}")
-                
-                # 使用计算得到的相似度，而不是AI返回的
-                result['similarity_score'] = similarity_score
-                
-                # 降低过滤阈值，更敏感地检测差异
-                if similarity_score > 0.99 and len(result.get('differences', [])) > 0:
-                    print("检测到可能的误判，相似度很高但AI报告了差异")
-                    # 过滤掉低置信度的差异，但降低阈值
-                    filtered_differences = [
-                        diff for diff in result.get('differences', [])
-                        if diff.get('confidence', 0) > 0.7  # 降低置信度阈值
-                    ]
-                    result['differences'] = filtered_differences
-                    print(f"过滤后差异数量: {len(filtered_differences)}")
-                    
-                    if len(filtered_differences) == 0:
-                        result['alert_level'] = 'info'
-                        result['summary'] = '图片基本相同，未检测到显著差异'
+            # 降低过滤阈值，更敏感地检测差异
+            if similarity_score > 0.99 and len(result.get('differences', [])) > 0:
+                # 过滤掉低置信度的差异，但降低阈值
+                filtered_differences = [
+                    diff for diff in result.get('differences', [])
+                    if isinstance(diff, dict) and difference_confidence(diff) > 0.7  # 降低置信度阈值
+                ]
+                result['differences'] = filtered_differences
+                logger.debug("相似度很高但AI报告了差异，过滤后差异数量: %d", len(filtered_differences))
                 
-                result['processing_time'] = time.time() - start_time
-                print(f"Ollama分析完成，耗时: {result['processing_time']:.2f}秒")
-                return result
-            except json.JSONDecodeError as e:
-                print(f"JSON解析失败: {str(e)}")
-                # 如果JSON解析失败，使用文本解析
-                return self._parse_text_response(response['response'], similarity_score)
-                
-        except requests.exceptions.ConnectionError:
-            print("Ollama连接失败，返回模拟数据")
-            # 当Ollama服务不可用时，返回模拟数据
-            return self._get_mock_response(start_time)
-        except Exception as e:
-            print(f"Ollama分析失败: {str(e)}")
-            raise Exception(f"Ollama API调用失败: {str(e)}")
+                if len(filtered_differences) == 0:
+                    result['alert_level'] = 'info'
+                    result['summary'] = '图片基本相同，未检测到显著差异'
+            
+            result['processing_time'] = time.time() - start_time
+            return result
+        except json.JSONDecodeError as e:
+            logger.warning("JSON解析失败: %s", e)
+            # 如果JSON解析失败，使用文本解析
+            return self._parse_text_response(text, similarity_score)
     
     def _parse_text_response(self, text: str, similarity_score: float) -> Dict[str, Any]:
         """解析文本响应（当JSON解析失败时使用）"""
@@ -224,7 +581,8 @@ class OllamaService:
             "similarity_score": similarity_score,
             "differences": [],
             "alert_level": "info",
-            "summary": text[:200] + "..." if len(text) > 200 else text
+            "summary": text[:200] + "..." if len(text) > 200 else text,
+            "parsed": False
         }
         
         # 根据关键词判断告警级别
@@ -235,38 +593,35 @@ class OllamaService:
         
         return result
     
-    def _get_mock_response(self, start_time: float) -> Dict[str, Any]:
-        """返回模拟的分析结果"""
-        return {
-            "similarity_score": 0.95,
-            "differences": [],
-            "alert_level": "info",
-            "summary": "图片基本相同，未检测到显著差异",
-            "processing_time": time.time() - start_time
-        }
+    async def test_connection(self) -> bool:
+        """检查推理池中各节点，至少一个节点可用且提供所需模型时返回True"""
+        results = await self.pool.check_health()
+        available = [
+            endpoint.url for endpoint, healthy in zip(self.pool.endpoints, results)
+            if healthy and endpoint.serves(self.model_name)
+        ]
+        if available:
+            logger.info("Ollama服务连接正常，模型 %s 可用节点: %s", self.model_name, available)
+            return True
+        
+        healthy = [endpoint.url for endpoint, ok in zip(self.pool.endpoints, results) if ok]
+        if healthy:
+            logger.warning("Ollama服务连接正常，但模型 %s 在节点 %s 上均不可用", self.model_name, healthy)
+        else:
+            logger.warning("Ollama服务连接失败: 没有可用的节点")
+        return False
     
-    def test_connection(self) -> bool:
-        """测试Ollama服务连接"""
-        try:
-            url = f"{self.base_url}/api/tags"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            # 检查模型是否可用
-            models = response.json().get('models', [])
-            model_names = [model.get('name', '') for model in models]
-            
-            if self.model_name in model_names:
-                print(f"Ollama服务连接正常，模型 {self.model_name} 可用")
-                return True
-            else:
-                print(f"Ollama服务连接正常，但模型 {self.model_name} 不可用")
-                print(f"可用模型: {model_names}")
-                return False
-                
-        except Exception as e:
-            print(f"Ollama服务连接失败: {str(e)}")
-            return False
+    def endpoint_status(self) -> List[Dict[str, Any]]:
+        """推理池各节点的状态"""
+        return self.pool.status()
+    
+    def model_status(self) -> List[Dict[str, Any]]:
+        """各节点上模型的加载状态"""
+        return self.model_manager.status()
+    
+    def circuit_status(self) -> Dict[str, Any]:
+        """VLM熔断器状态"""
+        return self.breaker.status()
 
 
 # 创建全局实例
@@ -0,0 +1,197 @@
+from typing import Dict, Any, Tuple
+from PIL import Image
+import numpy as np
+from app.core.config import settings
+from app.services.image_bundle import ImageBundle
+
+
+PRESCREEN_POLICIES = ("off", "conservative", "aggressive")
+
+
+def _resize_gray(image: Image.Image, size: Tuple[int, int]) -> np.ndarray:
+    """缩放为灰度float32数组，使用区域平均抑制噪声"""
+    return np.asarray(image.convert('L').resize(size, Image.BOX), dtype=np.float32)
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> np.ndarray:
+    """差值哈希：比较相邻像素的亮度梯度方向"""
+    gray = _resize_gray(image, (hash_size + 1, hash_size))
+    return (gray[:, 1:] > gray[:, :-1]).ravel()
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """DCT-II正交变换矩阵"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def phash(image: Image.Image, hash_size: int = 8) -> np.ndarray:
+    """感知哈希：32x32灰度图的低频DCT系数与中位数比较"""
+    gray = _resize_gray(image, (32, 32))
+    dct = _DCT_32 @ gray @ _DCT_32.T
+    low = dct[:hash_size, :hash_size].ravel()[1:]  # 去掉直流分量
+    return low > np.median(low)
+
+
+def block_mean_hash(image: Image.Image, blocks: int = 16) -> np.ndarray:
+    """块均值哈希：每个块的均值与全局中位数比较"""
+    gray = _resize_gray(image, (blocks, blocks))
+    return (gray > np.median(gray)).ravel()
+
+
+def hamming_ratio(hash1: np.ndarray, hash2: np.ndarray) -> float:
+    """归一化汉明距离 (0-1)"""
+    return float(np.count_nonzero(hash1 != hash2)) / hash1.size
+
+
+def image_hashes(bundle: ImageBundle) -> Dict[str, np.ndarray]:
+    """图片的三种感知哈希，缓存在数据包中（基准图在注册时预先计算）"""
+    if bundle.perceptual_hashes is None:
+        bundle.perceptual_hashes = {
+            "dhash": dhash(bundle.image),
+            "phash": phash(bundle.image),
+            "block_mean": block_mean_hash(bundle.image)
+        }
+    return bundle.perceptual_hashes
+
+
+def tile_change_map(bundle1: ImageBundle, bundle2: ImageBundle, max_side: int, tile_size: int,
+                    abs_threshold: float, noise_k: float) -> Dict[str, Any]:
+    """分块变化检测
+
+    两张图缩放到同一尺寸后计算逐块平均绝对差。先减去全局差值中位数以抵消整体亮度漂移，
+    再用块得分的中位数+MAD估计噪声底，只有明显高于噪声底的块才视为变化。
+    """
+    width, height = bundle1.size
+    scale = min(1.0, max_side / max(width, height))
+    size = (max(tile_size, int(width * scale)), max(tile_size, int(height * scale)))
+
+    gray1 = _resize_gray(bundle1.image, size)
+    gray2 = _resize_gray(bundle2.image, size)
+
+    diff = gray2 - gray1
+    diff -= np.median(diff)  # 全局亮度补偿
+    np.abs(diff, out=diff)
+
+    # 裁剪到块大小的整数倍后按块求均值
+    rows, cols = size[1] // tile_size, size[0] // tile_size
+    diff = diff[:rows * tile_size, :cols * tile_size]
+    scores = diff.reshape(rows, tile_size, cols, tile_size).mean(axis=(1, 3))
+
+    median = float(np.median(scores))
+    mad = float(np.median(np.abs(scores - median))) * 1.4826
+    noise_floor = median + noise_k * mad
+    # 噪声底过高通常意味着大面积变化，此时不再放宽阈值
+    threshold = max(abs_threshold, min(noise_floor, abs_threshold * 3))
+
+    mask = scores > threshold
+    return {
+        "scores": scores,
+        "mask": mask,
+        "threshold": threshold,
+        "tile_size": tile_size,
+        "scale": size[0] / width,
+        "changed_tiles": int(np.count_nonzero(mask)),
+        "total_tiles": int(mask.size)
+    }
+
+
+class Prescreener:
+    """VLM调用前的低成本预筛选
+
+    第一层比较dHash/pHash/块均值哈希，第二层使用抗噪声的分块变化检测，
+    根据策略决定这对图片是否需要发送给VLM。
+    """
+
+    def __init__(self):
+        self.policy = settings.prescreen_policy
+        self.hash_threshold = settings.prescreen_hash_threshold
+        self.hash_change_threshold = settings.prescreen_hash_change_threshold
+        self.max_side = settings.prescreen_max_side
+        self.tile_size = settings.prescreen_tile_size
+        self.tile_threshold = settings.prescreen_tile_threshold
+        self.noise_k = settings.prescreen_noise_k
+        self.max_changed_tiles = settings.prescreen_max_changed_tiles
+
+        if self.policy not in PRESCREEN_POLICIES:
+            raise ValueError(f"未知的预筛选策略: {self.policy}")
+
+    def hash_distances(self, bundle1: ImageBundle, bundle2: ImageBundle) -> Dict[str, float]:
+        """计算三种感知哈希的归一化距离"""
+        hashes1, hashes2 = image_hashes(bundle1), image_hashes(bundle2)
+        return {name: hamming_ratio(hashes1[name], hashes2[name]) for name in hashes1}
+
+    def evaluate(self, bundle1: ImageBundle, bundle2: ImageBundle) -> Dict[str, Any]:
+        """执行预筛选，返回是否跳过VLM以及做出决定的层级"""
+        result = {
+            "policy": self.policy,
+            "decision": "analyze",
+            "tier": "none",
+            "confidence": 0.0,
+            "hash_distances": {},
+            "changed_tiles": 0,
+            "total_tiles": 0,
+            "changed_tile_ratio": 0.0,
+            "tile_map": None
+        }
+        if self.policy == "off":
+            return result
+
+        # 第一层：感知哈希
+        # 三种哈希取中位数投票，避免单一哈希在平滑画面上的比特抖动造成误判
+        distances = self.hash_distances(bundle1, bundle2)
+        result["hash_distances"] = distances
+        distance = float(np.median(list(distances.values())))
+
+        if distance >= self.hash_change_threshold:
+            # 哈希明显不同，确定存在变化
+            result["tier"] = "hash"
+            result["confidence"] = min(1.0, distance / (self.hash_change_threshold * 2))
+            return result
+
+        hashes_match = distance <= self.hash_threshold
+        if hashes_match and self.policy == "aggressive":
+            result["decision"] = "skip"
+            result["tier"] = "hash"
+            result["confidence"] = 1.0 - distance / max(self.hash_threshold, 1e-6) * 0.5
+            return result
+
+        # 第二层：分块变化检测
+        tile_map = tile_change_map(
+            bundle1, bundle2, self.max_side, self.tile_size, self.tile_threshold, self.noise_k
+        )
+        changed = tile_map["changed_tiles"]
+        total = tile_map["total_tiles"]
+        result.update({
+            "tier": "tiles",
+            "changed_tiles": changed,
+            "total_tiles": total,
+            "changed_tile_ratio": changed / total if total else 0.0,
+            "tile_map": tile_map
+        })
+
+        tiles_unchanged = changed <= self.max_changed_tiles
+        if tiles_unchanged and (hashes_match or self.policy == "aggressive"):
+            result["decision"] = "skip"
+            # 最高块得分离阈值越远，越确定没有变化
+            peak = float(tile_map["scores"].max()) if total else 0.0
+            result["confidence"] = max(0.0, 1.0 - peak / tile_map["threshold"]) * 0.5 + 0.5
+        else:
+            result["confidence"] = min(1.0, 0.5 + result["changed_tile_ratio"] * 10)
+
+        return result
+
+
+def build_prescreen_report(prescreen: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉内部数据（分块得分矩阵），生成可序列化的预筛选报告"""
+    return {key: value for key, value in prescreen.items() if key != "tile_map"}
+
+
+# 创建全局实例
+prescreener = Prescreener()
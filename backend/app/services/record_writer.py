@@ -0,0 +1,278 @@
+import os
+import glob
+import json
+import time
+import logging
+import uuid
+import asyncio
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from app.models.database import AnalysisRecord, AnalysisTrace, SessionLocal
+from app.services.stats_service import stats_service
+from app.core.config import settings
+from app.core.metrics import DB_WRITE_SECONDS, DB_WRITE_RECORDS, PERSIST_QUEUE_DEPTH
+from app.core.tracing import close_detached_span
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台：无法检测其他进程是否仍在使用日志，按单进程处理
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+PERSIST_MODES = ("write_behind", "sync")
+
+# 批次写入失败时的重试间隔（秒）
+_RETRY_DELAYS = (0.1, 0.5, 2.0)
+
+
+def persist_trace(db, record: AnalysisRecord, trace: Optional[Dict[str, Any]], **attrs: Any):
+    """结束追踪中的persist span并保存追踪（记录需已flush，由调用方提交）"""
+    if not trace:
+        return
+    close_detached_span(trace, "persist", **attrs)
+    db.add(AnalysisTrace(record_id=record.id, trace=json.dumps(trace, ensure_ascii=False)))
+
+
+class RecordWriter:
+    """分析记录的后台批量写入
+
+    请求只把记录字段追加到日志文件并放入队列，后台任务把队列中的记录按批合并到
+    一个事务中提交，请求延迟不包含数据库提交。每条记录带有唯一的write_key：
+    进程崩溃后，启动时重放日志中尚未入库的记录；队列清空且全部提交成功后截断日志。
+
+    多个工作进程共用同一个journal_path时，每个进程写入带PID后缀的日志并持有文件锁，
+    启动时只重放没有进程持有锁的日志（即已退出进程遗留的日志）。
+    """
+
+    def __init__(self):
+        self.mode = settings.persist_mode
+        self.batch_size = settings.persist_batch_size
+        self.flush_interval = settings.persist_flush_interval
+        self.queue_size = settings.persist_queue_size
+        self.journal_path = settings.persist_journal_path
+        self.journal_fsync = settings.persist_journal_fsync
+
+        if self.mode not in PERSIST_MODES:
+            raise ValueError(f"未知的持久化模式: {self.mode}")
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._journal = None
+        self._journal_lock = threading.Lock()
+        self._journal_dirty = False  # 有提交失败的记录时保留日志，直到这些记录补写成功
+        self._failed: List[Dict[str, Any]] = []
+        self._pending = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """重放上次未提交的日志并启动后台写入任务（在事件循环中调用）"""
+        self.replay_journal()
+        if self.mode == "write_behind":
+            if self.journal_path:
+                self._journal = open(self._own_journal_path(), "a", encoding="utf-8")
+                if fcntl is not None:
+                    fcntl.flock(self._journal.fileno(), fcntl.LOCK_EX)
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """写入队列中剩余的记录后停止"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+            # 全部提交成功时删除日志；否则保留，下次启动时重放
+            if not self._journal_dirty:
+                self._remove_journal(self._own_journal_path())
+
+    async def submit(self, fields: Dict[str, Any]):
+        """提交一条记录；未启动后台任务或队列已满时在线程中直接写入"""
+        fields = dict(fields, write_key=fields.get("write_key") or uuid.uuid4().hex)
+        if not self.running:
+            await asyncio.to_thread(self._write_batch, [fields])
+            return
+
+        with self._journal_lock:
+            try:
+                self._queue.put_nowait(fields)
+                queued = True
+            except asyncio.QueueFull:
+                queued = False
+            else:
+                self._append_journal(fields)
+                self._pending += 1
+        if not queued:
+            logger.warning("持久化队列已满，直接写入分析记录")
+            await asyncio.to_thread(self._write_batch, [fields])
+
+    def _append_journal(self, fields: Dict[str, Any]):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(fields, ensure_ascii=False, default=str) + "\n")
+        self._journal.flush()
+        if self.journal_fsync:
+            os.fsync(self._journal.fileno())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._commit_with_retry(batch)
+
+    async def _commit_with_retry(self, batch: List[Dict[str, Any]]):
+        committed = False
+        for attempt, delay in enumerate((0.0,) + _RETRY_DELAYS):
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+                committed = True
+                break
+            except Exception as e:
+                logger.warning("分析记录批量写入失败（第%d次）: %s", attempt + 1, e)
+        else:
+            self._journal_dirty = True
+            self._failed.extend(batch)
+            logger.error("放弃写入 %d 条分析记录，保留在日志中等待补写或重放", len(batch))
+
+        if committed and self._failed:
+            await self._retry_failed()
+
+        with self._journal_lock:
+            self._pending -= len(batch)
+            if self._pending == 0 and not self._journal_dirty:
+                self._truncate_journal()
+
+    async def _retry_failed(self):
+        """数据库恢复后补写之前放弃的记录（write_key去重，重复写入是安全的）"""
+        try:
+            await asyncio.to_thread(self._write_batch, self._failed)
+        except Exception as e:
+            logger.warning("补写 %d 条分析记录失败: %s", len(self._failed), e)
+            return
+        logger.info("补写 %d 条之前写入失败的分析记录", len(self._failed))
+        self._failed = []
+        self._journal_dirty = False
+
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        """在一个事务中写入一批记录，已存在的write_key跳过"""
+        db = SessionLocal()
+        start = time.perf_counter()
+        try:
+            keys = [fields["write_key"] for fields in batch]
+            existing = {
+                key for (key,) in db.query(AnalysisRecord.write_key).filter(AnalysisRecord.write_key.in_(keys))
+            }
+            records, traces = [], []
+            for fields in batch:
+                if fields["write_key"] not in existing:
+                    existing.add(fields["write_key"])
+                    records.append(self._to_record(fields))
+                    traces.append(fields.get("trace"))
+            db.add_all(records)
+            db.flush()
+            stats_service.index_records(db, records)
+            for record, trace in zip(records, traces):
+                persist_trace(db, record, trace, mode="write_behind", batch_size=len(records))
+            db.commit()
+            DB_WRITE_SECONDS.observe(time.perf_counter() - start, operation="batch")
+            DB_WRITE_RECORDS.inc(len(records), operation="batch")
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _to_record(fields: Dict[str, Any]) -> AnalysisRecord:
+        fields = dict(fields)
+        fields.pop("trace", None)
+        if isinstance(fields.get("analysis_time"), str):
+            fields["analysis_time"] = datetime.fromisoformat(fields["analysis_time"])
+        return AnalysisRecord(**fields)
+
+    def _own_journal_path(self) -> str:
+        return f"{self.journal_path}.{os.getpid()}"
+
+    def _truncate_journal(self):
+        if self._journal is not None:
+            self._journal.truncate(0)
+
+    @staticmethod
+    def _remove_journal(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def replay_journal(self):
+        """写入日志中尚未入库的记录（上次进程异常退出时遗留），重放后删除日志"""
+        if not self.journal_path:
+            return
+        suffixed = [
+            path for path in glob.glob(glob.escape(self.journal_path) + ".*")
+            if path.rsplit(".", 1)[1].isdigit()
+        ]
+        for path in [self.journal_path] + sorted(suffixed):
+            self._replay_file(path)
+
+    def _replay_file(self, path: str):
+        try:
+            journal = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with journal:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # 其他工作进程正在使用该日志
+                    return
+            batch = []
+            for line in journal:
+                try:
+                    batch.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 最后一行可能在崩溃时只写了一半
+                    continue
+            for start in range(0, len(batch), self.batch_size):
+                self._write_batch(batch[start:start + self.batch_size])
+            if batch:
+                logger.info("重放持久化日志 %s: %d 条记录", path, len(batch))
+            self._remove_journal(path)
+
+
+# 创建全局实例
+record_writer = RecordWriter()
+PERSIST_QUEUE_DEPTH.set_function(record_writer.queue_depth)
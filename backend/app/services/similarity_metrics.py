@@ -0,0 +1,215 @@
+from typing import Dict, Any, List, Optional, Callable
+import numpy as np
+from app.core.config import settings
+from app.core.tracing import span
+from app.services.image_bundle import ImageBundle
+
+
+# SSIM常数（8位图像）
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+_SSIM_WINDOW = 7
+# MS-SSIM各尺度权重（Wang et al. 2003），尺度不足时取前几项并归一化
+_MS_SSIM_WEIGHTS = (0.0448, 0.2856, 0.3001, 0.2363, 0.1333)
+# Sobel梯度幅值超过该值视为边缘
+_EDGE_THRESHOLD = 100.0
+# 边缘差异的归一化下限（占总像素比例），避免边缘很少的画面上小变化被放大
+_EDGE_MIN_AREA = 0.1
+# PSNR达到该值（dB）视为完全相同
+_PSNR_MAX = 50.0
+
+
+def _box_mean(x: np.ndarray, k: int) -> np.ndarray:
+    """k×k均值滤波（积分图实现，valid模式）"""
+    c = np.zeros((x.shape[0] + 1, x.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(x, axis=0), axis=1, out=c[1:, 1:])
+    return ((c[k:, k:] - c[:-k, k:] - c[k:, :-k] + c[:-k, :-k]) / (k * k)).astype(np.float32)
+
+
+def _ssim_maps(gray1: np.ndarray, gray2: np.ndarray):
+    """返回 (SSIM图, 对比度-结构图)"""
+    k = _SSIM_WINDOW
+    mu1, mu2 = _box_mean(gray1, k), _box_mean(gray2, k)
+    mu1_sq, mu2_sq, mu12 = mu1 * mu1, mu2 * mu2, mu1 * mu2
+    sigma1 = _box_mean(gray1 * gray1, k) - mu1_sq
+    sigma2 = _box_mean(gray2 * gray2, k) - mu2_sq
+    sigma12 = _box_mean(gray1 * gray2, k) - mu12
+
+    cs = (2 * sigma12 + _SSIM_C2) / (sigma1 + sigma2 + _SSIM_C2)
+    luminance = (2 * mu12 + _SSIM_C1) / (mu1_sq + mu2_sq + _SSIM_C1)
+    return luminance * cs, cs
+
+
+def _downsample(gray: np.ndarray) -> np.ndarray:
+    """2×2均值下采样"""
+    h, w = gray.shape[0] // 2 * 2, gray.shape[1] // 2 * 2
+    return gray[:h, :w].reshape(h // 2, 2, w // 2, 2).mean(axis=(1, 3))
+
+
+def _sobel_magnitude(gray: np.ndarray) -> np.ndarray:
+    gx = (gray[:-2, 2:] + 2 * gray[1:-1, 2:] + gray[2:, 2:]) - (gray[:-2, :-2] + 2 * gray[1:-1, :-2] + gray[2:, :-2])
+    gy = (gray[2:, :-2] + 2 * gray[2:, 1:-1] + gray[2:, 2:]) - (gray[:-2, :-2] + 2 * gray[:-2, 1:-1] + gray[:-2, 2:])
+    return np.hypot(gx, gy)
+
+
+class _PairBuffers:
+    """一对图片共享的中间结果，各指标按需计算且只计算一次"""
+
+    def __init__(self, bundle1: ImageBundle, bundle2: ImageBundle):
+        self.buffers1 = bundle1.buffers
+        self.buffers2 = bundle2.buffers
+        self.values: Dict[str, float] = {}
+        self._mse: Optional[float] = None
+        self._ssim_maps = None
+
+    @property
+    def mse(self) -> float:
+        if self._mse is None:
+            diff = self.buffers1["rgb"] - self.buffers2["rgb"]
+            self._mse = float(np.mean(diff * diff))
+            self.values["mse"] = self._mse
+        return self._mse
+
+    @property
+    def ssim_maps(self):
+        if self._ssim_maps is None:
+            self._ssim_maps = _ssim_maps(self.buffers1["gray"], self.buffers2["gray"])
+        return self._ssim_maps
+
+
+def metric_mse(pair: _PairBuffers) -> float:
+    """1 - MSE/255²"""
+    return 1.0 - pair.mse / (255.0 ** 2)
+
+
+def metric_psnr(pair: _PairBuffers) -> float:
+    """PSNR线性映射到0-1，达到50dB视为相同"""
+    if pair.mse == 0:
+        psnr = float("inf")
+    else:
+        psnr = 10.0 * np.log10(255.0 ** 2 / pair.mse)
+    pair.values["psnr"] = psnr
+    return min(1.0, psnr / _PSNR_MAX)
+
+
+def metric_ssim(pair: _PairBuffers) -> float:
+    """灰度SSIM均值（7×7均匀窗口）"""
+    ssim_map, _ = pair.ssim_maps
+    return float(ssim_map.mean())
+
+
+def metric_ms_ssim(pair: _PairBuffers) -> float:
+    """多尺度SSIM：前几个尺度取对比度-结构项，最粗尺度取完整SSIM"""
+    gray1, gray2 = pair.buffers1["gray"], pair.buffers2["gray"]
+    scales = []
+    for _ in _MS_SSIM_WEIGHTS:
+        if min(gray1.shape) < _SSIM_WINDOW:
+            break
+        scales.append((gray1, gray2))
+        gray1, gray2 = _downsample(gray1), _downsample(gray2)
+
+    weights = np.array(_MS_SSIM_WEIGHTS[:len(scales)])
+    weights /= weights.sum()
+    result = 1.0
+    for index, (g1, g2) in enumerate(scales):
+        if index == 0:
+            ssim_map, cs_map = pair.ssim_maps
+        else:
+            ssim_map, cs_map = _ssim_maps(g1, g2)
+        value = ssim_map.mean() if index == len(scales) - 1 else cs_map.mean()
+        result *= max(float(value), 0.0) ** weights[index]
+    return result
+
+
+def metric_histogram(pair: _PairBuffers) -> float:
+    """各通道32级颜色直方图交集的均值"""
+    hist1, hist2 = pair.buffers1["histogram"], pair.buffers2["histogram"]
+    return float(np.minimum(hist1, hist2).sum(axis=1).mean() / hist1[0].sum())
+
+
+def metric_edge(pair: _PairBuffers) -> float:
+    """Sobel边缘图差异：不一致的边缘像素数相对于边缘像素总数（不低于下限）"""
+    edges1 = _sobel_magnitude(pair.buffers1["gray"]) > _EDGE_THRESHOLD
+    edges2 = _sobel_magnitude(pair.buffers2["gray"]) > _EDGE_THRESHOLD
+    union = max(np.count_nonzero(edges1 | edges2), edges1.size * _EDGE_MIN_AREA)
+    return 1.0 - np.count_nonzero(edges1 ^ edges2) / union
+
+
+METRICS: Dict[str, Callable[[_PairBuffers], float]] = {
+    "mse": metric_mse,
+    "psnr": metric_psnr,
+    "ssim": metric_ssim,
+    "ms_ssim": metric_ms_ssim,
+    "histogram": metric_histogram,
+    "edge": metric_edge
+}
+
+
+def image_features(buffers: Dict[str, np.ndarray]) -> Dict[str, float]:
+    """颜色、亮度、对比度等统计特征"""
+    rgb, gray = buffers["rgb"], buffers["gray"]
+    r_mean, g_mean, b_mean = rgb.mean(axis=(0, 1))
+    r_std, g_std, b_std = rgb.std(axis=(0, 1))
+    return {
+        'r_mean': float(r_mean), 'g_mean': float(g_mean), 'b_mean': float(b_mean),
+        'r_std': float(r_std), 'g_std': float(g_std), 'b_std': float(b_std),
+        'brightness': float(gray.mean()), 'contrast': float(gray.std())
+    }
+
+
+def _parse_weights(text: str) -> Dict[str, float]:
+    """解析 "ssim:0.4,edge:0.2" 格式的权重配置"""
+    weights = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition(":")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+class SimilarityMetricsEngine:
+    """相似度指标引擎
+
+    各指标共享图片数据包中的float32缓冲区（统一尺寸的RGB和灰度图、颜色直方图），
+    一次调用计算配置的全部指标，并按名称返回，供结果整合阶段加权。
+    """
+
+    def __init__(self):
+        self.enabled = [name.strip() for name in settings.similarity_metrics.split(",") if name.strip()]
+        self.weights = _parse_weights(settings.similarity_metric_weights)
+
+        for name in self.enabled:
+            if name not in METRICS:
+                raise ValueError(f"未知的相似度指标: {name}")
+        for name in self.weights:
+            if name not in self.enabled:
+                raise ValueError(f"相似度权重中的指标未启用: {name}")
+        if sum(self.weights.values()) <= 0:
+            raise ValueError("相似度指标权重之和必须大于0")
+
+    def compute(self, bundle1: ImageBundle, bundle2: ImageBundle,
+                names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """计算指定的指标，未指定时计算全部已启用指标和图片统计特征
+
+        返回 {"scores": 各指标0-1相似度, "values": 原始值（mse、psnr）, "features1", "features2"}
+        """
+        pair = _PairBuffers(bundle1, bundle2)
+        scores = {}
+        for name in names or self.enabled:
+            with span(f"metric.{name}"):
+                scores[name] = max(0.0, min(1.0, float(METRICS[name](pair))))
+        result = {"scores": scores, "values": pair.values}
+        if names is None:
+            result["features1"] = image_features(pair.buffers1)
+            result["features2"] = image_features(pair.buffers2)
+        return result
+
+    def weighted(self, scores: Dict[str, float]) -> float:
+        """按配置权重合成像素级相似度"""
+        total = sum(self.weights.values())
+        return sum(scores[name] * weight for name, weight in self.weights.items()) / total
+
+
+# 创建全局实例
+similarity_metrics = SimilarityMetricsEngine()
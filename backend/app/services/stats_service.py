@@ -0,0 +1,231 @@
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.models.database import AnalysisRecord, DifferenceRecord, StatsRollup
+
+logger = logging.getLogger(__name__)
+
+
+GRANULARITIES = ("hour", "day")
+DIMENSIONS = ("alert_level", "difference_type")
+
+# 重建统计时每批读取的记录数
+_REBUILD_CHUNK = 1000
+
+# 支持 INSERT ... ON CONFLICT DO UPDATE 的数据库方言
+_UPSERT_INSERTS = {
+    "sqlite": sqlite_insert,
+    "postgresql": postgresql_insert,
+}
+
+# (granularity, dimension, bucket_start, key) -> [count, score_sum]
+RollupDelta = Dict[Tuple[str, str, datetime, str], List[float]]
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _parse_differences(record: AnalysisRecord) -> List[Dict[str, Any]]:
+    if not record.differences:
+        return []
+    try:
+        differences = json.loads(record.differences)
+    except (TypeError, ValueError):
+        return []
+    return [diff for diff in differences if isinstance(diff, dict)]
+
+
+def _confidence(diff: Dict[str, Any]) -> Optional[float]:
+    """差异置信度，模型输出不是数值时视为缺失"""
+    try:
+        return float(diff.get("confidence"))
+    except (TypeError, ValueError):
+        return None
+
+
+class StatsService:
+    """差异明细和预聚合统计
+
+    已完成的分析记录写入时，把差异JSON展开为differences表中的行，并按小时、天
+    累加告警级别和差异类型的计数；删除记录时扣减。统计接口只读取聚合表，
+    查询时间与历史记录总量无关。
+    """
+
+    def _collect(self, record: AnalysisRecord, delta: RollupDelta, sign: int) -> List[Dict[str, Any]]:
+        """把一条记录的贡献累加到delta中，返回解析出的差异列表"""
+        differences = _parse_differences(record)
+        if record.status != "completed" or record.analysis_time is None:
+            return differences
+
+        for granularity in GRANULARITIES:
+            start = bucket_start(record.analysis_time, granularity)
+            if record.alert_level:
+                entry = delta[(granularity, "alert_level", start, record.alert_level)]
+                entry[0] += sign
+                entry[1] += sign * (record.similarity_score or 0.0)
+            for diff in differences:
+                entry = delta[(granularity, "difference_type", start, diff.get("type") or "unknown")]
+                entry[0] += sign
+                entry[1] += sign * (_confidence(diff) or 0.0)
+        return differences
+
+    def index_records(self, db: Session, records: Iterable[AnalysisRecord]):
+        """为新完成的记录写入差异明细并累加统计（记录需已flush以获得id，由调用方提交）"""
+        delta: RollupDelta = defaultdict(lambda: [0, 0.0])
+        for record in records:
+            differences = self._collect(record, delta, 1)
+            if record.status != "completed":
+                continue
+            for diff in differences:
+                bbox = diff.get("bbox")
+                if not (isinstance(bbox, list) and len(bbox) == 4):
+                    bbox = [None] * 4
+                db.add(DifferenceRecord(
+                    record_id=record.id,
+                    analysis_time=record.analysis_time,
+                    type=diff.get("type") or "unknown",
+                    confidence=_confidence(diff),
+                    severity=diff.get("severity"),
+                    bbox_x1=bbox[0], bbox_y1=bbox[1], bbox_x2=bbox[2], bbox_y2=bbox[3]
+                ))
+        self._apply(db, delta)
+
+    def unindex_record(self, db: Session, record: AnalysisRecord):
+        """删除记录前扣减统计并删除差异明细（由调用方提交）"""
+        delta: RollupDelta = defaultdict(lambda: [0, 0.0])
+        self._collect(record, delta, -1)
+        db.query(DifferenceRecord).filter(DifferenceRecord.record_id == record.id).delete(synchronize_session=False)
+        self._apply(db, delta)
+
+    def _apply(self, db: Session, delta: RollupDelta):
+        """把增量合并到聚合表
+
+        SQLite和PostgreSQL使用单条UPSERT语句，并发写入同一个桶时不会违反唯一约束；
+        其他数据库先更新，行不存在时插入。
+        """
+        insert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+        for (granularity, dimension, start, key), (count, score_sum) in delta.items():
+            if not count:
+                continue
+            if insert is None:
+                self._update_or_add(db, granularity, dimension, start, key, count, score_sum)
+                continue
+            statement = insert(StatsRollup).values(
+                granularity=granularity, dimension=dimension, bucket_start=start,
+                key=key, count=count, score_sum=score_sum
+            )
+            db.execute(statement.on_conflict_do_update(
+                index_elements=["granularity", "dimension", "bucket_start", "key"],
+                set_={
+                    "count": StatsRollup.count + statement.excluded.count,
+                    "score_sum": StatsRollup.score_sum + statement.excluded.score_sum
+                }
+            ))
+
+    def _update_or_add(self, db: Session, granularity: str, dimension: str, start: datetime,
+                       key: str, count: float, score_sum: float):
+        updated = db.query(StatsRollup).filter(
+            StatsRollup.granularity == granularity,
+            StatsRollup.dimension == dimension,
+            StatsRollup.bucket_start == start,
+            StatsRollup.key == key
+        ).update({
+            StatsRollup.count: StatsRollup.count + count,
+            StatsRollup.score_sum: StatsRollup.score_sum + score_sum
+        }, synchronize_session=False)
+        if not updated:
+            db.add(StatsRollup(
+                granularity=granularity, dimension=dimension, bucket_start=start,
+                key=key, count=count, score_sum=score_sum
+            ))
+            # 批量UPDATE不会先flush会话，立即写入新行，后续增量才能更新到它
+            db.flush()
+
+    def rebuild(self, db: Session) -> int:
+        """从全部分析记录重建差异明细和统计，返回处理的记录数"""
+        db.query(DifferenceRecord).delete(synchronize_session=False)
+        db.query(StatsRollup).delete(synchronize_session=False)
+        db.flush()
+
+        processed = 0
+        last_id = 0
+        while True:
+            records = db.query(AnalysisRecord).filter(
+                AnalysisRecord.id > last_id, AnalysisRecord.status == "completed"
+            ).order_by(AnalysisRecord.id).limit(_REBUILD_CHUNK).all()
+            if not records:
+                break
+            self.index_records(db, records)
+            db.flush()
+            processed += len(records)
+            last_id = records[-1].id
+        db.commit()
+        return processed
+
+    def ensure_built(self, db: Session):
+        """统计表为空而已有完成的记录时（如升级前的数据库）重建一次"""
+        if db.query(StatsRollup.id).first() is not None:
+            return
+        if db.query(AnalysisRecord.id).filter(AnalysisRecord.status == "completed").first() is None:
+            return
+        processed = self.rebuild(db)
+        logger.info("统计数据重建完成: %d 条记录", processed)
+
+    def get_stats(self, db: Session, granularity: str = "hour", dimension: str = "alert_level",
+                  start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                  key: Optional[str] = None) -> Dict[str, Any]:
+        """按时间桶返回统计序列和区间合计
+
+        时间范围按桶对齐：返回与 [start_time, end_time) 有重叠的全部桶。
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"不支持的统计粒度: {granularity}")
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"不支持的统计维度: {dimension}")
+
+        filters = [StatsRollup.granularity == granularity, StatsRollup.dimension == dimension,
+                   StatsRollup.count > 0]
+        if start_time:
+            filters.append(StatsRollup.bucket_start >= bucket_start(start_time, granularity))
+        if end_time:
+            filters.append(StatsRollup.bucket_start < end_time)
+        if key:
+            filters.append(StatsRollup.key == key)
+
+        rows = db.query(StatsRollup).filter(*filters).order_by(
+            StatsRollup.bucket_start, StatsRollup.key
+        ).all()
+
+        series = []
+        totals: Dict[str, Dict[str, float]] = defaultdict(lambda: {"count": 0, "score_sum": 0.0})
+        for row in rows:
+            series.append({
+                "bucket_start": row.bucket_start,
+                "key": row.key,
+                "count": row.count,
+                "avg_score": row.score_sum / row.count
+            })
+            totals[row.key]["count"] += row.count
+            totals[row.key]["score_sum"] += row.score_sum
+
+        return {
+            "granularity": granularity,
+            "dimension": dimension,
+            "series": series,
+            "totals": {
+                name: {"count": value["count"], "avg_score": value["score_sum"] / value["count"]}
+                for name, value in totals.items()
+            }
+        }
+
+
+# 创建全局实例
+stats_service = StatsService()
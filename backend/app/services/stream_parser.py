@@ -0,0 +1,111 @@
+import re
+import json
+from typing import List, Dict, Any, Optional, Tuple
+
+
+# 需要立即告警的差异类型
+ERROR_DIFFERENCE_TYPES = ["error", "failure", "danger", "person_detected"]
+ERROR_SEVERITIES = ["high", "critical"]
+
+_ALERT_LEVEL_PATTERN = re.compile(r'"alert_level"\s*:\s*"(\w+)"')
+_DIFFERENCES_KEY_PATTERN = re.compile(r'"differences"\s*:\s*\[')
+
+
+def difference_confidence(diff: Dict[str, Any]) -> float:
+    """差异置信度，模型输出不是数值时按0处理"""
+    try:
+        return float(diff.get("confidence", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def is_error_difference(diff: Dict[str, Any]) -> bool:
+    """判断差异是否达到error告警级别"""
+    if difference_confidence(diff) <= 0.8:
+        return False
+    return diff.get("type") in ERROR_DIFFERENCE_TYPES or diff.get("severity") in ERROR_SEVERITIES
+
+
+class IncrementalDifferenceParser:
+    """增量解析VLM流式输出的JSON
+
+    逐段喂入模型输出文本，每当differences数组中的一个对象完整出现时立即解析并返回，
+    alert_level字段出现时也会立即返回，无需等待整个JSON生成完毕。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.differences: List[Dict[str, Any]] = []
+        self.alert_level: Optional[str] = None
+        self._array_start: Optional[int] = None  # differences数组内容的起始位置
+        self._pos = 0  # 已扫描到的位置
+        self._depth = 0
+        self._object_start: Optional[int] = None
+        self._in_string = False
+        self._escaped = False
+        self._array_closed = False
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """喂入一段文本，返回新解析出的事件列表: ("alert_level", str) 或 ("difference", dict)"""
+        self.buffer += text
+        events: List[Tuple[str, Any]] = []
+
+        if self.alert_level is None:
+            match = _ALERT_LEVEL_PATTERN.search(self.buffer)
+            if match:
+                self.alert_level = match.group(1)
+                events.append(("alert_level", self.alert_level))
+
+        if self._array_start is None:
+            match = _DIFFERENCES_KEY_PATTERN.search(self.buffer)
+            if not match:
+                return events
+            self._array_start = match.end()
+            self._pos = self._array_start
+
+        if not self._array_closed:
+            events.extend(self._scan_differences())
+        return events
+
+    def _scan_differences(self) -> List[Tuple[str, Any]]:
+        """扫描differences数组，提取已完整生成的对象"""
+        events = []
+        buffer = self.buffer
+        while self._pos < len(buffer):
+            char = buffer[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._object_start = self._pos
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._object_start is not None:
+                    diff = self._parse_object(buffer[self._object_start:self._pos + 1])
+                    self._object_start = None
+                    if diff is not None:
+                        self.differences.append(diff)
+                        events.append(("difference", diff))
+            elif char == "]" and self._depth == 0:
+                self._array_closed = True
+                self._pos += 1
+                break
+            self._pos += 1
+        return events
+
+    @staticmethod
+    def _parse_object(text: str) -> Optional[Dict[str, Any]]:
+        """解析单个差异对象，模型输出格式不合法时忽略"""
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return value if isinstance(value, dict) else None
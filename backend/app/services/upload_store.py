@@ -0,0 +1,186 @@
+import io
+import os
+import re
+import uuid
+import hashlib
+import logging
+from typing import Optional, Tuple
+from PIL import Image
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models.database import StoredFile
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# 图片头部探测的最大字节数（JPEG的EXIF等元数据可能位于尺寸信息之前）
+_HEADER_PROBE_LIMIT = 512 * 1024
+_FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadRejected(Exception):
+    """上传内容不符合要求（大小、格式或像素数超限）"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _probe_header(head: bytes) -> Optional[Tuple[str, Tuple[int, int]]]:
+    """从文件头解析图片格式和尺寸，数据不足时返回None"""
+    try:
+        with Image.open(io.BytesIO(head)) as img:
+            return img.format, img.size
+    except Exception:
+        return None
+
+
+class UploadStore:
+    """内容寻址的上传文件存储
+
+    上传内容分块流式写入临时文件，写入的同时计算SHA-256，并在写完之前根据文件头
+    检查格式和像素数。文件按内容哈希存放在两级分片目录中（ab/cd/abcd....jpg），
+    相同内容只保存一份，通过stored_files表的引用计数管理删除。
+    """
+
+    def __init__(self):
+        self.root = settings.upload_dir
+        self.chunk_size = settings.upload_chunk_size
+        self.max_bytes = settings.max_file_size
+        self.max_pixels = settings.max_image_pixels
+        self._tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+    def path_for(self, content_hash: str, extension: str) -> str:
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash + extension)
+
+    def content_hash_of(self, path: str) -> Optional[str]:
+        """存储中的文件名即为内容哈希，不在存储中的路径返回None"""
+        name, _ = os.path.splitext(os.path.basename(path))
+        if not _HASH_PATTERN.match(name):
+            return None
+        expected = os.path.dirname(self.path_for(name, ""))
+        if os.path.abspath(os.path.dirname(path)) != os.path.abspath(expected):
+            return None
+        return name
+
+    async def save(self, db: Session, upload) -> str:
+        """流式保存上传文件，返回存储路径；相同内容已存在时只增加引用计数"""
+        tmp_path = os.path.join(self._tmp_dir, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        header = None
+
+        try:
+            with open(tmp_path, "wb") as buffer:
+                while True:
+                    chunk = await upload.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadRejected(f"图片文件大小不能超过{self.max_bytes // (1024 * 1024)}MB", 413)
+
+                    if header is None:
+                        head += chunk
+                        header = _probe_header(head)
+                        if header is not None:
+                            self._check_header(*header)
+                            head = b""
+                        elif len(head) >= _HEADER_PROBE_LIMIT:
+                            raise UploadRejected("无法识别的图片格式")
+
+                    digest.update(chunk)
+                    buffer.write(chunk)
+
+            if header is None:
+                raise UploadRejected("无法识别的图片格式" if size else "上传文件为空")
+
+            content_hash = digest.hexdigest()
+            file_path = self.path_for(content_hash, _FORMAT_EXTENSIONS[header[0]])
+            self._add_reference(db, content_hash, file_path, size, tmp_path)
+            logger.debug("文件保存完成: %s, 大小: %d 字节", file_path, size)
+            return file_path
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _check_header(self, image_format: str, image_size: Tuple[int, int]):
+        if image_format not in _FORMAT_EXTENSIONS:
+            raise UploadRejected("只支持JPEG、PNG和WebP格式的图片")
+        width, height = image_size
+        if width * height > self.max_pixels:
+            raise UploadRejected(f"图片像素数超过限制: {width}x{height}", 413)
+
+    def _add_reference(self, db: Session, content_hash: str, file_path: str, size: int, tmp_path: str):
+        """登记文件引用，内容首次出现时把临时文件移动到最终位置"""
+        while True:
+            stored = db.query(StoredFile).filter(StoredFile.content_hash == content_hash).first()
+            if stored is None:
+                if os.path.exists(tmp_path):
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    os.replace(tmp_path, file_path)
+                db.add(StoredFile(content_hash=content_hash, path=file_path, size=size, ref_count=1))
+                try:
+                    db.commit()
+                    return
+                except IntegrityError:
+                    # 并发上传了相同内容，另一请求已登记（文件内容相同，按已存在处理）
+                    db.rollback()
+                    continue
+
+            if self._increment(db, content_hash):
+                break
+            # 登记记录在查询后被并发的release删除，重新登记
+
+        if not os.path.exists(stored.path) and os.path.exists(tmp_path):
+            # 文件丢失时用本次上传恢复
+            os.makedirs(os.path.dirname(stored.path), exist_ok=True)
+            os.replace(tmp_path, stored.path)
+
+    def retain(self, db: Session, path: str):
+        """为已存储的文件增加一次引用（如分析记录引用基准图文件）"""
+        content_hash = self.content_hash_of(path)
+        if content_hash is None:
+            return
+        self._increment(db, content_hash)
+
+    def _increment(self, db: Session, content_hash: str) -> bool:
+        """原子地增加引用计数，登记记录不存在时返回False"""
+        updated = db.query(StoredFile).filter(StoredFile.content_hash == content_hash).update(
+            {StoredFile.ref_count: StoredFile.ref_count + 1}, synchronize_session=False
+        )
+        db.commit()
+        return updated > 0
+
+    def release(self, db: Session, path: str):
+        """释放一次引用，引用计数归零时删除文件
+
+        只处理存储登记过的文件；不在存储中的路径（如批量分析引用的本地图片）不做任何操作。
+        计数的增减都是原子的SQL UPDATE，删除时再次确认计数未被并发的上传增加。
+        """
+        content_hash = self.content_hash_of(path)
+        if content_hash is None:
+            return
+
+        query = db.query(StoredFile).filter(StoredFile.content_hash == content_hash)
+        if not query.update({StoredFile.ref_count: StoredFile.ref_count - 1}, synchronize_session=False):
+            db.rollback()
+            return
+        db.commit()
+
+        stored = query.first()
+        if stored is None or stored.ref_count > 0:
+            return
+        stored_path = stored.path
+        deleted = query.filter(StoredFile.ref_count <= 0).delete(synchronize_session=False)
+        db.commit()
+        if deleted and os.path.exists(stored_path):
+            os.remove(stored_path)
+
+
+# 创建全局实例
+upload_store = UploadStore()
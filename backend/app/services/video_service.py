@@ -0,0 +1,369 @@
+import os
+import re
+import json
+import shutil
+import asyncio
+import logging
+import tempfile
+import subprocess
+import contextvars
+from concurrent.futures import Future
+from fractions import Fraction
+from typing import Dict, Any, Iterator, AsyncIterator, List, Optional, Tuple
+from PIL import Image
+import numpy as np
+from app.core.config import settings
+from app.core.workers import get_cpu_executor
+from app.core.metrics import VIDEO_FRAMES_SCANNED, VIDEO_EVENTS
+from app.services.analysis_service import analysis_service
+
+try:
+    import cv2
+except ImportError:  # 可选依赖：未安装时使用ffmpeg解码视频
+    cv2 = None
+
+logger = logging.getLogger(__name__)
+
+
+FRAME_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+# 变化得分使用的分块大小（像素，在缩小后的灰度图上）
+_SCORE_TILE = 8
+
+
+def _natural_key(name: str) -> List[Any]:
+    """frame_2.jpg 排在 frame_10.jpg 之前"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def iter_directory_frames(directory: str, sample_fps: float) -> Iterator[Tuple[float, Image.Image]]:
+    """按文件名顺序逐帧读取帧序列目录，帧率为settings.video_frame_dir_fps"""
+    names = sorted(
+        (name for name in os.listdir(directory) if name.lower().endswith(FRAME_EXTENSIONS)),
+        key=_natural_key
+    )
+    if not names:
+        raise ValueError(f"目录中没有图片帧: {directory}")
+    frame_rate = settings.video_frame_dir_fps
+    step = max(1, round(frame_rate / sample_fps))
+    for index in range(0, len(names), step):
+        with Image.open(os.path.join(directory, names[index])) as image:
+            yield index / frame_rate, image.convert("RGB")
+
+
+def _iter_opencv_frames(path: str, sample_fps: float) -> Iterator[Tuple[float, Image.Image]]:
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"无法打开视频文件: {path}")
+    try:
+        frame_rate = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        step = max(1, round(frame_rate / sample_fps))
+        index = 0
+        # 跳过的帧只grab不解码为图像
+        while capture.grab():
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                yield index / frame_rate, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            index += 1
+    finally:
+        capture.release()
+
+
+def _probe_video(path: str) -> Tuple[int, int]:
+    """用ffprobe获取视频宽高"""
+    output = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=width,height", "-of", "json", path],
+        capture_output=True, check=True
+    ).stdout
+    streams = json.loads(output).get("streams") or []
+    if not streams:
+        raise ValueError(f"文件中没有视频流: {path}")
+    return int(streams[0]["width"]), int(streams[0]["height"])
+
+
+def _iter_ffmpeg_frames(path: str, sample_fps: float) -> Iterator[Tuple[float, Image.Image]]:
+    try:
+        width, height = _probe_video(path)
+    except subprocess.CalledProcessError as e:
+        raise ValueError(f"无法读取视频文件: {path}, {e.stderr.decode(errors='replace').strip()}")
+    frame_bytes = width * height * 3
+    # 由ffmpeg按采样帧率抽帧，管道中只传输采样后的原始RGB帧
+    process = subprocess.Popen(
+        ["ffmpeg", "-v", "error", "-i", path, "-vf", f"fps={Fraction(sample_fps).limit_denominator(1000)}",
+         "-f", "rawvideo", "-pix_fmt", "rgb24", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=frame_bytes
+    )
+    try:
+        index = 0
+        while True:
+            data = process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            yield index / sample_fps, Image.frombuffer("RGB", (width, height), data, "raw", "RGB", 0, 1)
+            index += 1
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+
+
+def iter_video_frames(path: str, sample_fps: float) -> Iterator[Tuple[float, Image.Image]]:
+    """逐帧解码视频文件（优先使用OpenCV，未安装时使用ffmpeg），产出 (时间戳秒, 图片)"""
+    if cv2 is not None:
+        return _iter_opencv_frames(path, sample_fps)
+    if shutil.which("ffmpeg") and shutil.which("ffprobe"):
+        return _iter_ffmpeg_frames(path, sample_fps)
+    raise ValueError("解码视频文件需要安装opencv-python或ffmpeg")
+
+
+def iter_frames(source: str, sample_fps: float) -> Iterator[Tuple[float, Image.Image]]:
+    """视频文件或帧序列目录的逐帧生成器，任意时刻只持有当前帧"""
+    if os.path.isdir(source):
+        return iter_directory_frames(source, sample_fps)
+    if os.path.isfile(source):
+        return iter_video_frames(source, sample_fps)
+    raise ValueError(f"视频文件或帧目录不存在: {source}")
+
+
+def frame_signature(image: Image.Image, side: int) -> np.ndarray:
+    """计算变化得分用的缩小灰度图"""
+    scale = side / max(image.size)
+    size = (max(_SCORE_TILE, int(image.width * scale)), max(_SCORE_TILE, int(image.height * scale)))
+    return np.asarray(image.convert("L").resize(size, Image.BOX), dtype=np.float32)
+
+
+def change_score(previous: np.ndarray, current: np.ndarray) -> float:
+    """相邻帧的变化得分：亮度补偿后逐块平均绝对差的最大值（0-255）
+
+    取最大块而不是全图均值，使画面中的小物体变化不会被大面积静止背景稀释。
+    """
+    diff = current - previous
+    diff -= np.median(diff)
+    np.abs(diff, out=diff)
+    rows, cols = diff.shape[0] // _SCORE_TILE, diff.shape[1] // _SCORE_TILE
+    diff = diff[:rows * _SCORE_TILE, :cols * _SCORE_TILE]
+    return float(diff.reshape(rows, _SCORE_TILE, cols, _SCORE_TILE).mean(axis=(1, 3)).max())
+
+
+class ChangeEventDetector:
+    """从逐帧变化得分中检测变化事件
+
+    得分达到阈值时开始事件，保存变化前的最后一帧；连续gap秒低于阈值（画面重新稳定）时结束事件，
+    保存稳定后的帧。事件持续超过max_seconds时强制结束并从当前帧开始新的检测。
+    每个事件只保留前后两个关键帧，内存占用与视频长度无关。
+    """
+
+    def __init__(self, threshold: float, gap: float, max_seconds: float, score_side: int):
+        self.threshold = threshold
+        self.gap = gap
+        self.max_seconds = max_seconds
+        self.score_side = score_side
+        self.frames = 0
+        self.duration = 0.0
+        self._previous: Optional[Tuple[float, Image.Image, np.ndarray]] = None
+        self._event: Optional[Dict[str, Any]] = None
+
+    def feed(self, timestamp: float, image: Image.Image) -> Optional[Dict[str, Any]]:
+        """处理一帧，事件结束时返回事件"""
+        signature = frame_signature(image, self.score_side)
+        self.frames += 1
+        self.duration = timestamp
+        finished = None
+        if self._previous is not None:
+            score = change_score(self._previous[2], signature)
+            if self._event is None:
+                if score >= self.threshold:
+                    before_time, before_image, _ = self._previous
+                    self._event = {
+                        "start_time": before_time, "last_active": timestamp, "peak_time": timestamp,
+                        "peak_score": score, "before_image": before_image
+                    }
+            else:
+                event = self._event
+                if score >= self.threshold:
+                    event["last_active"] = timestamp
+                    if score > event["peak_score"]:
+                        event["peak_score"], event["peak_time"] = score, timestamp
+                if timestamp - event["last_active"] >= self.gap or timestamp - event["start_time"] >= self.max_seconds:
+                    finished = self._finish(timestamp, image)
+        self._previous = (timestamp, image, signature)
+        return finished
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """视频结束时结束进行中的事件"""
+        if self._event is None or self._previous is None:
+            return None
+        timestamp, image, _ = self._previous
+        return self._finish(timestamp, image)
+
+    def _finish(self, timestamp: float, image: Image.Image) -> Dict[str, Any]:
+        event = self._event
+        self._event = None
+        return {
+            "start_time": event["start_time"],
+            "end_time": event["last_active"],
+            "peak_time": event["peak_time"],
+            "peak_score": event["peak_score"],
+            "before_time": event["start_time"],
+            "after_time": timestamp,
+            "before_image": event["before_image"],
+            "after_image": image
+        }
+
+
+class VideoService:
+    """视频/帧序列分析：逐帧计算低成本的变化得分，只把变化事件前后的关键帧送入完整分析流程"""
+
+    def __init__(self):
+        self.analysis_service = analysis_service
+
+    def scan_events(self, source: str, sample_fps: float, workdir: str,
+                    detector: ChangeEventDetector) -> Iterator[Dict[str, Any]]:
+        """同步生成器：解码并检测变化事件，关键帧写入workdir"""
+        for timestamp, image in iter_frames(source, sample_fps):
+            VIDEO_FRAMES_SCANNED.inc()
+            event = detector.feed(timestamp, image)
+            if event is not None:
+                yield self._save_keyframes(event, workdir)
+        event = detector.flush()
+        if event is not None:
+            yield self._save_keyframes(event, workdir)
+
+    def _save_keyframes(self, event: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+        name = f"{event['start_time']:010.3f}"
+        for key in ("before", "after"):
+            path = os.path.join(workdir, f"{name}_{key}.jpg")
+            event.pop(f"{key}_image").save(path, "JPEG", quality=95)
+            event[f"{key}_path"] = path
+        return event
+
+    @staticmethod
+    def _timeline_item(event: Dict[str, Any], **fields: Any) -> Dict[str, Any]:
+        """时间线中的事件（不含临时关键帧路径）"""
+        item = {key: value for key, value in event.items() if not key.endswith("_path")}
+        item.update(fields)
+        return item
+
+    async def _analyze_event(self, event: Dict[str, Any], semaphore: asyncio.Semaphore,
+                             threshold: float, latency_budget: Optional[float]) -> Dict[str, Any]:
+        try:
+            async with semaphore:
+                result = await self.analysis_service.analyze_images(
+                    event["before_path"], event["after_path"], threshold, latency_budget
+                )
+            VIDEO_EVENTS.inc(outcome="analyzed")
+            return self._timeline_item(event, status="success", result=result.dict())
+        except Exception as e:
+            VIDEO_EVENTS.inc(outcome="error")
+            return self._timeline_item(event, status="error", error=str(e))
+
+    async def iter_analyze(self, source: str, options: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """逐个产出按时间排序的事件（type=event），最后产出汇总（type=summary）
+
+        解码和事件检测在CPU工作池中进行，检测到的事件立即开始分析，与后续帧的解码并行。
+        超过max_events的事件只记录时间线，不调用分析（status=skipped）。
+        """
+        sample_fps = float(options.get("sample_fps") or settings.video_sample_fps)
+        change_threshold = float(options.get("change_threshold") or settings.video_change_threshold)
+        max_events = int(options.get("max_events") or settings.video_max_events)
+        threshold = options.get("threshold", 0.8)
+        concurrency = int(options.get("concurrency") or settings.batch_concurrency)
+        if sample_fps <= 0:
+            raise ValueError("采样帧率必须大于0")
+        if not os.path.exists(source):
+            raise ValueError(f"视频文件或帧目录不存在: {source}")
+
+        detector = ChangeEventDetector(
+            change_threshold, settings.video_event_gap, settings.video_max_event_seconds,
+            settings.video_score_side
+        )
+        semaphore = asyncio.Semaphore(max(1, min(concurrency, settings.batch_max_concurrency)))
+        workdir = tempfile.mkdtemp(prefix="video_frames_")
+        scanner = self.scan_events(source, sample_fps, workdir, detector)
+        pending: asyncio.Queue = asyncio.Queue()
+        counts = {"analyzed": 0, "skipped": 0}
+        # 正在工作线程中执行的next：取消生产者不会中断它，关闭生成器前必须等它返回
+        scanning: List[Optional[Future]] = [None]
+
+        async def produce():
+            try:
+                while True:
+                    scanning[0] = get_cpu_executor().submit(contextvars.copy_context().run, next, scanner, None)
+                    event = await asyncio.wrap_future(scanning[0])
+                    if event is None:
+                        break
+                    if counts["analyzed"] < max_events:
+                        counts["analyzed"] += 1
+                        task = asyncio.create_task(
+                            self._analyze_event(event, semaphore, threshold, options.get("latency_budget"))
+                        )
+                    else:
+                        counts["skipped"] += 1
+                        VIDEO_EVENTS.inc(outcome="skipped")
+                        task = asyncio.get_running_loop().create_future()
+                        task.set_result(self._timeline_item(event, status="skipped"))
+                    await pending.put(task)
+            finally:
+                await pending.put(None)
+
+        producer = asyncio.create_task(produce())
+        tasks: List[asyncio.Future] = []
+        try:
+            index = 0
+            while True:
+                task = await pending.get()
+                if task is None:
+                    break
+                tasks.append(task)
+                yield dict(await task, type="event", index=index)
+                index += 1
+            # 解码失败等异常在此抛出
+            await producer
+            logger.info("视频分析完成: %s, %d 帧, %d 个事件", source, detector.frames, index)
+            yield {
+                "type": "summary",
+                "source": source,
+                "frames_scanned": detector.frames,
+                "duration": detector.duration,
+                "events": index,
+                "analyzed_events": counts["analyzed"],
+                "skipped_events": counts["skipped"]
+            }
+        finally:
+            producer.cancel()
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            while not pending.empty():
+                task = pending.get_nowait()
+                if task is not None:
+                    task.cancel()
+            try:
+                await asyncio.gather(producer, return_exceptions=True)
+                # 等待正在执行的next返回后再关闭生成器（结束ffmpeg进程、释放视频句柄）
+                if scanning[0] is not None and not scanning[0].done():
+                    await asyncio.gather(asyncio.wrap_future(scanning[0]), return_exceptions=True)
+                scanner.close()
+            except Exception as e:
+                logger.warning("关闭视频解码失败: %s", e)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    async def analyze(self, source: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        """分析整个视频，返回事件时间线"""
+        events = []
+        summary = {}
+        async for item in self.iter_analyze(source, options):
+            if item["type"] == "event":
+                events.append(item)
+            else:
+                summary = item
+        summary.pop("type", None)
+        return dict(summary, timeline=events)
+
+
+# 创建全局实例
+video_service = VideoService()
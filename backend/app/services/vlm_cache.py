@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Any, Optional, List
+from app.core.config import settings
+from app.core.metrics import CACHE_REQUESTS
+
+
+# 命中时只在内存中记录访问时间，每隔该时间（秒）批量写回，避免每次命中都UPDATE+commit
+TOUCH_FLUSH_INTERVAL = 5.0
+# 待写回的访问时间超过该数量时立即写回
+TOUCH_FLUSH_MAX = 256
+
+
+class VLMResultCache:
+    """VLM分析结果缓存（基于内容哈希，本地SQLite持久化）
+
+    缓存键由两张图片的内容哈希、提示词版本、模型名称和推理参数共同决定，
+    支持TTL过期、按最近访问时间的LRU淘汰以及条目数上限。
+    读写是阻塞的SQLite操作，异步代码中应在线程中调用。
+    """
+
+    def __init__(self, db_path: str, ttl: float, max_entries: int, enabled: bool = True):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._touched: Dict[str, float] = {}
+        self._touch_flushed = time.monotonic()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """获取SQLite连接（首次使用时建表）"""
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS vlm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    image1_hash TEXT NOT NULL,
+                    image2_hash TEXT NOT NULL,
+                    prompt_name TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_vlm_cache_last_access ON vlm_cache (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_vlm_cache_image1 ON vlm_cache (image1_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_vlm_cache_image2 ON vlm_cache (image2_hash)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def make_key(image1_hash: str, image2_hash: str, prompt_name: str, prompt_version: str,
+                 model: str, options: Dict[str, Any]) -> str:
+        """生成缓存键"""
+        material = json.dumps(
+            [image1_hash, image2_hash, prompt_name, prompt_version, model, options],
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存，未命中或已过期时返回None"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            conn = self._get_conn()
+            row = conn.execute(
+                "SELECT value, created_at FROM vlm_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or (self.ttl > 0 and now - row[1] > self.ttl):
+                if row is not None:
+                    conn.execute("DELETE FROM vlm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="vlm", result="miss")
+                return None
+
+            self._touched[key] = now
+            if len(self._touched) >= TOUCH_FLUSH_MAX \
+                    or time.monotonic() - self._touch_flushed >= TOUCH_FLUSH_INTERVAL:
+                self._flush_touches(conn)
+                conn.commit()
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="vlm", result="hit")
+            return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any], image1_hash: str, image2_hash: str,
+            prompt_name: str, prompt_version: str, model: str):
+        """写入缓存，并按LRU淘汰超出上限的条目"""
+        if not self.enabled:
+            return
+
+        now = time.time()
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO vlm_cache
+                    (key, value, image1_hash, image2_hash, prompt_name, prompt_version, model, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (key, json.dumps(value, ensure_ascii=False), image1_hash, image2_hash,
+                 prompt_name, prompt_version, model, now, now)
+            )
+            # 淘汰前写回访问时间，保证LRU顺序准确
+            self._flush_touches(conn)
+            self._evict(conn, now)
+            conn.commit()
+
+    def _flush_touches(self, conn: sqlite3.Connection):
+        """批量写回缓存命中时记录的访问时间（由调用方提交）"""
+        if self._touched:
+            conn.executemany(
+                "UPDATE vlm_cache SET last_access = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._touched.items()]
+            )
+            self._touched.clear()
+        self._touch_flushed = time.monotonic()
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """淘汰过期条目和超出数量上限的最久未访问条目"""
+        if self.ttl > 0:
+            conn.execute("DELETE FROM vlm_cache WHERE created_at < ?", (now - self.ttl,))
+
+        count = conn.execute("SELECT COUNT(*) FROM vlm_cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM vlm_cache WHERE key IN "
+                "(SELECT key FROM vlm_cache ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+
+    def invalidate(self, image_hash: Optional[str] = None, prompt_version: Optional[str] = None,
+                   model: Optional[str] = None) -> int:
+        """按条件删除缓存条目，不传条件时清空全部缓存，返回删除数量"""
+        conditions: List[str] = []
+        params: List[Any] = []
+        if image_hash:
+            conditions.append("(image1_hash = ? OR image2_hash = ?)")
+            params.extend([image_hash, image_hash])
+        if prompt_version:
+            conditions.append("prompt_version = ?")
+            params.append(prompt_version)
+        if model:
+            conditions.append("model = ?")
+            params.append(model)
+
+        sql = "DELETE FROM vlm_cache"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        with self._lock:
+            conn = self._get_conn()
+            deleted = conn.execute(sql, params).rowcount
+            conn.commit()
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            entries = self._get_conn().execute("SELECT COUNT(*) FROM vlm_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+
+# 创建全局实例
+vlm_cache = VLMResultCache(
+    db_path=settings.vlm_cache_path,
+    ttl=settings.vlm_cache_ttl,
+    max_entries=settings.vlm_cache_max_entries,
+    enabled=settings.vlm_cache_enabled
+)
@@ -0,0 +1,128 @@
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Dict, Any, List, Optional
+from PIL import Image
+from app.core.config import settings
+
+
+VLM_IMAGE_FORMATS = ("original", "JPEG", "PNG", "WEBP")
+
+
+def vlm_input_options(max_side: Optional[int] = None, image_format: Optional[str] = None,
+                      quality: Optional[int] = None, grayscale: Optional[bool] = None) -> Dict[str, Any]:
+    """VLM输入预处理参数（未指定的项使用配置值），同时作为缓存键的一部分"""
+    options = {
+        "max_side": settings.vlm_max_side if max_side is None else max_side,
+        "format": image_format or settings.vlm_image_format,
+        "quality": settings.vlm_image_quality if quality is None else quality,
+        "grayscale": settings.vlm_grayscale if grayscale is None else grayscale
+    }
+    if options["format"] not in VLM_IMAGE_FORMATS:
+        raise ValueError(f"不支持的VLM图片格式: {options['format']}")
+    return options
+
+
+def prepare_vlm_image(image: Image.Image, raw_bytes: bytes, options: Dict[str, Any]) -> bytes:
+    """按预处理参数缩放并重新编码图片
+
+    format为original且max_side为0时直接使用原始上传内容。
+    """
+    if options["format"] == "original" and not options["max_side"] and not options["grayscale"]:
+        return raw_bytes
+
+    img = image
+    max_side = options["max_side"]
+    if max_side and max(img.size) > max_side:
+        img = img.copy()
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    if options["grayscale"]:
+        img = img.convert('L')
+
+    image_format = options["format"] if options["format"] != "original" else "JPEG"
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        img.save(buffer, format="PNG", optimize=False)
+    else:
+        img.save(buffer, format=image_format, quality=options["quality"])
+    return buffer.getvalue()
+
+
+def _difference_types(result: Dict[str, Any]) -> set:
+    return {diff.get("type") for diff in result.get("differences", []) if isinstance(diff, dict)}
+
+
+async def benchmark_resolutions(image1_path: str, image2_path: str, sides: List[int],
+                                repeats: int = 1) -> List[Dict[str, Any]]:
+    """对比不同输入分辨率下的VLM延迟、载荷大小和结果一致性
+
+    以列表中的第一个分辨率作为参考结果，其余分辨率与参考结果比较差异类型的Jaccard相似度。
+    直接调用Ollama API，不经过结果缓存。
+    """
+    from app.services.image_bundle import ImageBundle
+    from app.services.ollama_service import ollama_service, DIFFERENCE_PROMPT
+
+    reports = []
+    reference_types = None
+    try:
+        for side in sides:
+            # 按当前分辨率加载，确保解码尺寸不低于目标尺寸
+            options = vlm_input_options(max_side=side)
+            decode_side = max(side, settings.image_decode_max_side) if side else 100000
+            bundle1 = ImageBundle(image1_path, max_side=decode_side)
+            bundle2 = ImageBundle(image2_path, max_side=decode_side)
+            images = [
+                bundle1.vlm_base64_for(options),
+                bundle2.vlm_base64_for(options)
+            ]
+
+            latencies = []
+            result: Dict[str, Any] = {}
+            for _ in range(repeats):
+                start = time.time()
+                response = await ollama_service._call_ollama_api(DIFFERENCE_PROMPT, images)
+                latencies.append(time.time() - start)
+                result = ollama_service._parse_analysis_response(response.get('response', ''), 0.0, start)
+
+            types = _difference_types(result)
+            if reference_types is None:
+                reference_types = types
+            union = types | reference_types
+            reports.append({
+                "max_side": side,
+                "payload_bytes": sum(len(image) for image in images),
+                "latency_mean": sum(latencies) / len(latencies),
+                "latency_min": min(latencies),
+                "differences": len(result.get("differences", [])),
+                "agreement": len(types & reference_types) / len(union) if union else 1.0
+            })
+    finally:
+        await ollama_service.close()
+    return reports
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="VLM输入分辨率基准测试（精度 vs 延迟）")
+    parser.add_argument("image1")
+    parser.add_argument("image2")
+    parser.add_argument("--sides", default="0,1536,1024,768,512",
+                        help="逗号分隔的最长边列表，0表示原始分辨率，第一个作为参考")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--output", help="结果JSON输出文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    sides = [int(side) for side in args.sides.split(",")]
+    reports = asyncio.run(benchmark_resolutions(args.image1, args.image2, sides, args.repeats))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(reports, output, ensure_ascii=False, indent=2)
+    else:
+        json.dump(reports, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
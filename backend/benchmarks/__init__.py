@@ -0,0 +1,8 @@
+"""性能基准测试
+
+synthetic    生成合成图片对（相同、噪声、光照变化、插入物体，多种分辨率）
+fake_ollama  本地Ollama替身服务（可配置延迟，返回固定响应或回放录制的响应）
+runner       测量analyze_images、batch_analyze和HTTP接口的吞吐量与延迟分位数，输出JSON
+
+用法（在backend目录下）: python -m benchmarks.runner --output result.json
+"""
@@ -0,0 +1,332 @@
+import json
+import time
+import random
+import hashlib
+import re
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional
+import httpx
+
+
+# 未指定响应文件时返回的分析结果
+DEFAULT_RESPONSE = {
+    "similarity_score": 0.72,
+    "differences": [
+        {
+            "type": "object_appeared",
+            "description": "画面中出现一个深色物体",
+            "confidence": 0.9,
+            "bbox": [120, 80, 260, 300],
+            "severity": "medium"
+        }
+    ],
+    "alert_level": "warning",
+    "summary": "检测到新出现的物体"
+}
+
+# 流式响应每个片段的字符数
+_STREAM_CHUNK_CHARS = 16
+
+# 未指定keep_alive时模型常驻的秒数（与Ollama默认的5分钟一致）
+DEFAULT_KEEP_ALIVE = 300.0
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_keep_alive(value: Any) -> float:
+    """keep_alive转换为秒：数字按秒，字符串按时长（如30m、1h30m），负数表示永久常驻"""
+    if value is None:
+        return DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    sign = -1.0 if text.startswith("-") else 1.0
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", text)
+    if not parts:
+        return DEFAULT_KEEP_ALIVE
+    return sign * sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def request_key(body: Dict[str, Any]) -> str:
+    """录制和回放使用的请求键：模型+提示词+图片内容"""
+    digest = hashlib.sha256()
+    digest.update(str(body.get("model", "")).encode())
+    digest.update(b"\0" + str(body.get("prompt", "")).encode())
+    for image in body.get("images") or []:
+        digest.update(b"\0" + image.encode())
+    return digest.hexdigest()
+
+
+class FakeOllamaServer:
+    """本地Ollama替身服务
+
+    实现/api/generate（流式和非流式）、/api/tags和/api/ps。每个推理请求等待
+    latency±jitter秒后返回；parallel>0时最多同时处理parallel个请求，其余排队，
+    模拟Ollama的OLLAMA_NUM_PARALLEL。
+
+    模型按请求的keep_alive常驻，到期后卸载；模型未加载时请求额外等待load_latency秒，
+    并在load_duration中返回，/api/ps只列出常驻中的模型。空提示词且无图片的请求只加载模型。
+
+    响应来源：
+    - 固定响应：response中的分析结果（默认DEFAULT_RESPONSE）
+    - 回放：recordings_path为录制文件（JSONL，每行{"key", "response"}），按请求键匹配，
+      未匹配的请求返回固定响应
+    - 录制：指定upstream时把请求转发给真实的Ollama服务，并把响应追加到record_path
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, model: str = "qwen2.5vl:7b-fp16",
+                 latency: float = 0.5, jitter: float = 0.0, parallel: int = 0,
+                 stream_chunk_delay: float = 0.005, response: Optional[Dict[str, Any]] = None,
+                 recordings_path: Optional[str] = None, upstream: Optional[str] = None,
+                 record_path: Optional[str] = None, load_latency: float = 0.0):
+        self.model = model
+        self.latency = latency
+        self.load_latency = load_latency
+        # 常驻的模型 -> 到期时间（time.time()，None表示永久）
+        self.loaded: Dict[str, Optional[float]] = {}
+        self._load_lock = threading.Lock()
+        self.jitter = jitter
+        self.stream_chunk_delay = stream_chunk_delay
+        self.response_text = json.dumps(response or DEFAULT_RESPONSE, ensure_ascii=False)
+        self.upstream = upstream
+        self.record_path = record_path
+        self.recordings: Dict[str, Dict[str, Any]] = {}
+        if recordings_path:
+            self.recordings = self.load_recordings(recordings_path)
+
+        self.stats = {"requests": 0, "replayed": 0, "recorded": 0, "in_flight": 0, "max_in_flight": 0,
+                      "loads": 0}
+        self._stats_lock = threading.Lock()
+        self._record_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(parallel) if parallel > 0 else None
+        self._upstream_client = httpx.Client(base_url=upstream, timeout=600.0) if upstream else None
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @staticmethod
+    def load_recordings(path: str) -> Dict[str, Dict[str, Any]]:
+        recordings = {}
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    recordings[entry["key"]] = entry["response"]
+        return recordings
+
+    def start(self) -> str:
+        """在后台线程中启动服务，返回服务地址"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+        if self._upstream_client is not None:
+            self._upstream_client.close()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[name] += amount
+            if name == "in_flight":
+                self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+    def running_models(self) -> Dict[str, Optional[float]]:
+        """常驻中的模型（移除已到期的）"""
+        now = time.time()
+        with self._load_lock:
+            for name, expires_at in list(self.loaded.items()):
+                if expires_at is not None and expires_at <= now:
+                    del self.loaded[name]
+            return dict(self.loaded)
+
+    def _load_model(self, body: Dict[str, Any]) -> int:
+        """模型未常驻时模拟加载，按keep_alive更新到期时间，返回加载耗时（纳秒）"""
+        name = body.get("model", self.model)
+        load_ns = 0
+        if name not in self.running_models():
+            self._count("loads")
+            time.sleep(self.load_latency)
+            load_ns = int(self.load_latency * 1e9)
+        keep_alive = parse_keep_alive(body.get("keep_alive"))
+        with self._load_lock:
+            if keep_alive == 0:
+                self.loaded.pop(name, None)
+            else:
+                self.loaded[name] = None if keep_alive < 0 else time.time() + keep_alive
+        return load_ns
+
+    def generate(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """返回一次推理的完整（非流式）响应，包含模拟延迟"""
+        if not body.get("prompt") and not body.get("images") and self._upstream_client is None:
+            load_ns = self._load_model(body)
+            return {"model": body.get("model", self.model), "response": "", "done": True,
+                    "done_reason": "load", "load_duration": load_ns, "total_duration": load_ns}
+        self._count("requests")
+        if self._slots is not None:
+            self._slots.acquire()
+        self._count("in_flight")
+        start = time.perf_counter()
+        try:
+            if self._upstream_client is not None:
+                return self._forward(body)
+
+            recorded = self.recordings.get(request_key(body))
+            load_ns = self._load_model(body)
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+            if recorded is not None:
+                self._count("replayed")
+                return dict(recorded, done=True, load_duration=load_ns)
+
+            elapsed_ns = int((time.perf_counter() - start) * 1e9)
+            return {
+                "model": body.get("model", self.model),
+                "response": self.response_text,
+                "done": True,
+                "total_duration": elapsed_ns,
+                "load_duration": load_ns,
+                "prompt_eval_count": 512,
+                "eval_count": len(self.response_text) // 3,
+                "eval_duration": elapsed_ns
+            }
+        finally:
+            self._count("in_flight", -1)
+            if self._slots is not None:
+                self._slots.release()
+
+    def _forward(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """转发给真实的Ollama服务（统一使用非流式）并录制响应"""
+        response = self._upstream_client.post("/api/generate", json=dict(body, stream=False))
+        response.raise_for_status()
+        result = response.json()
+        if self.record_path:
+            line = json.dumps({"key": request_key(body), "response": result}, ensure_ascii=False)
+            with self._record_lock, open(self.record_path, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
+        self.recordings[request_key(body)] = result
+        self._count("recorded")
+        return result
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, obj: Dict[str, Any], status: int = 200):
+                data = json.dumps(obj, ensure_ascii=False).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, obj: Dict[str, Any]):
+                data = json.dumps(obj, ensure_ascii=False).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json({"models": [{"name": server.model, "model": server.model}]})
+                elif self.path == "/api/ps":
+                    models = []
+                    for name, expires_at in server.running_models().items():
+                        expires = datetime.fromtimestamp(expires_at, timezone.utc) if expires_at is not None \
+                            else datetime(2318, 1, 1, tzinfo=timezone.utc)
+                        models.append({"name": name, "model": name, "expires_at": expires.isoformat()})
+                    self._send_json({"models": models})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                if self.path != "/api/generate":
+                    self._send_json({"error": "not found"}, 404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                try:
+                    result = server.generate(body)
+                except Exception as e:
+                    self._send_json({"error": str(e)}, 500)
+                    return
+
+                if body.get("stream") is False:
+                    self._send_json(result)
+                    return
+
+                # 流式：把完整输出切成片段逐个发送，最后一个片段携带统计信息
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                text = result.get("response", "")
+                for start in range(0, len(text), _STREAM_CHUNK_CHARS):
+                    self._send_chunk({"model": result.get("model"), "response": text[start:start + _STREAM_CHUNK_CHARS],
+                                      "done": False})
+                    if server.stream_chunk_delay:
+                        time.sleep(server.stream_chunk_delay)
+                self._send_chunk(dict(result, response=""))
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="本地Ollama替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--model", default="qwen2.5vl:7b-fp16")
+    parser.add_argument("--latency", type=float, default=0.5, help="每次推理的模拟耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="耗时的随机波动范围（秒）")
+    parser.add_argument("--load-latency", type=float, default=0.0, help="模型未常驻时的模拟加载耗时（秒）")
+    parser.add_argument("--parallel", type=int, default=0, help="同时处理的推理请求数，0表示不限")
+    parser.add_argument("--response", help="固定响应使用的分析结果JSON文件")
+    parser.add_argument("--recordings", help="回放的录制文件（JSONL）")
+    parser.add_argument("--upstream", help="真实Ollama服务地址，指定时转发请求并录制响应")
+    parser.add_argument("--record", help="录制文件输出路径（JSONL，追加写入）")
+    args = parser.parse_args(argv)
+
+    response = None
+    if args.response:
+        with open(args.response, encoding="utf-8") as file:
+            response = json.load(file)
+
+    server = FakeOllamaServer(
+        args.host, args.port, args.model, args.latency, args.jitter, args.parallel,
+        response=response, recordings_path=args.recordings, upstream=args.upstream, record_path=args.record,
+        load_latency=args.load_latency
+    )
+    print(f"Ollama替身服务: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
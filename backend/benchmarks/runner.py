@@ -0,0 +1,345 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+import numpy as np
+
+from benchmarks.synthetic import generate_pairs, load_pairs, parse_resolutions, PAIR_KINDS
+from benchmarks.fake_ollama import FakeOllamaServer
+
+# 注意：app模块在配置好环境变量后才导入（settings在导入时读取环境变量）
+
+SCENARIOS = ("analyze_images", "batch_analyze", "http_compare", "http_stream", "http_batch")
+PERCENTILES = (50, 90, 95, 99)
+# 与基准结果比较时检查的指标 -> 数值越大越好
+_COMPARED_METRICS = {"p50": False, "p90": False, "p99": False, "throughput": True}
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    values = np.asarray(latencies)
+    summary = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+    summary.update(mean=float(values.mean()), min=float(values.min()), max=float(values.max()))
+    return summary
+
+
+def _histogram_quantile(upper_bounds, counts: List[int], q: float) -> float:
+    """按分桶计数估算分位数（桶内线性插值，与Prometheus的histogram_quantile一致）"""
+    total = sum(counts)
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(upper_bounds, counts):
+        if count and cumulative + count >= rank:
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return upper_bounds[-1]
+
+
+def stage_summary(before: Dict, after: Dict, upper_bounds) -> Dict[str, Dict[str, float]]:
+    """两次直方图快照之间各阶段的次数、平均耗时和估算分位数"""
+    stages = {}
+    for key, (counts, total) in after.items():
+        previous_counts, previous_total = before.get(key, ([0] * len(counts), 0.0))
+        delta = [now - then for now, then in zip(counts, previous_counts)]
+        count = sum(delta)
+        if not count:
+            continue
+        summary = {"count": count, "mean": (total - previous_total) / count}
+        for p in PERCENTILES:
+            summary[f"p{p}"] = _histogram_quantile(upper_bounds, delta, p / 100)
+        stages[key[0]] = summary
+    return stages
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def configure_environment(workdir: str, ollama_url: str, cache: bool):
+    """让被测服务使用临时目录中的数据库、缓存和上传目录，并指向Ollama替身"""
+    os.environ.update({
+        "OLLAMA_BASE_URL": ollama_url,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "BASELINE_DIR": os.path.join(workdir, "baselines"),
+        "VLM_CACHE_PATH": os.path.join(workdir, "vlm_cache.db"),
+        "VLM_CACHE_ENABLED": "true" if cache else "false",
+        "PERSIST_JOURNAL_PATH": os.path.join(workdir, "persist_journal.jsonl"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING")
+    })
+
+
+class BenchmarkRunner:
+    """依次执行各基准场景，每个场景重复iterations轮（之前先执行warmup轮不计入结果）"""
+
+    def __init__(self, pairs: List[Dict[str, Any]], iterations: int, warmup: int, concurrency: int,
+                 fake: Optional[FakeOllamaServer]):
+        self.pairs = pairs
+        self.iterations = iterations
+        self.warmup = warmup
+        self.concurrency = concurrency
+        self.fake = fake
+
+    async def _measure(self, items: int, call: Callable[[], Awaitable[List[float]]]) -> Dict[str, Any]:
+        """执行一个场景：call完成一轮并返回本轮各请求的延迟，items为每轮处理的图片对数"""
+        from app.core.metrics import ANALYSIS_STAGE_SECONDS
+
+        for _ in range(self.warmup):
+            await call()
+
+        requests_before = self.fake.stats["requests"] if self.fake else 0
+        stages_before = ANALYSIS_STAGE_SECONDS.snapshot()
+        latencies: List[float] = []
+        errors = 0
+        start = time.perf_counter()
+        for _ in range(self.iterations):
+            try:
+                latencies.extend(await call())
+            except Exception as e:
+                errors += 1
+                print(f"基准场景执行失败: {e}", file=sys.stderr)
+        wall = time.perf_counter() - start
+
+        report = {
+            "requests": len(latencies),
+            "pairs": items * self.iterations,
+            "errors": errors,
+            "wall_seconds": wall,
+            "throughput": items * (self.iterations - errors) / wall if wall else 0.0,
+            "latency": latency_summary(latencies),
+            "stages": stage_summary(stages_before, ANALYSIS_STAGE_SECONDS.snapshot(),
+                                    ANALYSIS_STAGE_SECONDS.upper_bounds)
+        }
+        if self.fake:
+            report["vlm_requests"] = self.fake.stats["requests"] - requests_before
+        return report
+
+    async def _bounded(self, calls: List[Callable[[], Awaitable[Any]]]) -> List[float]:
+        """以self.concurrency的并发执行calls，返回每个调用的延迟"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def timed(call):
+            async with semaphore:
+                start = time.perf_counter()
+                await call()
+                return time.perf_counter() - start
+
+        return list(await asyncio.gather(*(timed(call) for call in calls)))
+
+    async def analyze_images(self) -> Dict[str, Any]:
+        from app.services.analysis_service import analysis_service
+
+        def call_for(pair):
+            return lambda: analysis_service.analyze_images(pair["image1_path"], pair["image2_path"])
+
+        return await self._measure(len(self.pairs), lambda: self._bounded([call_for(p) for p in self.pairs]))
+
+    async def batch_analyze(self) -> Dict[str, Any]:
+        from app.services.analysis_service import analysis_service
+
+        async def call():
+            start = time.perf_counter()
+            results = await analysis_service.batch_analyze(self.pairs, {"concurrency": self.concurrency})
+            failed = [item for item in results if item["status"] != "success"]
+            if failed:
+                raise Exception(f"{len(failed)} 个图片对分析失败: {failed[0]['error']}")
+            return [time.perf_counter() - start]
+
+        return await self._measure(len(self.pairs), call)
+
+    async def http(self, scenario: str) -> Dict[str, Any]:
+        """通过ASGI传输在进程内调用HTTP接口，包含中间件、上传存储和持久化"""
+        import httpx
+        import main
+
+        await main.startup_event()
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=600) as client:
+                if scenario == "http_batch":
+                    return await self._measure(len(self.pairs), lambda: self._http_batch(client))
+                path = "/api/v1/compare-images" + ("/stream" if scenario == "http_stream" else "")
+
+                def call_for(pair):
+                    return lambda: self._http_compare(client, path, pair)
+
+                return await self._measure(len(self.pairs), lambda: self._bounded([call_for(p) for p in self.pairs]))
+        finally:
+            await main.shutdown_event()
+
+    @staticmethod
+    async def _http_compare(client, path: str, pair: Dict[str, Any]):
+        with open(pair["image1_path"], "rb") as image1, open(pair["image2_path"], "rb") as image2:
+            files = {
+                "image1": (os.path.basename(pair["image1_path"]), image1.read(), "image/jpeg"),
+                "image2": (os.path.basename(pair["image2_path"]), image2.read(), "image/jpeg")
+            }
+        response = await client.post(path, files=files, data={"save_results": "true"})
+        response.raise_for_status()
+        if path.endswith("/stream") and "event: error" in response.text:
+            raise Exception("流式分析返回错误事件")
+
+    async def _http_batch(self, client) -> List[float]:
+        body = {
+            "image_pairs": [
+                {"id": pair["id"], "image1_url": pair["image1_path"], "image2_url": pair["image2_path"]}
+                for pair in self.pairs
+            ],
+            "options": {"concurrency": self.concurrency}
+        }
+        start = time.perf_counter()
+        response = await client.post("/api/v1/batch-analyze", json=body)
+        response.raise_for_status()
+        return [time.perf_counter() - start]
+
+    async def run(self, scenarios: List[str]) -> Dict[str, Any]:
+        from app.services.ollama_service import ollama_service
+
+        results = {}
+        try:
+            for scenario in scenarios:
+                if scenario == "analyze_images":
+                    results[scenario] = await self.analyze_images()
+                elif scenario == "batch_analyze":
+                    results[scenario] = await self.batch_analyze()
+                else:
+                    results[scenario] = await self.http(scenario)
+        finally:
+            await ollama_service.close()
+        return results
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """与基准结果比较，返回超出容差的退化项"""
+    regressions = []
+    for scenario, report in current["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        for metric, higher_is_better in _COMPARED_METRICS.items():
+            now = report.get(metric, report["latency"].get(metric))
+            then = previous.get(metric, previous.get("latency", {}).get(metric))
+            if not now or not then:
+                continue
+            change = (now - then) / then
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append({"scenario": scenario, "metric": metric, "baseline": then,
+                                    "current": now, "change": change})
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="图片分析吞吐量和延迟基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--pairs-dir", help="已生成的图片对目录（包含manifest.json），默认临时生成")
+    parser.add_argument("--resolutions", default="640x480,1920x1080")
+    parser.add_argument("--kinds", default=",".join(PAIR_KINDS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--cache", action="store_true", help="启用VLM结果缓存（默认关闭，每轮都调用模型）")
+    parser.add_argument("--ollama-url", help="使用真实的Ollama服务而不是本地替身")
+    parser.add_argument("--latency", type=float, default=0.2, help="Ollama替身的推理耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--parallel", type=int, default=1, help="Ollama替身同时处理的请求数，0表示不限")
+    parser.add_argument("--load-latency", type=float, default=0.0, help="Ollama替身在模型未常驻时的加载耗时（秒）")
+    parser.add_argument("--recordings", help="Ollama替身回放的录制文件（JSONL）")
+    parser.add_argument("--workdir", help="数据库、缓存和上传文件目录，默认临时目录")
+    parser.add_argument("--output", help="结果JSON输出文件，默认输出到标准输出")
+    parser.add_argument("--baseline", help="用于比较的历史结果JSON，出现退化时退出码为1")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允许的相对退化比例")
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(sorted(unknown))}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="image-compare-bench-")
+    if args.pairs_dir:
+        pairs = load_pairs(args.pairs_dir)
+    else:
+        pairs = generate_pairs(os.path.join(workdir, "pairs"), parse_resolutions(args.resolutions),
+                               args.kinds.split(","), args.seed)
+
+    fake = None
+    ollama_url = args.ollama_url
+    if not ollama_url:
+        fake = FakeOllamaServer(latency=args.latency, jitter=args.jitter, parallel=args.parallel,
+                                recordings_path=args.recordings, load_latency=args.load_latency)
+        ollama_url = fake.start()
+    configure_environment(workdir, ollama_url, args.cache)
+
+    from app.core.config import settings
+
+    started_at = datetime.now().isoformat(timespec="seconds")
+    try:
+        runner = BenchmarkRunner(pairs, args.iterations, args.warmup, args.concurrency, fake)
+        # 服务启动信息输出到标准错误，标准输出只包含结果JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            scenario_results = asyncio.run(runner.run(scenarios))
+    finally:
+        if fake:
+            fake.stop()
+
+    result = {
+        "meta": {
+            "started_at": started_at,
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pairs": len(pairs),
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "ollama": {"url": args.ollama_url} if args.ollama_url else {
+                "fake": True, "latency": args.latency, "jitter": args.jitter, "parallel": args.parallel
+            },
+            "settings": {
+                name: getattr(settings, name) for name in (
+                    "ollama_model_name", "vlm_cache_enabled", "prescreen_policy", "localization_mode",
+                    "escalation_policy", "vlm_max_side", "persist_mode", "cpu_workers", "trace_mode"
+                )
+            }
+        },
+        "scenarios": scenario_results
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare_results(result, json.load(file), args.tolerance)
+        result["regressions"] = regressions
+        for item in regressions:
+            print(f"性能退化: {item['scenario']} {item['metric']} {item['baseline']:.4f} -> "
+                  f"{item['current']:.4f} ({item['change']:+.1%})", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(result, output, ensure_ascii=False, indent=2)
+    else:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+import json
+import argparse
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+import numpy as np
+from PIL import Image
+
+
+# 图片对类型 -> 是否应检测到变化
+PAIR_KINDS = {
+    "identical": False,  # 同一文件内容
+    "noise": False,      # 传感器噪声和JPEG压缩差异
+    "lighting": False,   # 整体亮度变化
+    "object": True       # 插入一个物体
+}
+DEFAULT_RESOLUTIONS = ((640, 480), (1280, 720), (1920, 1080))
+
+
+def _scene(width: int, height: int, rng: np.random.Generator) -> np.ndarray:
+    """平滑渐变背景加若干矩形块，近似监控画面中的静态场景"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    scene = np.stack([
+        x / width * 200 + 20,
+        y / height * 180 + 30,
+        (x + y) % 400 / 400 * 150 + 50
+    ], axis=-1)
+    for _ in range(6):
+        w, h = int(width * rng.uniform(0.05, 0.2)), int(height * rng.uniform(0.05, 0.2))
+        x0, y0 = int(rng.integers(0, width - w)), int(rng.integers(0, height - h))
+        scene[y0:y0 + h, x0:x0 + w] = rng.uniform(40, 220, size=3)
+    return scene
+
+
+def _capture(scene: np.ndarray, rng: np.random.Generator, sigma: float = 4.0, shift: float = 0.0) -> Image.Image:
+    """模拟一次拍摄：加亮度偏移和高斯噪声"""
+    frame = scene + shift + rng.normal(0, sigma, scene.shape)
+    return Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8))
+
+
+def _insert_object(scene: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """在场景中放入一个约占画面2%的深色物体"""
+    height, width = scene.shape[:2]
+    w, h = max(8, int(width * 0.1)), max(8, int(height * 0.2))
+    x0, y0 = int(rng.integers(0, width - w)), int(rng.integers(0, height - h))
+    changed = scene.copy()
+    changed[y0:y0 + h, x0:x0 + w] = (30, 30, 30)
+    return changed
+
+
+def generate_pairs(output_dir: str, resolutions: Sequence[Tuple[int, int]] = DEFAULT_RESOLUTIONS,
+                   kinds: Sequence[str] = tuple(PAIR_KINDS), seed: int = 0,
+                   quality: int = 85) -> List[Dict[str, Any]]:
+    """生成合成图片对并写入清单manifest.json，返回清单内容
+
+    每个图片对包含id、kind、width、height、image1_path、image2_path和expected_change。
+    相同的seed生成相同的图片。
+    """
+    unknown = set(kinds) - set(PAIR_KINDS)
+    if unknown:
+        raise ValueError(f"未知的图片对类型: {', '.join(sorted(unknown))}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    pairs = []
+    for width, height in resolutions:
+        scene = _scene(width, height, rng)
+        for kind in kinds:
+            pair_id = f"{kind}_{width}x{height}"
+            image1_path = os.path.join(output_dir, f"{pair_id}_1.jpg")
+            image2_path = os.path.join(output_dir, f"{pair_id}_2.jpg")
+            first = _capture(scene, rng)
+            first.save(image1_path, quality=quality)
+
+            if kind == "identical":
+                first.save(image2_path, quality=quality)
+            elif kind == "noise":
+                _capture(scene, rng).save(image2_path, quality=quality)
+            elif kind == "lighting":
+                _capture(scene, rng, shift=25.0).save(image2_path, quality=quality)
+            else:
+                _capture(_insert_object(scene, rng), rng).save(image2_path, quality=quality)
+
+            pairs.append({
+                "id": pair_id,
+                "kind": kind,
+                "width": width,
+                "height": height,
+                "image1_path": image1_path,
+                "image2_path": image2_path,
+                "expected_change": PAIR_KINDS[kind]
+            })
+
+    with open(os.path.join(output_dir, "manifest.json"), "w", encoding="utf-8") as manifest:
+        json.dump(pairs, manifest, ensure_ascii=False, indent=2)
+    return pairs
+
+
+def load_pairs(output_dir: str) -> List[Dict[str, Any]]:
+    with open(os.path.join(output_dir, "manifest.json"), encoding="utf-8") as manifest:
+        return json.load(manifest)
+
+
+def parse_resolutions(value: str) -> List[Tuple[int, int]]:
+    """解析"640x480,1920x1080"形式的分辨率列表"""
+    resolutions = []
+    for item in value.split(","):
+        width, height = item.lower().split("x")
+        resolutions.append((int(width), int(height)))
+    return resolutions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="生成基准测试用的合成图片对")
+    parser.add_argument("output_dir")
+    parser.add_argument("--resolutions", default="640x480,1280x720,1920x1080")
+    parser.add_argument("--kinds", default=",".join(PAIR_KINDS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    pairs = generate_pairs(args.output_dir, parse_resolutions(args.resolutions),
+                           args.kinds.split(","), args.seed)
+    print(f"已生成 {len(pairs)} 个图片对: {os.path.join(args.output_dir, 'manifest.json')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,29 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
+import logging
 
 from app.core.config import settings
-from app.models.database import create_tables
+from app.models.database import create_tables, SessionLocal
 from app.api.analysis import router as analysis_router
+from app.services.ollama_service import ollama_service
+from app.core.workers import shutdown_workers
+from app.core.metrics import registry, MetricsMiddleware
+from app.services.job_service import job_service
+from app.services.record_writer import record_writer
+from app.services.stats_service import stats_service
+
+# 日志配置（DEBUG级别输出各分析阶段的详细信息）
+logging.basicConfig(
+    level=settings.log_level.upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+# httpx在INFO级别记录每个请求，Ollama调用已有指标和追踪
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+logger = logging.getLogger(__name__)
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -26,6 +44,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求指标（进行中的请求数、各路由耗时）
+app.add_middleware(MetricsMiddleware)
+
 # 挂载静态文件
 if os.path.exists(settings.upload_dir):
     app.mount("/uploads", StaticFiles(directory=settings.upload_dir), name="uploads")
@@ -37,9 +58,28 @@ app.include_router(analysis_router)
 @app.on_event("startup")
 async def startup_event():
     create_tables()
-    print(f"🚀 {settings.app_name} 启动成功")
-    print(f"📊 API文档: http://localhost:8000/docs")
-    print(f"🔗 Ollama服务: {settings.ollama_base_url}")
+    db = SessionLocal()
+    try:
+        stats_service.ensure_built(db)
+    finally:
+        db.close()
+    record_writer.start()
+    ollama_service.start()
+    # 预热模型并定期检查是否被卸载，避免空闲后的第一个请求承担模型加载耗时
+    ollama_service.model_manager.start()
+    job_service.recover()
+    logger.info("%s 启动成功", settings.app_name)
+    logger.info("API文档: http://localhost:8000/docs")
+    logger.info("Ollama服务: %s", ", ".join(endpoint.url for endpoint in ollama_service.pool.endpoints))
+
+
+# 关闭时停止异步任务，写入队列中的分析记录，停止Ollama健康检查和模型管理并释放连接池和CPU工作池
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_service.shutdown()
+    await record_writer.close()
+    await ollama_service.close()
+    shutdown_workers()
 
 
 @app.get("/")
@@ -63,6 +103,12 @@ async def health():
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus指标"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,32 @@
+import os
+import tempfile
+
+# 配置在导入app模块时读取，测试使用独立的临时目录，不触碰本地数据库、上传目录和缓存
+_workdir = tempfile.mkdtemp(prefix="image_comparison_tests_")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{_workdir}/test.db",
+    UPLOAD_DIR=os.path.join(_workdir, "uploads"),
+    PERSIST_JOURNAL_PATH=os.path.join(_workdir, "persist_journal.jsonl"),
+    VLM_CACHE_ENABLED="false",
+    VLM_CACHE_PATH=os.path.join(_workdir, "vlm_cache.db"),
+    OLLAMA_HEALTH_INTERVAL="0",
+    OLLAMA_MODEL_CHECK_INTERVAL="0",
+    OLLAMA_BASE_URL="http://127.0.0.1:9"
+)
+
+import pytest
+from app.models.database import create_tables, SessionLocal
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _tables():
+    create_tables()
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,16 @@
+import asyncio
+from benchmarks.synthetic import generate_pairs
+from app.services.analysis_service import analysis_service
+
+
+def test_expired_budget_returns_degraded_result_without_false_alert(tmp_path):
+    pair = generate_pairs(str(tmp_path), [(320, 240)], ["object"])[0]
+
+    result = asyncio.run(analysis_service.analyze_images(
+        pair["image1_path"], pair["image2_path"], 0.8, latency_budget=1e-6
+    ))
+
+    assert result.degraded
+    assert result.degraded_reason == "budget_exhausted"
+    assert result.escalation.reason == "budget_exhausted"
+    assert result.alert_level != "error"
@@ -0,0 +1,144 @@
+import time
+import asyncio
+from collections import deque
+import pytest
+from app.core.config import settings
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.services.ollama_service import OllamaService, VLMUnavailableError
+
+
+def make_breaker(**overrides):
+    options = dict(
+        window=60.0, min_calls=4, failure_rate=0.5, slow_call_seconds=10.0, slow_call_rate=0.8,
+        open_seconds=30.0, half_open_calls=1
+    )
+    options.update(overrides)
+    return CircuitBreaker("test", **options)
+
+
+def trip(breaker, calls=4):
+    for _ in range(calls):
+        breaker.before_call()
+        breaker.record(False, 0.1)
+
+
+def expire_open(breaker):
+    breaker._opened_at = time.monotonic() - breaker.open_seconds
+
+
+def test_stays_closed_below_min_calls():
+    breaker = make_breaker()
+    trip(breaker, calls=3)
+    assert breaker.state == "closed"
+
+
+def test_opens_on_failure_rate_and_rejects():
+    breaker = make_breaker()
+    breaker.record(True, 0.1)
+    breaker.record(True, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.state == "closed"
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_opens_on_slow_call_rate():
+    breaker = make_breaker(slow_call_rate=0.75)
+    for _ in range(3):
+        breaker.record(True, 12.0)
+    breaker.record(True, 0.1)
+    assert breaker.state == "open"
+
+
+def test_half_open_admits_limited_probes_and_closes_on_success():
+    breaker = make_breaker()
+    trip(breaker)
+    expire_open(breaker)
+    assert breaker.state == "half_open"
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(True, 0.1)
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_half_open_failure_reopens():
+    breaker = make_breaker()
+    trip(breaker)
+    expire_open(breaker)
+    breaker.before_call()
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+
+
+def test_release_returns_probe_slot():
+    breaker = make_breaker()
+    trip(breaker)
+    expire_open(breaker)
+    breaker.before_call()
+    breaker.release()
+    breaker.before_call()
+    assert breaker.state == "half_open"
+
+
+def test_old_calls_leave_the_window():
+    breaker = make_breaker(window=1.0)
+    for _ in range(3):
+        breaker.record(False, 0.1)
+    breaker._calls = deque((moment - 5.0, failed, slow) for moment, failed, slow in breaker._calls)
+    breaker.record(False, 0.1)
+    assert breaker.state == "closed"
+
+
+def test_disabled_breaker_never_rejects():
+    breaker = make_breaker(enabled=False)
+    trip(breaker, calls=10)
+    breaker.before_call()
+    assert breaker.state == "closed"
+
+
+def test_call_timeout_bounded_by_slow_call_threshold():
+    assert make_breaker(slow_call_seconds=10.0, timeout_factor=3.0).call_timeout(600.0) == 30.0
+    assert make_breaker(slow_call_seconds=10.0, timeout_factor=3.0).call_timeout(5.0) == 5.0
+    assert make_breaker(timeout_factor=0.0).call_timeout(600.0) == 600.0
+    assert make_breaker(enabled=False, timeout_factor=3.0).call_timeout(600.0) == 600.0
+
+
+def test_hung_backend_times_out_and_opens_breaker(monkeypatch):
+    async def scenario():
+        connections = []
+
+        async def hang(reader, writer):
+            # 接受连接后永不响应
+            connections.append(writer)
+            await asyncio.sleep(3600)
+
+        server = await asyncio.start_server(hang, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(settings, "ollama_endpoints", [])
+        monkeypatch.setattr(settings, "ollama_base_url", f"http://127.0.0.1:{port}")
+        monkeypatch.setattr(settings, "vlm_breaker_min_calls", 2)
+        monkeypatch.setattr(settings, "vlm_breaker_slow_call_seconds", 0.05)
+        monkeypatch.setattr(settings, "vlm_breaker_timeout_factor", 2.0)
+        service = OllamaService()
+        reasons = []
+        try:
+            for _ in range(3):
+                try:
+                    await asyncio.wait_for(service._call_ollama_api("prompt", []), timeout=5)
+                except VLMUnavailableError as e:
+                    reasons.append(e.reason)
+        finally:
+            await service.close()
+            server.close()
+            for writer in connections:
+                writer.close()
+        return reasons, service.breaker.state
+
+    reasons, state = asyncio.run(scenario())
+    assert reasons == ["timeout", "timeout", "circuit_open"]
+    assert state == "open"
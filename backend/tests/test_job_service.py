@@ -0,0 +1,21 @@
+from app.models.database import AnalysisRecord
+from app.services.job_service import JobService
+
+
+def test_recover_reschedules_with_persisted_parameters(db, monkeypatch):
+    service = JobService()
+    scheduled = []
+    monkeypatch.setattr(service, "_schedule", lambda *args: scheduled.append(args))
+
+    job_id = service.submit(db, "a.png", "b.png", threshold=0.65, latency_budget=2.5)
+    # 升级前提交的任务没有保存阈值
+    legacy = AnalysisRecord(image1_path="c.png", image2_path="d.png", status="processing")
+    db.add(legacy)
+    db.commit()
+    scheduled.clear()
+
+    service.recover()
+
+    recovered = {args[0]: args for args in scheduled}
+    assert recovered[job_id] == (job_id, "a.png", "b.png", 0.65, 2.5)
+    assert recovered[legacy.id] == (legacy.id, "c.png", "d.png", 0.8, None)
@@ -0,0 +1,129 @@
+import os
+import json
+import uuid
+import asyncio
+import pytest
+from app.core.config import settings
+from app.models.database import AnalysisRecord
+from app.services import record_writer as record_writer_module
+from app.services.record_writer import RecordWriter
+
+
+def record_fields(write_key: str):
+    return {
+        "image1_path": "a.jpg", "image2_path": "b.jpg", "similarity_score": 0.5, "differences": "[]",
+        "alert_level": "info", "analysis_time": "2026-10-17T10:00:00", "processing_time": 1.0,
+        "status": "completed", "error_message": None, "write_key": write_key
+    }
+
+
+def stored_keys(db, keys):
+    db.expire_all()
+    return sorted(key for (key,) in db.query(AnalysisRecord.write_key).filter(AnalysisRecord.write_key.in_(keys)))
+
+
+@pytest.fixture
+def journal_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "journal.jsonl")
+    monkeypatch.setattr(settings, "persist_journal_path", path)
+    monkeypatch.setattr(settings, "persist_mode", "write_behind")
+    monkeypatch.setattr(settings, "persist_flush_interval", 0.01)
+    monkeypatch.setattr(record_writer_module, "_RETRY_DELAYS", (0.01,))
+    return path
+
+
+def write_journal(path, keys, torn_tail=True):
+    with open(path, "w", encoding="utf-8") as journal:
+        for key in keys:
+            journal.write(json.dumps(record_fields(key)) + "\n")
+        if torn_tail:
+            journal.write('{"image1_path": "trunc')
+
+
+def test_replay_writes_orphaned_journals_once(journal_path, db):
+    keys = [uuid.uuid4().hex for _ in range(3)]
+    write_journal(journal_path, keys[:2])
+    # 已退出进程遗留的带PID后缀的日志，其中一条与上面重复
+    write_journal(journal_path + ".99999", keys[1:])
+
+    RecordWriter().replay_journal()
+
+    assert stored_keys(db, keys) == sorted(keys)
+    assert not os.path.exists(journal_path)
+    assert not os.path.exists(journal_path + ".99999")
+
+
+@pytest.mark.skipif(record_writer_module.fcntl is None, reason="需要文件锁")
+def test_replay_skips_journal_held_by_live_worker(journal_path, db):
+    key = uuid.uuid4().hex
+    live_path = journal_path + ".88888"
+    write_journal(live_path, [key], torn_tail=False)
+    with open(live_path, "a") as live:
+        record_writer_module.fcntl.flock(live.fileno(), record_writer_module.fcntl.LOCK_EX)
+        RecordWriter().replay_journal()
+        assert stored_keys(db, [key]) == []
+        assert os.path.exists(live_path)
+
+
+def test_write_behind_commits_and_removes_own_journal(journal_path, db):
+    keys = [uuid.uuid4().hex for _ in range(5)]
+
+    async def scenario():
+        writer = RecordWriter()
+        writer.start()
+        for key in keys:
+            await writer.submit(record_fields(key))
+        assert os.path.exists(writer._own_journal_path())
+        await writer.close()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert stored_keys(db, keys) == sorted(keys)
+    assert not os.path.exists(writer._own_journal_path())
+
+
+def test_failed_batch_is_rewritten_and_journal_truncated(journal_path, db):
+    keys = [uuid.uuid4().hex for _ in range(2)]
+
+    async def scenario():
+        writer = RecordWriter()
+        write_batch = writer._write_batch
+        failures = {"remaining": 2}
+
+        def flaky(batch):
+            if failures["remaining"]:
+                failures["remaining"] -= 1
+                raise RuntimeError("database is locked")
+            write_batch(batch)
+
+        writer._write_batch = flaky
+        writer.start()
+        await writer.submit(record_fields(keys[0]))
+        await asyncio.sleep(0.2)
+        assert writer._journal_dirty
+        assert os.path.getsize(writer._own_journal_path()) > 0
+
+        await writer.submit(record_fields(keys[1]))
+        await asyncio.sleep(0.2)
+        dirty, size = writer._journal_dirty, os.path.getsize(writer._own_journal_path())
+        await writer.close()
+        return dirty, size
+
+    dirty, size = asyncio.run(scenario())
+    assert not dirty
+    assert size == 0
+    assert stored_keys(db, keys) == sorted(keys)
+
+
+def test_queue_full_falls_back_to_direct_write(journal_path, monkeypatch, db):
+    monkeypatch.setattr(settings, "persist_queue_size", 1)
+    keys = [uuid.uuid4().hex for _ in range(10)]
+
+    async def scenario():
+        writer = RecordWriter()
+        writer.start()
+        await asyncio.gather(*(writer.submit(record_fields(key)) for key in keys))
+        await writer.close()
+
+    asyncio.run(scenario())
+    assert stored_keys(db, keys) == sorted(keys)
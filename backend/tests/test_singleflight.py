@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+from app.core.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"value": 42}
+
+        results = await asyncio.gather(*(flight.run("key", compute) for _ in range(5)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert calls == 1
+    assert [joined for _, joined, _ in results] == [False, True, True, True, True]
+    assert all(shared for _, _, shared in results)
+    assert all(result is results[0][0] for result, _, _ in results)
+    assert flight.in_flight() == 0
+
+
+def test_sequential_calls_recompute():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        first = await flight.run("key", compute)
+        second = await flight.run("key", compute)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == (1, False, False)
+    assert second == (2, False, False)
+
+
+def test_different_keys_do_not_join():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def compute(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        return await asyncio.gather(flight.run("a", lambda: compute(1)), flight.run("b", lambda: compute(2)))
+
+    assert asyncio.run(scenario()) == [(1, False, False), (2, False, False)]
+
+
+def test_exception_propagates_to_all_waiters():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*(flight.run("key", compute) for _ in range(3)), return_exceptions=True)
+        return flight, results
+
+    flight, results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.in_flight() == 0
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        leader = asyncio.create_task(flight.run("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.run("key", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == ("done", True, True)
+
+
+def test_computation_cancelled_when_last_waiter_cancels():
+    async def scenario():
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        caller = asyncio.create_task(flight.run("key", compute))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.sleep(0)
+        return flight.in_flight()
+
+    assert asyncio.run(scenario()) == 0
@@ -0,0 +1,30 @@
+from datetime import datetime
+import pytest
+from app.models.database import StatsRollup
+from app.services import stats_service as stats_module
+from app.services.stats_service import StatsService
+
+
+def rollup(db, start, key):
+    return db.query(StatsRollup).filter(
+        StatsRollup.granularity == "hour",
+        StatsRollup.dimension == "alert_level",
+        StatsRollup.bucket_start == start,
+        StatsRollup.key == key
+    ).one()
+
+
+@pytest.mark.parametrize("upsert", [True, False])
+def test_apply_merges_deltas_into_existing_bucket(db, monkeypatch, upsert):
+    if not upsert:
+        # 不支持UPSERT的数据库走先更新后插入的路径
+        monkeypatch.setattr(stats_module, "_UPSERT_INSERTS", {})
+    service = StatsService()
+    start = datetime(2024, 1, 1, 10 if upsert else 11)
+
+    service._apply(db, {("hour", "alert_level", start, "warning"): [2, 1.5]})
+    service._apply(db, {("hour", "alert_level", start, "warning"): [-1, -0.5]})
+    db.commit()
+
+    row = rollup(db, start, "warning")
+    assert (row.count, row.score_sum) == (1, 1.0)
@@ -0,0 +1,71 @@
+import json
+from app.services.stream_parser import IncrementalDifferenceParser, is_error_difference, difference_confidence
+
+
+RESPONSE = json.dumps({
+    "similarity_score": 0.4,
+    "alert_level": "error",
+    "differences": [
+        {"type": "person_detected", "description": "门口有人 {进入}", "confidence": 0.95, "severity": "high"},
+        {"type": "object_moved", "description": "椅子被移动 \"左侧\"", "confidence": 0.7, "severity": "low"}
+    ],
+    "summary": "检测到人员"
+}, ensure_ascii=False)
+
+
+def feed_in_chunks(text, size):
+    parser = IncrementalDifferenceParser()
+    events = []
+    for start in range(0, len(text), size):
+        events.extend(parser.feed(text[start:start + size]))
+    return parser, events
+
+
+def test_events_independent_of_chunking():
+    expected = json.loads(RESPONSE)
+    for size in (1, 3, 17, len(RESPONSE)):
+        parser, events = feed_in_chunks(RESPONSE, size)
+        assert events[0] == ("alert_level", "error")
+        assert [value for kind, value in events if kind == "difference"] == expected["differences"]
+        assert parser.buffer == RESPONSE
+
+
+def test_difference_emitted_as_soon_as_object_closes():
+    parser = IncrementalDifferenceParser()
+    head = '{"differences": [{"type": "a", "confidence": 0.9}'
+    assert parser.feed(head) == [("difference", {"type": "a", "confidence": 0.9})]
+    assert parser.feed(', {"type": "b"') == []
+    assert parser.feed('}]}') == [("difference", {"type": "b"})]
+
+
+def test_nested_objects_and_text_after_array_are_ignored():
+    parser = IncrementalDifferenceParser()
+    events = parser.feed('{"differences": [{"type": "a", "meta": {"x": 1}}], "extra": [{"type": "z"}]}')
+    assert events == [("difference", {"type": "a", "meta": {"x": 1}})]
+
+
+def test_invalid_objects_are_skipped():
+    parser = IncrementalDifferenceParser()
+    events = parser.feed('{"differences": [{"type": broken}, {"type": "ok"}]}')
+    assert events == [("difference", {"type": "ok"})]
+    assert parser.differences == [{"type": "ok"}]
+
+
+def test_markdown_fenced_output():
+    _, events = feed_in_chunks("```json\n" + RESPONSE + "\n```", 5)
+    assert len([kind for kind, _ in events if kind == "difference"]) == 2
+
+
+def test_is_error_difference():
+    assert is_error_difference({"type": "person_detected", "confidence": 0.9})
+    assert is_error_difference({"type": "object_moved", "severity": "critical", "confidence": "0.85"})
+    assert not is_error_difference({"type": "person_detected", "confidence": 0.8})
+    assert not is_error_difference({"type": "object_moved", "severity": "low", "confidence": 0.99})
+    assert not is_error_difference({"type": "person_detected", "confidence": "high"})
+
+
+def test_difference_confidence_coerces_model_output():
+    assert difference_confidence({"confidence": "0.5"}) == 0.5
+    assert difference_confidence({"confidence": None}) == 0.0
+    assert difference_confidence({"confidence": [1]}) == 0.0
+    assert difference_confidence({}) == 0.0
@@ -0,0 +1,116 @@
+import io
+import os
+import asyncio
+import numpy as np
+import pytest
+from PIL import Image
+from app.core.config import settings
+from app.models.database import StoredFile
+from app.services.upload_store import UploadStore, UploadRejected
+
+
+class FakeUpload:
+    """模拟UploadFile的分块读取"""
+
+    def __init__(self, data: bytes):
+        self._buffer = io.BytesIO(data)
+
+    async def read(self, size: int) -> bytes:
+        return self._buffer.read(size)
+
+
+def png_bytes(seed: int, size=(64, 48)) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "upload_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "upload_chunk_size", 1024)
+    return UploadStore()
+
+
+def save(store, db, data):
+    return asyncio.run(store.save(db, FakeUpload(data)))
+
+
+def ref_count(db, store, path):
+    db.expire_all()
+    stored = db.query(StoredFile).filter(StoredFile.content_hash == store.content_hash_of(path)).first()
+    return None if stored is None else stored.ref_count
+
+
+def test_identical_content_is_stored_once(store, db):
+    data = png_bytes(1)
+    path1 = save(store, db, data)
+    path2 = save(store, db, data)
+    assert path1 == path2
+    assert path1.endswith(".png") and os.path.exists(path1)
+    assert ref_count(db, store, path1) == 2
+    assert os.listdir(os.path.join(store.root, "tmp")) == []
+
+
+def test_file_removed_only_when_last_reference_released(store, db):
+    path = save(store, db, png_bytes(2))
+    store.retain(db, path)
+    assert ref_count(db, store, path) == 2
+
+    store.release(db, path)
+    assert ref_count(db, store, path) == 1
+    assert os.path.exists(path)
+
+    store.release(db, path)
+    assert ref_count(db, store, path) is None
+    assert not os.path.exists(path)
+
+    # 多余的释放不会出错，也不会产生负计数
+    store.release(db, path)
+    assert ref_count(db, store, path) is None
+
+
+def test_content_reuploaded_after_deletion(store, db):
+    data = png_bytes(3)
+    path = save(store, db, data)
+    store.release(db, path)
+    assert save(store, db, data) == path
+    assert os.path.exists(path)
+    assert ref_count(db, store, path) == 1
+
+
+def test_release_ignores_files_outside_the_store(store, db, tmp_path):
+    outside = tmp_path / "local.png"
+    outside.write_bytes(png_bytes(4))
+    store.release(db, str(outside))
+    assert outside.exists()
+
+    # 文件名形如内容哈希但不在分片目录中
+    fake = tmp_path / ("ab" * 32 + ".png")
+    fake.write_bytes(b"x")
+    assert store.content_hash_of(str(fake)) is None
+    store.release(db, str(fake))
+    assert fake.exists()
+
+
+def test_rejects_unrecognized_and_empty_uploads(store, db):
+    with pytest.raises(UploadRejected):
+        save(store, db, b"not an image" * 100)
+    with pytest.raises(UploadRejected):
+        save(store, db, b"")
+    assert os.listdir(os.path.join(store.root, "tmp")) == []
+
+
+def test_rejects_oversized_uploads(store, db):
+    store.max_bytes = 1000
+    with pytest.raises(UploadRejected) as error:
+        save(store, db, png_bytes(5, size=(200, 200)))
+    assert error.value.status_code == 413
+
+
+def test_rejects_too_many_pixels(store, db):
+    store.max_pixels = 100
+    with pytest.raises(UploadRejected) as error:
+        save(store, db, png_bytes(6))
+    assert error.value.status_code == 413
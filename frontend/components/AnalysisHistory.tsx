@@ -1,6 +1,6 @@
 'use client'
 
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import { Button } from '@/components/ui/button'
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { Badge } from '@/components/ui/badge'
@@ -26,8 +26,9 @@ interface AnalysisRecord {
   image2_path: string
   similarity_score: number
   alert_level: string
-  created_at: string
+  analysis_time: string
   processing_time: number
+  status: string
   differences: Array<{
     type: string
     description: string
@@ -35,6 +36,8 @@ interface AnalysisRecord {
   }>
 }
 
+const PAGE_SIZE = 10
+
 interface AnalysisHistoryProps {
   isDarkMode?: boolean
 }
@@ -42,23 +45,44 @@ interface AnalysisHistoryProps {
 const AnalysisHistory: React.FC<AnalysisHistoryProps> = ({ isDarkMode = false }) => {
   const [records, setRecords] = useState<AnalysisRecord[]>([])
   const [loading, setLoading] = useState(true)
+  // 键集分页：cursors[i] 为第 i+1 页的游标，第一页为空
+  const [cursors, setCursors] = useState<Array<string | null>>([null])
   const [currentPage, setCurrentPage] = useState(1)
-  const [totalPages, setTotalPages] = useState(1)
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [total, setTotal] = useState(0)
   const [selectedRecord, setSelectedRecord] = useState<AnalysisRecord | null>(null)
   const [searchTerm, setSearchTerm] = useState('')
   const [filterLevel, setFilterLevel] = useState('all')
 
-  const fetchHistory = async (page: number = 1) => {
+  const totalPages = Math.max(1, Math.ceil(total / PAGE_SIZE))
+  const filterInitialized = useRef(false)
+
+  const fetchHistory = async (page: number = currentPage) => {
     setLoading(true)
     try {
-      const response = await fetch(`/api/v1/analysis-history?page=${page}&limit=10`)
+      const params = new URLSearchParams({ limit: String(PAGE_SIZE) })
+      const cursor = cursors[page - 1]
+      if (cursor) params.set('cursor', cursor)
+      if (filterLevel !== 'all') params.set('alert_level', filterLevel)
+
+      const response = await fetch(`/api/v1/analysis-history?${params.toString()}`)
       if (!response.ok) {
         throw new Error('Failed to fetch history records')
       }
       const data = await response.json()
-      if (data.status === 'success') {
-        setRecords(data.data.records || [])
-        setTotalPages(Math.ceil((data.data.total || 0) / 10))
+      setRecords((data.items || []).map((item: any) => ({
+        ...item,
+        id: String(item.id),
+        differences: item.differences ? JSON.parse(item.differences) : []
+      })))
+      setNextCursor(data.next_cursor)
+      setTotal(data.total || 0)
+      if (data.next_cursor) {
+        setCursors(prev => {
+          const updated = prev.slice(0, page)
+          updated[page] = data.next_cursor
+          return updated
+        })
       }
     } catch (error) {
       console.error('Failed to fetch history records:', error)
@@ -71,6 +95,20 @@ const AnalysisHistory: React.FC<AnalysisHistoryProps> = ({ isDarkMode = false })
     fetchHistory(currentPage)
   }, [currentPage])
 
+  // 过滤条件变化时从第一页重新加载
+  useEffect(() => {
+    if (!filterInitialized.current) {
+      filterInitialized.current = true
+      return
+    }
+    setCursors([null])
+    if (currentPage === 1) {
+      fetchHistory(1)
+    } else {
+      setCurrentPage(1)
+    }
+  }, [filterLevel])
+
   const handleDelete = async (id: string) => {
     if (!confirm('Are you sure you want to delete this record?')) return
     
@@ -113,9 +151,7 @@ const AnalysisHistory: React.FC<AnalysisHistoryProps> = ({ isDarkMode = false })
   }
 
   const filteredRecords = records.filter(record => {
-    const matchesSearch = record.id.toLowerCase().includes(searchTerm.toLowerCase())
-    const matchesFilter = filterLevel === 'all' || record.alert_level === filterLevel
-    return matchesSearch && matchesFilter
+    return record.id.toLowerCase().includes(searchTerm.toLowerCase())
   })
 
   return (
@@ -193,7 +229,7 @@ const AnalysisHistory: React.FC<AnalysisHistoryProps> = ({ isDarkMode = false })
                         <p className={`text-sm ${isDarkMode ? 'text-gray-400' : 'text-gray-500'}`}>
                           Similarity: {(record.similarity_score * 100).toFixed(1)}% | 
                           Differences: {record.differences.length} | 
-                          Time: {new Date(record.created_at).toLocaleString()}
+                          Time: {new Date(record.analysis_time).toLocaleString()}
                         </p>
                       </div>
                     </div>
@@ -226,7 +262,7 @@ const AnalysisHistory: React.FC<AnalysisHistoryProps> = ({ isDarkMode = false })
       </Card>
 
       {/* 分页 */}
-      {totalPages > 1 && (
+      {(currentPage > 1 || nextCursor) && (
         <Card className={`shadow-sm border-0 ${isDarkMode ? 'bg-gray-700' : 'bg-white'}`}>
           <CardContent className="p-3">
             <div className="flex items-center justify-between">
@@ -245,8 +281,8 @@ const AnalysisHistory: React.FC<AnalysisHistoryProps> = ({ isDarkMode = false })
                   Previous
                 </Button>
                 <Button
-                  onClick={() => setCurrentPage(Math.min(totalPages, currentPage + 1))}
-                  disabled={currentPage === totalPages}
+                  onClick={() => setCurrentPage(currentPage + 1)}
+                  disabled={!nextCursor}
                   variant="outline"
                   size="sm"
                   className={`${isDarkMode ? 'border-gray-600 text-gray-300 hover:bg-gray-600' : 'border-gray-300 text-gray-700 hover:bg-gray-50'}`}
@@ -294,13 +330,13 @@ const AnalysisHistory: React.FC<AnalysisHistoryProps> = ({ isDarkMode = false })
                 <div>
                   <span className={`text-sm font-medium ${isDarkMode ? 'text-gray-300' : 'text-gray-700'}`}>Processing Time:</span>
                   <p className={`${isDarkMode ? 'text-gray-300' : 'text-gray-600'}`}>
-                    {selectedRecord.processing_time.toFixed(1)} seconds
+                    {(selectedRecord.processing_time ?? 0).toFixed(1)} seconds
                   </p>
                 </div>
                 <div>
                   <span className={`text-sm font-medium ${isDarkMode ? 'text-gray-300' : 'text-gray-700'}`}>Created At:</span>
                   <p className={`${isDarkMode ? 'text-gray-300' : 'text-gray-600'}`}>
-                    {new Date(selectedRecord.created_at).toLocaleString()}
+                    {new Date(selectedRecord.analysis_time).toLocaleString()}
                   </p>
                 </div>
               </div>
@@ -14,14 +14,17 @@ import {
   Activity
 } from 'lucide-react'
 
+interface Difference {
+  type: string
+  description: string
+  confidence: number
+  bbox?: number[]
+  severity?: string
+}
+
 interface AnalysisResult {
   similarity_score: number
-  differences: Array<{
-    type: string
-    description: string
-    confidence: number
-    bbox?: number[]
-  }>
+  differences: Difference[]
   alert_level: string
   alert_details?: {
     severity: string
@@ -35,6 +38,8 @@ interface AnalysisResult {
   analysis_summary: string
   analysis_time: string
   processing_time: number
+  degraded?: boolean
+  degraded_reason?: string
 }
 
 interface ImageComparisonProps {
@@ -50,6 +55,9 @@ const ImageComparison: React.FC<ImageComparisonProps> = ({ isDarkMode = false })
   const [isAnalyzing, setIsAnalyzing] = useState(false)
   const [result, setResult] = useState<AnalysisResult | null>(null)
   const [error, setError] = useState<string>('')
+  const [streamMode, setStreamMode] = useState(true)
+  const [liveDifferences, setLiveDifferences] = useState<Difference[]>([])
+  const [earlyAlert, setEarlyAlert] = useState<string>('')
 
   const handleImageUpload = (file: File, setImage: (file: File) => void, setPreview: (url: string) => void) => {
     if (file.type.startsWith('image/')) {
@@ -59,6 +67,58 @@ const ImageComparison: React.FC<ImageComparisonProps> = ({ isDarkMode = false })
     }
   }
 
+  const handleStreamEvent = (event: string, data: any) => {
+    switch (event) {
+      case 'alert':
+        setEarlyAlert(data.alert_level)
+        break
+      case 'difference':
+        setLiveDifferences(prev => [...prev, data])
+        break
+      case 'result':
+        setResult(data)
+        break
+      case 'error':
+        throw new Error(data.detail || 'Analysis failed')
+    }
+  }
+
+  const analyzeStream = async (formData: FormData) => {
+    const response = await fetch('/api/v1/compare-images/stream', {
+      method: 'POST',
+      body: formData,
+    })
+
+    if (!response.ok || !response.body) {
+      throw new Error(`Analysis request failed: HTTP ${response.status}: ${response.statusText}`)
+    }
+
+    // 解析Server-Sent Events：事件之间以空行分隔
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+
+      let separator = buffer.indexOf('\n\n')
+      while (separator !== -1) {
+        const rawEvent = buffer.slice(0, separator)
+        buffer = buffer.slice(separator + 2)
+        separator = buffer.indexOf('\n\n')
+
+        let event = 'message'
+        let data = ''
+        for (const line of rawEvent.split('\n')) {
+          if (line.startsWith('event:')) event = line.slice(6).trim()
+          else if (line.startsWith('data:')) data += line.slice(5).trim()
+        }
+        if (data) handleStreamEvent(event, JSON.parse(data))
+      }
+    }
+  }
+
   const handleAnalyze = async () => {
     if (!image1 || !image2) {
       setError('Please select two images')
@@ -68,6 +128,8 @@ const ImageComparison: React.FC<ImageComparisonProps> = ({ isDarkMode = false })
     setIsAnalyzing(true)
     setError('')
     setResult(null)
+    setLiveDifferences([])
+    setEarlyAlert('')
 
     try {
       const formData = new FormData()
@@ -77,6 +139,11 @@ const ImageComparison: React.FC<ImageComparisonProps> = ({ isDarkMode = false })
       formData.append('enable_alert', 'true')
       formData.append('save_results', 'true')
 
+      if (streamMode) {
+        await analyzeStream(formData)
+        return
+      }
+
       const response = await fetch('/api/v1/compare-images', {
         method: 'POST',
         body: formData,
@@ -305,6 +372,15 @@ const ImageComparison: React.FC<ImageComparisonProps> = ({ isDarkMode = false })
                 </div>
               </div>
             </div>
+            <label className={`flex items-center gap-2 text-sm ${isDarkMode ? 'text-gray-300' : 'text-gray-700'}`}>
+              <input
+                type="checkbox"
+                checked={streamMode}
+                onChange={(e) => setStreamMode(e.target.checked)}
+                className="h-4 w-4"
+              />
+              Stream results (show alerts as soon as they are detected)
+            </label>
           </div>
         </CardContent>
       </Card>
@@ -342,6 +418,33 @@ const ImageComparison: React.FC<ImageComparisonProps> = ({ isDarkMode = false })
         </Card>
       )}
 
+      {/* 流式分析中的实时结果 */}
+      {isAnalyzing && streamMode && (earlyAlert || liveDifferences.length > 0) && (
+        <Card className={`shadow-sm border-0 ${isDarkMode ? 'bg-gray-700' : 'bg-white'}`}>
+          <CardHeader className="pb-2">
+            <div className="flex items-center justify-between">
+              <CardTitle className={`text-base flex items-center gap-2 ${isDarkMode ? 'text-white' : 'text-gray-800'}`}>
+                {earlyAlert && getAlertIcon(earlyAlert)}
+                Live Analysis
+              </CardTitle>
+              {earlyAlert && getAlertBadge(earlyAlert)}
+            </div>
+          </CardHeader>
+          <CardContent className="pt-0">
+            <div className="space-y-2">
+              {liveDifferences.map((diff, index) => (
+                <div key={index} className={`flex items-center justify-between p-3 ${isDarkMode ? 'bg-gray-800' : 'bg-gray-50'} rounded-lg border ${isDarkMode ? 'border-gray-600' : 'border-gray-200'}`}>
+                  <span className={`text-sm font-semibold ${isDarkMode ? 'text-white' : 'text-gray-900'} capitalize`}>
+                    {diff.type.replace('_', ' ')}
+                  </span>
+                  <span className={`text-sm ${isDarkMode ? 'text-gray-300' : 'text-gray-600'} max-w-xs truncate`}>{diff.description}</span>
+                </div>
+              ))}
+            </div>
+          </CardContent>
+        </Card>
+      )}
+
       {/* 分析结果 */}
       {result && (
         <Card className={`shadow-lg border-0 ${isDarkMode ? 'bg-gray-700' : 'bg-white'} animate-fade-in`}>
@@ -410,6 +513,16 @@ const ImageComparison: React.FC<ImageComparisonProps> = ({ isDarkMode = false })
                 </div>
               </div>
 
+              {/* 降级提示 - VLM不可用时结果仅基于本地指标 */}
+              {result.degraded && (
+                <div className={`flex items-center gap-3 p-4 rounded-xl border ${isDarkMode ? 'bg-gray-800 border-yellow-700 text-yellow-300' : 'bg-yellow-50 border-yellow-300 text-yellow-800'}`}>
+                  <AlertTriangle className="h-4 w-4 flex-shrink-0" />
+                  <span className="text-sm">
+                    AI analysis unavailable ({result.degraded_reason}); this result is based on local image metrics only.
+                  </span>
+                </div>
+              )}
+
               {/* 告警详情 - 仅在严重告警时显示 */}
               {result.alert_details && result.alert_level === 'error' && (
                 <div className={`${isDarkMode ? 'bg-gray-800' : 'bg-white'} rounded-xl p-6 border ${isDarkMode ? 'border-gray-700' : 'border-gray-200'}`}>